@@ -0,0 +1,443 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-memory vCenter, for benchmarking the worker without a real vSphere lab.
+
+The fake replaces the SOAP stub that pyVmomi managed objects talk to, so the
+worker code (and ``vlab_inf_common``) run unmodified. Every property read and
+method call is one "round trip", and sleeps for ``latency`` seconds, just like a
+call to a real vCenter would block on the network. PropertyCollector queries
+also cost ``per_object`` seconds for each object they return, and are paged the
+same way vCenter pages them.
+"""
+import time
+import uuid
+import datetime
+import threading
+import itertools
+
+import ujson
+from pyVmomi import vim, vmodl
+from vlab_inf_common.vmware import vCenter
+
+
+class FakeStub(object):
+    """Stands in for ``pyVmomi.SoapAdapter.SoapStubAdapter``, and holds the inventory.
+
+    :param latency: How many seconds every call to vCenter takes
+    :type latency: Float
+
+    :param per_object: How many more seconds a PropertyCollector query takes, per object returned
+    :type per_object: Float
+
+    :param page_size: The max number of objects in one page of PropertyCollector results
+    :type page_size: Integer
+
+    :param base_dir: The name of the folder that holds every user's folder
+    :type base_dir: String
+    """
+    def __init__(self, latency=0.005, per_object=0.00002, page_size=100, base_dir='vlab'):
+        self.latency = latency
+        self.per_object = per_object
+        self.page_size = page_size
+        self.base_dir = base_dir
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._objects = {}
+        self._pages = {}
+        self.root = self._add(vim.Folder, 'group-d', name='Datacenters', childEntity=[])
+        self.datacenter = self._add(vim.Datacenter, 'datacenter', name='vLab')
+        self.vm_folder = self._add(vim.Folder, 'group-v', name='vm', childEntity=[])
+        self.net_folder = self._add(vim.Folder, 'group-n', name='network', childEntity=[])
+        self._props(self.datacenter).update(vmFolder=self.vm_folder, networkFolder=self.net_folder,
+                                            childEntity=[self.vm_folder, self.net_folder])
+        self._props(self.root)['childEntity'].append(self.datacenter)
+        self.top_folder = self.add_folder(base_dir, self.vm_folder)
+        self._objects['propertyCollector'] = {}
+        self.service_content = vim.ServiceInstanceContent(
+            rootFolder=self.root,
+            propertyCollector=vmodl.query.PropertyCollector('propertyCollector', stub=self),
+            viewManager=self._add(vim.view.ViewManager, 'ViewManager'),
+            searchIndex=self._add(vim.SearchIndex, 'SearchIndex'),
+            sessionManager=self._add(vim.SessionManager, 'SessionManager',
+                                     currentSession=vim.UserSession(key=str(uuid.uuid4()))),
+            setting=self._add(vim.option.OptionManager, 'VpxSettings', setting=[]),
+            about=vim.AboutInfo(instanceUuid=str(uuid.uuid4())))
+
+    def populate(self, users=1, vms=10, networks=2, insightiq=0.1, username='bench'):
+        """Fill the inventory with a user who owns ``vms`` VMs, and ``users``
+        other users who own a few VMs each.
+
+        :Returns: vim.Folder of ``username``
+
+        :param users: How many other users have a folder
+        :type users: Integer
+
+        :param vms: How many VMs are in the folder of ``username``
+        :type vms: Integer
+
+        :param networks: How many networks ``username`` has
+        :type networks: Integer
+
+        :param insightiq: What fraction of the VMs are InsightIQ instances
+        :type insightiq: Float
+
+        :param username: The user the benchmarks run as
+        :type username: String
+        """
+        for idx in range(users):
+            other = 'user{:05d}'.format(idx)
+            folder = self.add_folder(other, self.top_folder)
+            network = self.add_network('{}_frontend'.format(other))
+            for vm_idx in range(3):
+                self.add_vm(folder, '{}-vm{}'.format(other, vm_idx), network)
+        user_networks = [self.add_network('{}_net{}'.format(username, x)) for x in range(1, networks)]
+        user_networks.insert(0, self.add_network('{}_frontend'.format(username)))
+        folder = self.add_folder(username, self.top_folder)
+        every = int(1 / insightiq) if insightiq else 0
+        for idx in range(vms):
+            network = user_networks[idx % len(user_networks)]
+            if every and idx % every == 0:
+                self.add_insightiq(folder, 'iiq{:05d}'.format(idx), network)
+            else:
+                self.add_vm(folder, 'vm{:05d}'.format(idx), network)
+        return folder
+
+    def add_folder(self, name, parent):
+        """Make a VM folder
+
+        :Returns: vim.Folder
+        """
+        folder = self._add(vim.Folder, 'group-v', name=name, parent=parent, childEntity=[])
+        with self._lock:
+            self._props(parent)['childEntity'].append(folder)
+        return folder
+
+    def add_network(self, name):
+        """Make a network
+
+        :Returns: vim.Network
+        """
+        network = self._add(vim.Network, 'network', name=name, vm=[])
+        with self._lock:
+            self._props(self.net_folder)['childEntity'].append(network)
+        return network
+
+    def add_vm(self, folder, name, network, annotation='', power_state='poweredOn', ips=None):
+        """Make a virtual machine
+
+        :Returns: vim.VirtualMachine
+        """
+        moid = next(self._ids)
+        if ips is None:
+            ips = ['10.{}.{}.{}'.format(moid // 65536 % 256, moid // 256 % 256, moid % 256)]
+        the_vm = self._add(vim.VirtualMachine, 'vm', moid=moid,
+                           name=name,
+                           parent=folder,
+                           runtime=vim.vm.RuntimeInfo(powerState=power_state),
+                           config=vim.vm.ConfigInfo(name=name, annotation=annotation),
+                           guest=vim.vm.GuestInfo(net=[vim.vm.GuestInfo.NicInfo(ipAddress=ips)]),
+                           network=[network])
+        with self._lock:
+            self._props(folder)['childEntity'].append(the_vm)
+            self._props(network)['vm'].append(the_vm)
+        return the_vm
+
+    def add_insightiq(self, folder, name, network):
+        """Make a virtual machine that's tagged as an InsightIQ instance
+
+        :Returns: vim.VirtualMachine
+        """
+        meta = {'component': 'InsightIQ', 'created': time.time(), 'version': '4.1.2',
+                'configured': False, 'generation': 1}
+        return self.add_vm(folder, name, network, annotation=ujson.dumps(meta))
+
+    def connect(self):
+        """Log in; used as the factory of a ``SessionPool``
+
+        :Returns: FakeVCenter
+        """
+        # A real login is a handful of round trips (plus the TLS handshake)
+        self._round_trip(count=3)
+        return FakeVCenter(self)
+
+    def InvokeAccessor(self, mo, info):
+        """Read a property of a managed object"""
+        self._round_trip()
+        with self._lock:
+            props = self._objects.get(mo._moId)
+            if props is None:
+                raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+            value = props.get(info.name)
+        if isinstance(value, list):
+            return list(value)
+        return value
+
+    def InvokeMethod(self, mo, info, args):
+        """Call a method of a managed object"""
+        self._round_trip()
+        handler = getattr(self, '_{}'.format(info.wsdlName), None)
+        if handler is None:
+            raise NotImplementedError('The fake vCenter does not support {}'.format(info.wsdlName))
+        if info.wsdlName == 'WaitForUpdatesEx' and args[0]:
+            # Nothing changes behind the benchmark's back, so block like vCenter
+            # does when there's nothing to report; without holding the lock
+            options = args[1]
+            time.sleep(options.maxWaitSeconds if options is not None and options.maxWaitSeconds else 0)
+        with self._lock:
+            if mo._moId not in self._objects and not isinstance(mo, vim.ServiceInstance):
+                raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+            answer = handler(mo, *args)
+        if self.per_object and isinstance(answer, vmodl.query.PropertyCollector.RetrieveResult):
+            time.sleep(self.per_object * len(answer.objects))
+        return answer
+
+    def _round_trip(self, count=1):
+        """Block like a call to vCenter would"""
+        self.calls += count
+        if self.latency:
+            time.sleep(self.latency * count)
+
+    def _add(self, vimtype, prefix, moid=None, **props):
+        """Create a managed object"""
+        if moid is None:
+            moid = next(self._ids)
+        obj = vimtype('{}-{}'.format(prefix, moid), stub=self)
+        with self._lock:
+            self._objects[obj._moId] = props
+        return obj
+
+    def _props(self, obj):
+        """The properties of a managed object; caller must hold the lock for writes"""
+        return self._objects[obj._moId]
+
+    def _value(self, obj, path):
+        """Resolve a property path, like ``runtime.powerState``"""
+        first, _, rest = path.partition('.')
+        value = self._objects.get(obj._moId, {}).get(first)
+        for attr in rest.split('.') if rest else []:
+            value = getattr(value, attr, None)
+        return value
+
+    @staticmethod
+    def _soap_value(value):
+        """Over SOAP, lists arrive as typed arrays; empty ones are left out"""
+        if isinstance(value, list):
+            return type(value[0]).Array(value) if value else None
+        return value
+
+    def _task(self, result=None):
+        """Make a vCenter task that has already finished"""
+        moid = 'task-{}'.format(next(self._ids))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        info = vim.TaskInfo(key=moid, state=vim.TaskInfo.State.success, result=result,
+                            queueTime=now, startTime=now, completeTime=now)
+        the_task = vim.Task(moid, stub=self)
+        self._objects[moid] = {'info': info}
+        return the_task
+
+    # vSphere API methods; the lock is held when these are called
+    def _RetrieveServiceContent(self, mo):
+        return self.service_content
+
+    def _RetrievePropertiesEx(self, mo, specSet, options):
+        contents = []
+        for spec in specSet:
+            contents += self._collect(spec)
+        page_size = self.page_size
+        if options is not None and options.maxObjects:
+            page_size = min(page_size, options.maxObjects)
+        return self._page(contents, page_size)
+
+    def _ContinueRetrievePropertiesEx(self, mo, token):
+        contents, page_size = self._pages.pop(token)
+        return self._page(contents, page_size)
+
+    def _FindChild(self, mo, entity, name):
+        for child in self._objects.get(entity._moId, {}).get('childEntity', []):
+            if self._objects[child._moId].get('name') == name:
+                return child
+        return None
+
+    def _AcquireCloneTicket(self, mo):
+        return uuid.uuid4().hex
+
+    def _Logout(self, mo):
+        return None
+
+    def _CreateContainerView(self, mo, container, type, recursive):
+        found = []
+        self._walk(container, tuple(type), recursive, found)
+        view = vim.view.ContainerView('session[{}]'.format(next(self._ids)), stub=self)
+        self._objects[view._moId] = {'view': found}
+        return view
+
+    def _DestroyView(self, mo):
+        self._objects.pop(mo._moId, None)
+
+    def _CreatePropertyCollector(self, mo):
+        collector = vim.PropertyCollector('session[{}]'.format(next(self._ids)), stub=self)
+        self._objects[collector._moId] = {'filters': []}
+        return collector
+
+    def _DestroyPropertyCollector(self, mo):
+        self._objects.pop(mo._moId, None)
+
+    def _CreateFilter(self, mo, spec, partialUpdates):
+        self._objects[mo._moId]['filters'].append(spec)
+        return vmodl.query.PropertyCollector.Filter('session[{}]'.format(next(self._ids)), stub=self)
+
+    def _WaitForUpdatesEx(self, mo, version, options):
+        # The first wait reports every object the filters select, and later ones time out
+        if version:
+            return None
+        updates = []
+        for spec in self._objects[mo._moId]['filters']:
+            for content in self._collect(spec):
+                changes = [vmodl.query.PropertyCollector.Change(name=x.name, op='assign', val=x.val)
+                           for x in content.propSet]
+                updates.append(vmodl.query.PropertyCollector.ObjectUpdate(kind='enter', obj=content.obj,
+                                                                          changeSet=changes))
+        filter_update = vmodl.query.PropertyCollector.FilterUpdate(objectSet=updates)
+        return vmodl.query.PropertyCollector.UpdateSet(version='1', filterSet=[filter_update])
+
+    def _PowerOnVM_Task(self, mo, host=None):
+        self._objects[mo._moId]['runtime'] = vim.vm.RuntimeInfo(powerState='poweredOn')
+        return self._task()
+
+    def _PowerOffVM_Task(self, mo):
+        self._objects[mo._moId]['runtime'] = vim.vm.RuntimeInfo(powerState='poweredOff')
+        return self._task()
+
+    def _ReconfigVM_Task(self, mo, spec):
+        props = self._objects[mo._moId]
+        if spec.annotation is not None:
+            props['config'] = vim.vm.ConfigInfo(name=props['name'], annotation=spec.annotation)
+        return self._task()
+
+    def _Destroy_Task(self, mo):
+        props = self._objects.pop(mo._moId)
+        parent = self._objects.get(props['parent']._moId)
+        if parent is not None:
+            parent['childEntity'] = [x for x in parent['childEntity'] if x != mo]
+        for network in props.get('network', []):
+            net_props = self._objects[network._moId]
+            net_props['vm'] = [x for x in net_props['vm'] if x != mo]
+        return self._task()
+
+    def _walk(self, container, types, recursive, found):
+        """Find every object of ``types`` within ``container``"""
+        props = self._objects.get(container._moId, {})
+        children = list(props.get('childEntity', []))
+        if 'vmFolder' in props:
+            children = [props['vmFolder'], props['networkFolder']]
+        for child in children:
+            if isinstance(child, types):
+                found.append(child)
+            if recursive:
+                self._walk(child, types, recursive, found)
+
+    def _collect(self, spec):
+        """Run one PropertyCollector FilterSpec against the inventory"""
+        traversals = {}
+        for obj_spec in spec.objectSet:
+            self._named(obj_spec.selectSet, traversals)
+        selected = {}
+        for obj_spec in spec.objectSet:
+            self._select(obj_spec.obj, obj_spec.skip, obj_spec.selectSet, traversals, selected)
+        contents = []
+        for obj in selected:
+            prop_spec = [x for x in spec.propSet if isinstance(obj, x.type)]
+            if not prop_spec:
+                continue
+            prop_set = []
+            for path in prop_spec[0].pathSet:
+                value = self._soap_value(self._value(obj, path))
+                if value is not None:
+                    prop_set.append(vmodl.DynamicProperty(name=path, val=value))
+            contents.append(vmodl.query.PropertyCollector.ObjectContent(obj=obj, propSet=prop_set))
+        return contents
+
+    def _named(self, select_set, traversals):
+        """Index the TraversalSpecs by name, so a SelectionSpec can refer to one"""
+        for select in select_set or []:
+            if isinstance(select, vmodl.query.PropertyCollector.TraversalSpec) and select.name not in traversals:
+                traversals[select.name] = select
+                self._named(select.selectSet, traversals)
+
+    def _select(self, obj, skip, select_set, traversals, selected):
+        """Follow the traversal specs from ``obj``, recording every object found"""
+        if obj._moId not in self._objects:
+            return
+        if not skip:
+            selected[obj] = None
+        for select in select_set or []:
+            traversal = traversals.get(select.name, select)
+            if not isinstance(traversal, vmodl.query.PropertyCollector.TraversalSpec):
+                continue
+            if not isinstance(obj, traversal.type):
+                continue
+            children = self._value(obj, traversal.path)
+            if children is None:
+                continue
+            if not isinstance(children, list):
+                children = [children]
+            for child in children:
+                if child not in selected:
+                    self._select(child, traversal.skip, traversal.selectSet, traversals, selected)
+
+    def _page(self, contents, page_size):
+        """Split PropertyCollector results into pages, like vCenter does"""
+        result = vmodl.query.PropertyCollector.RetrieveResult(objects=contents[:page_size])
+        if len(contents) > page_size:
+            token = uuid.uuid4().hex
+            self._pages[token] = (contents[page_size:], page_size)
+            result.token = token
+        return result
+
+
+class FakeVCenter(vCenter):
+    """A ``vlab_inf_common`` vCenter object that's connected to a ``FakeStub``
+
+    :param stub: The fake vCenter to talk to
+    :type stub: FakeStub
+    """
+    def __init__(self, stub):
+        self._conn = vim.ServiceInstance('ServiceInstance', stub=stub)
+        self._base_dir = stub.base_dir
+        self._net_cache = None
+
+    def close(self):
+        self._conn.RetrieveContent().sessionManager.Logout()
+
+
+class FakeOva(object):
+    """Stands in for an opened OVA file"""
+    networks = ['VM Network']
+    size = 1024 * 1024 * 1024
+
+    def __init__(self):
+        self.on_progress = None
+
+    def close(self):
+        pass
+
+
+def deployer(stub, upload_seconds=0.0):
+    """Make a replacement for ``virtual_machine.deploy_from_ova``, that creates
+    the VM in the fake inventory after ``upload_seconds``.
+
+    :Returns: Function
+
+    :param stub: The fake vCenter to create VMs in
+    :type stub: FakeStub
+
+    :param upload_seconds: How long uploading the OVA takes
+    :type upload_seconds: Float
+    """
+    def deploy_from_ova(vcenter, ova, network_map, username, machine_name, logger, power_on=True):
+        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+        time.sleep(upload_seconds)
+        return stub.add_vm(folder, machine_name, network_map[0].network, annotation=None,
+                           power_state='poweredOn' if power_on else 'poweredOff')
+    return deploy_from_ova
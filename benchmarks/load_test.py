@@ -0,0 +1,309 @@
+# -*- coding: UTF-8 -*-
+"""
+Load tests the API over HTTP, without RabbitMQ, the auth service, or vCenter.
+
+The Flask app from ``app.py`` is served by a threaded WSGI server, with Celery
+pointed at an in-memory broker and result backend, so sending a task is real
+work but nothing ever runs the task. Requests are signed with a test token, and
+any call to the auth service is answered in-process.
+
+Concurrent clients send a weighted mix of requests, and the report shows the
+requests/sec, latency percentiles, and per-request memory allocations for each
+route. Allocations are measured afterwards, one request at a time, with
+``tracemalloc``; "peak" is the most memory the request had allocated at once, and
+"retained" is what was still allocated after the response was sent.
+
+Run it from the root of the repo::
+
+    python -m benchmarks.load_test --concurrency 16 --requests 5000
+    python -m benchmarks.load_test --mix get=1,image=1 --sync-images
+"""
+import os
+import time
+import uuid
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import http.client
+from collections import defaultdict
+from unittest.mock import patch, MagicMock
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+import ujson
+from werkzeug.test import EnvironBuilder
+
+from benchmarks.stats import percentile
+
+
+USERNAME = 'loadtest'
+# name -> (method, path, body)
+ROUTES = {'get': ('GET', '/api/2/inf/insightiq', None),
+          'post': ('POST', '/api/2/inf/insightiq', lambda: {'name': _name(), 'image': '4.1.2', 'network': 'frontend'}),
+          'delete': ('DELETE', '/api/2/inf/insightiq', lambda: {'name': _name()}),
+          'image': ('GET', '/api/2/inf/insightiq/image', None),
+          'task': ('GET', '/api/2/inf/insightiq/task/{}'.format(uuid.uuid4()), None),
+          'health': ('GET', '/api/1/inf/insightiq/healthcheck', None),
+         }
+DEFAULT_MIX = 'get=4,post=1,delete=1,image=2,task=4,health=1'
+
+
+def _name():
+    return 'iiq-{}'.format(uuid.uuid4().hex[:8])
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """A WSGI server that handles every request in its own thread"""
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Don't log every request to stderr"""
+    def log_message(self, *args, **kwargs):
+        pass
+
+
+def configure(args):
+    """Set the environment the app reads its settings from. Must run before the
+    app is imported.
+
+    :Returns: None
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    os.environ['VLAB_MESSAGE_BROKER'] = 'memory://'
+    os.environ['VLAB_INSIGHTIQ_RESULT_BACKEND'] = 'cache+memory://'
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    if args.sync_images:
+        images_dir = tempfile.mkdtemp(prefix='vlab_insightiq_images')
+        for version in ('4.1.2', '4.2.0', '4.3.1'):
+            open(os.path.join(images_dir, 'InsightIQ_{}.ova'.format(version)), 'w').close()
+        os.environ['VLAB_INSIGHTIQ_IMAGES_DIR'] = images_dir
+        os.environ['VLAB_INSIGHTIQ_SYNC_IMAGES'] = 'true'
+
+
+def fake_verify(latency):
+    """Make a replacement for ``requests.get``, that answers the auth service's
+    token check after ``latency`` seconds.
+
+    :Returns: Function
+
+    :param latency: How many seconds the auth service takes to answer
+    :type latency: Float
+    """
+    def get(url, *args, **kwargs):
+        if latency:
+            time.sleep(latency)
+        resp = MagicMock()
+        resp.ok = True
+        return resp
+    return get
+
+
+def serve(app):
+    """Run the WSGI server in a background thread
+
+    :Returns: Tuple (wsgiref.simple_server.WSGIServer, Integer) of the server and its port
+    """
+    server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, server.server_address[1]
+
+
+def send(port, route, token):
+    """Make one request to the API
+
+    :Returns: Tuple (Integer, Float) of the HTTP status, and how long it took
+
+    :param port: The port the API listens on
+    :type port: Integer
+
+    :param route: The name of the route; a key of ``ROUTES``
+    :type route: String
+
+    :param token: The auth token to send
+    :type token: String
+    """
+    method, path, body = ROUTES[route]
+    headers = {'X-Auth': token, 'X-REQUEST-ID': uuid.uuid4().hex}
+    data = None
+    if body is not None:
+        data = ujson.dumps(body())
+        headers['Content-Type'] = 'application/json'
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request(method, path, body=data, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        status = resp.status
+    except (OSError, http.client.HTTPException):
+        status = 0
+    finally:
+        conn.close()
+    return status, time.perf_counter() - start
+
+
+def allocations(app, route, token, samples):
+    """Measure the memory the app allocates for one request, by calling it
+    directly (so the client's and server's allocations are not counted).
+
+    :Returns: Tuple (Float, Float) of the average peak, and average retained bytes
+
+    :param app: The WSGI app
+    :type app: flask.Flask
+
+    :param route: The name of the route; a key of ``ROUTES``
+    :type route: String
+
+    :param token: The auth token to send
+    :type token: String
+
+    :param samples: How many requests to measure
+    :type samples: Integer
+    """
+    method, path, body = ROUTES[route]
+    peaks = []
+    retained = []
+    for _ in range(samples):
+        environ = EnvironBuilder(path=path, method=method, json=body() if body else None,
+                                 headers={'X-Auth': token, 'X-REQUEST-ID': uuid.uuid4().hex},
+                                 environ_base={'REMOTE_ADDR': '127.0.0.1'}).get_environ()
+        tracemalloc.start()
+        try:
+            chunks = app(environ, lambda status, headers, exc_info=None: None)
+            for _ in chunks:
+                pass
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peaks.append(peak)
+        retained.append(current)
+    return sum(peaks) / samples, sum(retained) / samples
+
+
+def schedule(mix, count, seed):
+    """Pick the route of every request, in proportion to the mix
+
+    :Returns: List
+
+    :param mix: Maps a route name to its weight
+    :type mix: Dictionary
+
+    :param count: How many requests to send
+    :type count: Integer
+
+    :param seed: Makes the order repeatable between runs
+    :type seed: Integer
+    """
+    routes = list(mix.keys())
+    return random.Random(seed).choices(routes, weights=[mix[x] for x in routes], k=count)
+
+
+def report(results, elapsed, allocs):
+    """Print the results as a table
+
+    :Returns: None
+
+    :param results: Maps a route name to a list of (status, seconds) tuples
+    :type results: Dictionary
+
+    :param elapsed: How long the load test ran, in seconds
+    :type elapsed: Float
+
+    :param allocs: Maps a route name to a tuple of (peak bytes, retained bytes)
+    :type allocs: Dictionary
+    """
+    total = sum(len(x) for x in results.values())
+    print('{} requests in {:.1f}s; {:.1f} requests/sec'.format(total, elapsed, total / elapsed))
+    header = '{:<7} {:>7} {:>8} {:>8} {:>8} {:>8} {:>7} {:>10} {:>10}'.format(
+                'route', 'count', 'req/sec', 'p50 ms', 'p90 ms', 'p99 ms', 'errors', 'peak KiB', 'retained B')
+    print(header)
+    print('-' * len(header))
+    for route in sorted(results.keys()):
+        samples = results[route]
+        latencies = sorted(x[1] * 1000 for x in samples)
+        errors = len([x for x in samples if not 200 <= x[0] < 300])
+        peak, retained = allocs.get(route, (0, 0))
+        print('{:<7} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7} {:>10.1f} {:>10.0f}'.format(
+                route, len(samples), len(samples) / elapsed, percentile(latencies, 50),
+                percentile(latencies, 90), percentile(latencies, 99), errors, peak / 1024, retained))
+
+
+def _mix(value):
+    answer = {}
+    for pair in value.split(','):
+        name, _, weight = pair.partition('=')
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError('Unknown route {}; pick from {}'.format(name, sorted(ROUTES.keys())))
+        answer[name] = int(weight or 1)
+    return answer
+
+
+def parse_args(argv=None):
+    """Read the command line
+
+    :Returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Load test the InsightIQ API with an in-memory broker')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients (default: %(default)s)')
+    parser.add_argument('--requests', type=int, default=2000, help='Total requests to send (default: %(default)s)')
+    parser.add_argument('--mix', type=_mix, default=_mix(DEFAULT_MIX),
+                        help='Comma separated route=weight pairs (default: {})'.format(DEFAULT_MIX))
+    parser.add_argument('--verify-latency', type=float, default=0.0,
+                        help='Seconds the (fake) auth service takes to verify a token (default: %(default)s)')
+    parser.add_argument('--sync-images', action='store_true',
+                        help='Answer /image from the API, instead of sending a task')
+    parser.add_argument('--alloc-samples', type=int, default=20,
+                        help='Requests per route to measure allocations with; 0 to skip (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the order of requests (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the load test, and report the results
+
+    :Returns: Dictionary
+    """
+    args = parse_args(argv)
+    configure(args)
+    # The app reads its settings at import time, so it's imported after configure()
+    from vlab_api_common import http_auth
+    from vlab_api_common.http_auth import generate_v2_test_token
+    from vlab_insightiq_api.app import app
+    # Writing the access log of every request would skew the results
+    logging.disable(logging.INFO)
+
+    token = generate_v2_test_token(username=USERNAME, client_ip='127.0.0.1').decode()
+    results = defaultdict(list)
+    with patch.object(http_auth.requests, 'get', fake_verify(args.verify_latency)):
+        server, port = serve(app)
+        try:
+            plan = schedule(args.mix, args.requests, args.seed)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                for route, outcome in zip(plan, executor.map(lambda x: send(port, x, token), plan)):
+                    results[route].append(outcome)
+            elapsed = time.perf_counter() - started
+        finally:
+            server.shutdown()
+            server.server_close()
+        allocs = {}
+        if args.alloc_samples:
+            for route in args.mix:
+                allocs[route] = allocations(app, route, token, args.alloc_samples)
+    report(results, elapsed, allocs)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# -*- coding: UTF-8 -*-
+"""
+Measures how fast the worker can show, create, delete, and list every user's InsightIQ
+instances, against a simulated vCenter (see ``fake_vcenter.py``).
+
+Every scenario is a worker function, the number of VMs in the user's folder,
+and how many tasks run at the same time. For each one, the throughput (ops/sec)
+and the p50/p99 latency is reported, along with how many calls were made to
+vCenter per operation.
+
+Run it from the root of the repo::
+
+    python -m benchmarks.run --vms 10,100,1000,5000 --concurrency 1,4
+
+To check a change for a regression, save the results before the change, and
+compare against them after the change::
+
+    python -m benchmarks.run --save before.json
+    python -m benchmarks.run --baseline before.json
+"""
+import ssl
+import time
+import logging
+import argparse
+import datetime
+import threading
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+
+import ujson
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from vlab_inf_common.vmware import virtual_machine
+
+from vlab_insightiq_api.lib.worker import vmware, inventory
+from vlab_insightiq_api.lib.worker.mirror import InventoryMirror
+from vlab_insightiq_api.lib.worker.session import SessionPool
+from benchmarks.fake_vcenter import FakeStub, FakeOva, deployer
+from benchmarks.stats import percentile
+
+
+FUNCTIONS = ('show', 'create', 'delete', 'inventory')
+USERNAME = 'bench'
+NETWORK = '{}_frontend'.format(USERNAME)
+
+
+def run_scenario(function, vms, concurrency, args):
+    """Benchmark one worker function, with one inventory size and concurrency
+
+    :Returns: Dictionary
+
+    :param function: The worker function to run; one of ``FUNCTIONS``
+    :type function: String
+
+    :param vms: How many VMs are in the user's folder
+    :type vms: Integer
+
+    :param concurrency: How many operations run at the same time
+    :type concurrency: Integer
+
+    :param args: The parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    stub = FakeStub(latency=args.latency, per_object=args.per_object, page_size=args.page_size)
+    folder = stub.populate(users=args.users, vms=vms, networks=args.networks,
+                           insightiq=args.insightiq, username=USERNAME)
+    scratch_network = stub.add_network('{}_scratch'.format(USERNAME))
+    logger = logging.getLogger('benchmark')
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def next_name():
+        with counter_lock:
+            return 'bench{:06d}'.format(next(counter))
+
+    def show():
+        # Same as the insightiq.show task
+        if vmware.mirrored_insightiq(USERNAME, since=0) is None:
+            vmware.show_insightiq(USERNAME)
+
+    def create():
+        vmware.create_insightiq(USERNAME, next_name(), '4.1.2', NETWORK, logger)
+
+    def delete():
+        # Setting up the VM to delete is not part of the measurement
+        machine_name = next_name()
+        stub.add_insightiq(folder, machine_name, scratch_network)
+        return lambda: vmware.delete_insightiq(USERNAME, machine_name, logger)
+
+    def every_user():
+        # Same as the insightiq.inventory task
+        if vmware.mirrored_inventory(since=0) is None:
+            vmware.inventory_insightiq()
+
+    def timed(operation):
+        if function == 'delete':
+            operation = operation()
+        start = time.perf_counter()
+        operation()
+        return time.perf_counter() - start
+
+    operation = {'show': show, 'create': create, 'delete': delete, 'inventory': every_user}[function]
+    pool = SessionPool(stub.connect, size=concurrency, keepalive=60)
+    the_mirror = InventoryMirror(stub.connect, stub.base_dir)
+    inventory._FOLDERS.clear()
+    with patch.object(vmware, 'SESSIONS', pool), \
+         patch.object(vmware, 'MIRROR', the_mirror), \
+         patch.object(vmware, 'const', vmware.const._replace(VLAB_INSIGHTIQ_MIRROR=args.mirror)), \
+         patch.object(virtual_machine, 'deploy_from_ova', deployer(stub, args.upload)):
+        if args.mirror:
+            the_mirror.start()
+            while the_mirror.owners() is None:
+                time.sleep(0.01)
+        for _ in range(args.warmup):
+            timed(operation)
+        calls_before = stub.calls
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(lambda _: timed(operation), range(args.ops)))
+        elapsed = time.perf_counter() - started
+        calls = stub.calls - calls_before
+    the_mirror.stop()
+    pool.clear()
+    latencies.sort()
+    return {'function': function,
+            'vms': vms,
+            'concurrency': concurrency,
+            'ops': args.ops,
+            'ops_per_sec': args.ops / elapsed,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'calls_per_op': calls / args.ops,
+           }
+
+
+def self_signed_cert():
+    """Make a PEM certificate for the console URL code to take a thumbprint of
+
+    :Returns: String
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'vcenter.benchmark')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()).not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256())
+    return cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def report(results, baseline=None):
+    """Print the results as a table, with the change from the baseline (if any)
+
+    :Returns: None
+
+    :param results: The output of ``run_scenario`` for every scenario
+    :type results: List
+
+    :param baseline: Optional - The results of an earlier run
+    :type baseline: List
+    """
+    previous = {}
+    for result in baseline or []:
+        previous[(result['function'], result['vms'], result['concurrency'])] = result
+    header = '{:<8} {:>6} {:>5} {:>10} {:>10} {:>10} {:>9}'.format('function', 'vms', 'conc', 'ops/sec',
+                                                                 'p50 (ms)', 'p99 (ms)', 'calls/op')
+    if baseline is not None:
+        header += ' {:>9}'.format('vs base')
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        line = '{function:<8} {vms:>6} {concurrency:>5} {ops_per_sec:>10.1f} {p50_ms:>10.1f} ' \
+               '{p99_ms:>10.1f} {calls_per_op:>9.1f}'.format(p50_ms=result['p50'] * 1000,
+                                                            p99_ms=result['p99'] * 1000,
+                                                            **result)
+        before = previous.get((result['function'], result['vms'], result['concurrency']))
+        if before is not None:
+            change = (result['ops_per_sec'] - before['ops_per_sec']) / before['ops_per_sec'] * 100
+            line += ' {:>+8.1f}%'.format(change)
+        print(line)
+
+
+def _int_list(value):
+    return [int(x) for x in value.split(',')]
+
+
+def _function_list(value):
+    functions = value.split(',')
+    for function in functions:
+        if function not in FUNCTIONS:
+            raise argparse.ArgumentTypeError('Unknown function {}; pick from {}'.format(function, FUNCTIONS))
+    return functions
+
+
+def parse_args(argv=None):
+    """Read the command line
+
+    :Returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the InsightIQ worker against a simulated vCenter')
+    parser.add_argument('--functions', type=_function_list, default=list(FUNCTIONS),
+                        help='Comma separated worker functions to run (default: %(default)s)')
+    parser.add_argument('--vms', type=_int_list, default=[10, 100, 1000],
+                        help='Comma separated VMs per folder to test with (default: %(default)s)')
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 4],
+                        help='Comma separated numbers of concurrent tasks (default: %(default)s)')
+    parser.add_argument('--ops', type=int, default=20, help='Operations per scenario (default: %(default)s)')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Untimed operations to run first (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds each call to vCenter takes (default: %(default)s)')
+    parser.add_argument('--per-object', type=float, default=0.00002,
+                        help='Extra seconds per object returned by a PropertyCollector query (default: %(default)s)')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='Objects per page of PropertyCollector results (default: %(default)s)')
+    parser.add_argument('--upload', type=float, default=0.05,
+                        help='Seconds it takes to upload an OVA (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=50,
+                        help='How many other users have a VM folder (default: %(default)s)')
+    parser.add_argument('--networks', type=int, default=2,
+                        help='How many networks the benchmark user has (default: %(default)s)')
+    parser.add_argument('--insightiq', type=float, default=0.1,
+                        help='Fraction of the VMs that are InsightIQ instances (default: %(default)s)')
+    parser.add_argument('--mirror', action='store_true',
+                        help='Answer lookups from the inventory mirror, like VLAB_INSIGHTIQ_MIRROR')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against the results in this JSON file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run every scenario, and report the results
+
+    :Returns: List
+    """
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as the_file:
+            baseline = ujson.load(the_file)
+    results = []
+    pem = self_signed_cert()
+    with patch.object(ssl, 'get_server_certificate', lambda *a, **kw: pem), \
+         patch.object(vmware, '_open_image', lambda image: ('/dev/null', FakeOva())):
+        for function in args.functions:
+            for vms in args.vms:
+                for concurrency in args.concurrency:
+                    results.append(run_scenario(function, vms, concurrency, args))
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as the_file:
+            ujson.dump(results, the_file, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+# -*- coding: UTF-8 -*-
+"""Summarizing the samples the benchmarks collect"""
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list
+
+    :Returns: Float
+
+    :param values: The sorted samples
+    :type values: List
+
+    :param pct: The percentile, from 0 to 100
+    :type pct: Integer
+    """
+    if not values:
+        return 0.0
+    idx = max(0, int(round(pct / 100 * len(values))) - 1)
+    return values[min(idx, len(values) - 1)]
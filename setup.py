@@ -15,5 +15,6 @@ setup(name="vlab-insightiq-api",
       package_files={'vlab_insightiq_api' : ['app.ini']},
       description="Create, delete, and show InsightIQ appliances in vLab",
       install_requires=['flask', 'ldap3', 'pyjwt', 'uwsgi', 'vlab-api-common',
-                        'ujson', 'cryptography', 'vlab-inf-common', 'celery']
+                        'ujson', 'cryptography', 'vlab-inf-common', 'celery',
+                        'prometheus-client']
       )
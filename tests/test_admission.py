@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in admission.py
+"""
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_insightiq_api.lib.worker import admission
+
+
+class TestAdmission(unittest.TestCase):
+    """A set of test cases for the Admission object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def make(self, max_deploys=0, max_user_deploys=0, running_timeout=1800):
+        return admission.Admission(self.directory, max_deploys=max_deploys,
+                                   max_user_deploys=max_user_deploys, interval=10,
+                                   running_timeout=running_timeout)
+
+    def test_disabled(self):
+        """``admit`` lets every deploy start when there are no limits"""
+        slots = self.make()
+
+        output = [slots.admit('task{}'.format(x), 'bob') for x in range(10)]
+
+        self.assertEqual(output, [(True, 0)] * 10)
+
+    def test_global_limit(self):
+        """``admit`` puts deploys in line once the global limit is reached"""
+        slots = self.make(max_deploys=2)
+        slots.admit('task1', 'bob')
+        slots.admit('task2', 'alice')
+
+        output = slots.admit('task3', 'sam')
+
+        self.assertEqual(output, (False, 1))
+
+    def test_user_limit(self):
+        """``admit`` limits how many deploys one user can run, without blocking other users"""
+        slots = self.make(max_user_deploys=1)
+        slots.admit('task1', 'bob')
+
+        bob = slots.admit('task2', 'bob')
+        alice = slots.admit('task3', 'alice')
+
+        self.assertEqual(bob, (False, 1))
+        self.assertEqual(alice, (True, 0))
+
+    def test_release(self):
+        """``release`` frees up the slot for the next deploy in line"""
+        slots = self.make(max_deploys=1)
+        slots.admit('task1', 'bob')
+        slots.admit('task2', 'alice')
+
+        slots.release('task1')
+        output = slots.admit('task2', 'alice')
+
+        self.assertEqual(output, (True, 0))
+
+    def test_round_robin(self):
+        """``admit`` takes turns between users, instead of first come, first served"""
+        slots = self.make(max_deploys=1)
+        slots.admit('running', 'sam')
+        for num in range(3):
+            slots.admit('bob{}'.format(num), 'bob')
+
+        output = slots.admit('alice0', 'alice')
+
+        self.assertEqual(output, (False, 2))
+
+    def test_waits_turn(self):
+        """``admit`` doesn't let a deploy skip ahead of the one at the front of the line"""
+        slots = self.make(max_deploys=1)
+        slots.admit('task1', 'bob')
+        slots.admit('task2', 'alice')
+        slots.admit('task3', 'sam')
+        slots.release('task1')
+
+        output = slots.admit('task3', 'sam')
+
+        self.assertEqual(output, (False, 2))
+
+    def test_already_running(self):
+        """``admit`` lets a redelivered deploy that already has a slot carry on"""
+        slots = self.make(max_deploys=1)
+        slots.admit('task1', 'bob')
+
+        output = slots.admit('task1', 'bob')
+
+        self.assertEqual(output, (True, 0))
+
+    @patch.object(admission.time, 'time')
+    def test_stale_waiting(self, fake_time):
+        """``admit`` drops deploys from the line that stopped checking in"""
+        slots = self.make(max_deploys=1)
+        fake_time.return_value = 100
+        slots.admit('task1', 'bob')
+        slots.admit('task2', 'alice')
+        slots.release('task1')
+        fake_time.return_value = 200
+
+        output = slots.admit('task3', 'sam')
+
+        self.assertEqual(output, (True, 0))
+
+    @patch.object(admission.time, 'time')
+    def test_stale_running(self, fake_time):
+        """``admit`` frees the slots of deploys that ran past the time limit"""
+        slots = self.make(max_deploys=1)
+        fake_time.return_value = 100
+        slots.admit('task1', 'bob')
+        fake_time.return_value = 100 + 1800
+
+        output = slots.admit('task2', 'alice')
+
+        self.assertEqual(output, (True, 0))
+
+    @patch.object(admission.time, 'time')
+    def test_running_timeout(self, fake_time):
+        """``admit`` uses the configured time limit, to tell when a deploy was killed"""
+        slots = self.make(max_deploys=1, running_timeout=600)
+        fake_time.return_value = 100
+        slots.admit('task1', 'bob')
+        fake_time.return_value = 100 + 599
+        still_running = slots.admit('task2', 'alice')
+        fake_time.return_value = 100 + 600
+
+        output = slots.admit('task2', 'alice')
+
+        self.assertEqual(still_running, (False, 1))
+        self.assertEqual(output, (True, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in cache.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_insightiq_api.lib.worker import cache
+
+
+class TestResultCache(unittest.TestCase):
+    """A set of test cases for the ResultCache object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = cache.ResultCache(self.cache_dir, ttl=30)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_empty(self):
+        """``ResultCache.get`` returns None when nothing is cached"""
+        output = self.cache.get('alice')
+
+        self.assertTrue(output is None)
+
+    def test_set_and_get(self):
+        """``ResultCache.get`` returns what was saved with ``set``"""
+        self.cache.set('alice', {'myIIQ': {}}, started=cache.time.time())
+
+        output = self.cache.get('alice')
+        expected = {'myIIQ': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_get_per_user(self):
+        """``ResultCache.get`` does not return results cached for another user"""
+        self.cache.set('alice', {'myIIQ': {}}, started=cache.time.time())
+
+        output = self.cache.get('bob')
+
+        self.assertTrue(output is None)
+
+    def test_get_expired(self):
+        """``ResultCache.get`` returns None once the TTL has passed"""
+        self.cache.set('alice', {'myIIQ': {}}, started=cache.time.time())
+
+        with patch.object(cache.time, 'time', return_value=cache.time.time() + 31):
+            output = self.cache.get('alice')
+
+        self.assertTrue(output is None)
+
+    def test_invalidate(self):
+        """``ResultCache.invalidate`` drops the cached result"""
+        self.cache.set('alice', {'myIIQ': {}}, started=cache.time.time())
+        self.cache.invalidate('alice')
+
+        output = self.cache.get('alice')
+
+        self.assertTrue(output is None)
+
+    def test_set_stale(self):
+        """``ResultCache.set`` ignores results computed before the last invalidation"""
+        started = cache.time.time() - 5
+        self.cache.invalidate('alice')
+        self.cache.set('alice', {'myIIQ': {}}, started=started)
+
+        output = self.cache.get('alice')
+
+        self.assertTrue(output is None)
+
+    def test_set_after_invalidate(self):
+        """``ResultCache.set`` saves results computed after the last invalidation"""
+        self.cache.invalidate('alice')
+        self.cache.set('alice', {'myIIQ': {}}, started=cache.time.time() + 1)
+
+        output = self.cache.get('alice')
+        expected = {'myIIQ': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_changed(self):
+        """``ResultCache.changed`` returns when the user's result was last invalidated, even after a new ``set``"""
+        self.cache.invalidate('alice')
+        invalidated = self.cache.changed('alice')
+        self.cache.set('alice', {'myIIQ': {}}, started=cache.time.time() + 1)
+
+        output = self.cache.changed('alice')
+
+        self.assertTrue(invalidated > 0)
+        self.assertEqual(output, invalidated)
+
+    def test_changed_never(self):
+        """``ResultCache.changed`` returns zero for a user who never changed anything"""
+        output = self.cache.changed('alice')
+
+        self.assertEqual(output, 0)
+
+    def test_username_path(self):
+        """``ResultCache`` does not treat usernames as file paths"""
+        self.cache.set('../alice', {'myIIQ': {}}, started=cache.time.time())
+
+        output = self.cache.get('../alice')
+        expected = {'myIIQ': {}}
+
+        self.assertEqual(output, expected)
+        self.assertTrue(self.cache.get('alice') is None)
+
+    def test_disabled(self):
+        """``ResultCache`` never returns results when the TTL is zero"""
+        the_cache = cache.ResultCache(self.cache_dir, ttl=0)
+        the_cache.set('alice', {'myIIQ': {}}, started=cache.time.time())
+
+        output = the_cache.get('alice')
+
+        self.assertTrue(output is None)
+
+
+class TestFileLock(unittest.TestCase):
+    """A set of test cases for the FileLock object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'locks', 'some.lock')
+
+    def test_non_blocking(self):
+        """A non-blocking ``FileLock`` doesn't wait for a lock another holder has"""
+        with cache.FileLock(self.path):
+            with cache.FileLock(self.path, blocking=False) as lock:
+                output = lock.held
+
+        self.assertFalse(output)
+
+    def test_non_blocking_free(self):
+        """A non-blocking ``FileLock`` takes a lock nobody holds"""
+        with cache.FileLock(self.path, blocking=False) as lock:
+            output = lock.held
+
+        self.assertTrue(output)
+        self.assertFalse(lock.held)
+
+
+if __name__ == '__main__':
+    unittest.main()
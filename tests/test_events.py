@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in events.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_insightiq_api.lib import events
+
+
+def make_result(status, info=None, result=None):
+    """Make a fake Celery AsyncResult"""
+    fake_result = MagicMock()
+    fake_result.status = status
+    fake_result.info = info
+    fake_result.result = result
+    return fake_result
+
+
+class TestEvents(unittest.TestCase):
+    """A set of test cases for the events.py module"""
+    @patch.object(events.time, 'sleep')
+    def test_task_events(self, fake_sleep):
+        """``task_events`` yields every change in the state of a task, until it's done"""
+        fake_celery = MagicMock()
+        fake_celery.AsyncResult.side_effect = [make_result('PENDING'),
+                                               make_result('PENDING'),
+                                               make_result('PROGRESS', info={'phase': 'uploading', 'percent': 10}),
+                                               make_result('SUCCESS', result={'content': {}, 'error': None})]
+
+        output = [x for _, x in events.task_events(fake_celery, 'asdf')]
+        statuses = [x['status'] for x in output]
+        expected = ['PENDING', 'PROGRESS', 'SUCCESS']
+
+        self.assertEqual(statuses, expected)
+        self.assertEqual(output[1]['progress'], {'phase': 'uploading', 'percent': 10})
+        self.assertEqual(output[2]['result'], {'content': {}, 'error': None})
+
+    @patch.object(events.time, 'sleep')
+    def test_task_events_queued(self, fake_sleep):
+        """``task_events`` includes the place in line of a deploy that's waiting to start"""
+        fake_celery = MagicMock()
+        fake_celery.AsyncResult.side_effect = [make_result('QUEUED', info={'position': 2}),
+                                               make_result('QUEUED', info={'position': 1}),
+                                               make_result('SUCCESS', result={'content': {}, 'error': None})]
+
+        output = [x for _, x in events.task_events(fake_celery, 'asdf')]
+        positions = [x['progress'] for x in output[:2]]
+
+        self.assertEqual(positions, [{'position': 2}, {'position': 1}])
+
+    @patch.object(events.time, 'sleep')
+    def test_task_events_last_id(self, fake_sleep):
+        """``task_events`` does not yield the event the client already has"""
+        fake_celery = MagicMock()
+        fake_celery.AsyncResult.return_value = make_result('PENDING')
+        first_id, _ = next(events.task_events(fake_celery, 'asdf'))
+
+        output = list(events.task_events(fake_celery, 'asdf', last_id=first_id, timeout=0))
+
+        self.assertEqual(output, [])
+
+    @patch.object(events.time, 'time')
+    @patch.object(events.time, 'sleep')
+    def test_task_events_timeout(self, fake_sleep, fake_time):
+        """``task_events`` stops checking on the task after the timeout"""
+        fake_time.side_effect = [100, 101, 200]
+        fake_celery = MagicMock()
+        fake_celery.AsyncResult.return_value = make_result('PENDING')
+
+        list(events.task_events(fake_celery, 'asdf', timeout=30))
+
+        self.assertEqual(fake_celery.AsyncResult.call_count, 2)
+
+    def test_to_sse(self):
+        """``to_sse`` formats an event as a Server-Sent Event"""
+        event = {'status': 'PROGRESS', 'progress': {'phase': 'powering on'}, 'result': None}
+
+        output = events.to_sse('someId', event)
+        expected = 'id: someId\nevent: status\ndata: {}\n\n'.format(ujson.dumps(event))
+
+        self.assertEqual(output, expected)
+
+    def test_to_sse_done(self):
+        """``to_sse`` names the last event of a task 'done'"""
+        event = {'status': 'FAILURE', 'progress': None, 'result': None}
+
+        output = events.to_sse('someId', event)
+
+        self.assertTrue(output.startswith('id: someId\nevent: done\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in guest.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib.worker import guest
+
+
+def make_update(ips, name='guest.net', op='assign'):
+    """Make a fake WaitForUpdatesEx result"""
+    nic = MagicMock()
+    nic.ipAddress = ips
+    change = MagicMock()
+    change.name = name
+    change.op = op
+    change.val = [nic]
+    obj_update = MagicMock()
+    obj_update.changeSet = [change]
+    filter_update = MagicMock()
+    filter_update.objectSet = [obj_update]
+    update = MagicMock()
+    update.filterSet = [filter_update]
+    return update
+
+
+class TestWaitForIp(unittest.TestCase):
+    """A set of test cases for the ``wait_for_ip`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.collector = self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        self.the_vm = MagicMock(spec=guest.vim.VirtualMachine)
+
+    def test_ip(self):
+        """``wait_for_ip`` returns the IPs once the VM has one"""
+        self.collector.WaitForUpdatesEx.side_effect = [make_update([]), make_update(['10.1.1.1', 'fe80::1'])]
+
+        output = guest.wait_for_ip(self.fake_vcenter, self.the_vm, timeout=60)
+
+        self.assertEqual(output, ['10.1.1.1'])
+
+    def test_version(self):
+        """``wait_for_ip`` asks for the updates after the last one it got"""
+        first = make_update([])
+        first.version = '1'
+        self.collector.WaitForUpdatesEx.side_effect = [first, make_update(['10.1.1.1'])]
+
+        guest.wait_for_ip(self.fake_vcenter, self.the_vm, timeout=60)
+        the_args, _ = self.collector.WaitForUpdatesEx.call_args
+
+        self.assertEqual(the_args[0], '1')
+
+    def test_ignore(self):
+        """``wait_for_ip`` keeps waiting while the VM only has ignored IPs"""
+        self.collector.WaitForUpdatesEx.side_effect = [make_update(['10.1.1.1']), make_update(['10.2.2.2'])]
+
+        output = guest.wait_for_ip(self.fake_vcenter, self.the_vm, timeout=60, ignore=['10.1.1.1'])
+
+        self.assertEqual(output, ['10.2.2.2'])
+
+    def test_partial_change(self):
+        """``wait_for_ip`` reads the NICs off the VM when the update isn't the whole ``guest.net``"""
+        nic = MagicMock()
+        nic.ipAddress = ['10.1.1.1']
+        self.the_vm.guest = MagicMock()
+        self.the_vm.guest.net = [nic]
+        self.collector.WaitForUpdatesEx.return_value = make_update([], name='guest.net["4000"].ipAddress')
+
+        output = guest.wait_for_ip(self.fake_vcenter, self.the_vm, timeout=60)
+
+        self.assertEqual(output, ['10.1.1.1'])
+
+    @patch.object(guest.time, 'time')
+    def test_timeout(self, fake_time):
+        """``wait_for_ip`` raises RuntimeError if the VM never gets an IP"""
+        fake_time.side_effect = [100, 100, 161]
+        self.collector.WaitForUpdatesEx.return_value = None
+
+        with self.assertRaises(RuntimeError):
+            guest.wait_for_ip(self.fake_vcenter, self.the_vm, timeout=60)
+
+    def test_cleanup(self):
+        """``wait_for_ip`` destroys its PropertyCollector"""
+        self.collector.WaitForUpdatesEx.return_value = make_update(['10.1.1.1'])
+
+        guest.wait_for_ip(self.fake_vcenter, self.the_vm, timeout=60)
+
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
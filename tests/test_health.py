@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in health.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib import health
+
+
+class TestDependencyProbe(unittest.TestCase):
+    """A set of test cases for the DependencyProbe object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.probe = health.DependencyProbe(interval=1, timeout=1)
+        self.celery_app = MagicMock()
+
+    @patch.object(health.os, 'listdir')
+    @patch.object(health.socket, 'create_connection')
+    def test_check(self, fake_create_connection, fake_listdir):
+        """``DependencyProbe.check`` records every dependency that works"""
+        self.probe.check(self.celery_app)
+        with patch.object(self.probe, 'start'):
+            output = self.probe.status(self.celery_app)
+
+        self.assertTrue(all(x['ok'] for x in output.values()))
+
+    @patch.object(health.os, 'listdir')
+    @patch.object(health.socket, 'create_connection')
+    def test_check_vcenter(self, fake_create_connection, fake_listdir):
+        """``DependencyProbe.check`` records the error of vCenter being unreachable"""
+        fake_create_connection.side_effect = OSError('Connection refused')
+        self.probe.check(self.celery_app)
+        with patch.object(self.probe, 'start'):
+            output = self.probe.status(self.celery_app)
+
+        self.assertFalse(output['vcenter']['ok'])
+        self.assertEqual(output['vcenter']['error'], 'Connection refused')
+
+    @patch.object(health.os, 'listdir')
+    @patch.object(health.socket, 'create_connection')
+    def test_check_broker(self, fake_create_connection, fake_listdir):
+        """``DependencyProbe.check`` records the error of the broker being unreachable"""
+        conn = self.celery_app.connection_for_write.return_value.__enter__.return_value
+        conn.ensure_connection.side_effect = ConnectionError('nope')
+        self.probe.check(self.celery_app)
+        with patch.object(self.probe, 'start'):
+            output = self.probe.status(self.celery_app)
+
+        self.assertFalse(output['broker']['ok'])
+        self.assertTrue(output['images']['ok'])
+
+    @patch.object(health.os, 'listdir')
+    @patch.object(health.socket, 'create_connection')
+    def test_check_images(self, fake_create_connection, fake_listdir):
+        """``DependencyProbe.check`` records the error of the images directory being unreadable"""
+        fake_listdir.side_effect = PermissionError('denied')
+        self.probe.check(self.celery_app)
+        with patch.object(self.probe, 'start'):
+            output = self.probe.status(self.celery_app)
+
+        self.assertFalse(output['images']['ok'])
+
+    @patch.object(health.os, 'listdir')
+    @patch.object(health.socket, 'create_connection')
+    def test_check_images_optional(self, fake_create_connection, fake_listdir):
+        """``DependencyProbe.check`` reports that the API doesn't require the images directory"""
+        self.probe.check(self.celery_app)
+        with patch.object(self.probe, 'start'):
+            output = self.probe.status(self.celery_app)
+
+        self.assertFalse(output['images']['required'])
+        self.assertTrue(output['broker']['required'])
+
+    def test_status_unknown(self):
+        """``DependencyProbe.status`` reports dependencies that have not been checked yet"""
+        with patch.object(self.probe, 'start'):
+            output = self.probe.status(self.celery_app)
+
+        self.assertEqual(set(output.keys()), {'broker', 'vcenter', 'images'})
+        self.assertTrue(all(x['ok'] is None for x in output.values()))
+
+    @patch.object(health.threading, 'Thread')
+    def test_start(self, fake_Thread):
+        """``DependencyProbe.start`` only starts one background thread per process"""
+        self.probe.start(self.celery_app)
+        self.probe.start(self.celery_app)
+
+        self.assertEqual(fake_Thread.call_count, 1)
+
+    @patch.object(health.os, 'getpid')
+    @patch.object(health.threading, 'Thread')
+    def test_start_forked(self, fake_Thread, fake_getpid):
+        """``DependencyProbe.start`` starts a new background thread after a fork"""
+        fake_getpid.side_effect = [1, 2]
+        self.probe.start(self.celery_app)
+        self.probe.start(self.celery_app)
+
+        self.assertEqual(fake_Thread.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
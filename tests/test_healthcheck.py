@@ -21,6 +21,7 @@ class TestHealthView(unittest.TestCase):
         app = Flask(__name__)
         healthcheck.HealthView.register(app)
         app.config['TESTING'] = True
+        app.celery_app = MagicMock()
         cls.app = app.test_client()
 
     def test_get(self):
@@ -31,6 +32,62 @@ class TestHealthView(unittest.TestCase):
 
         self.assertEqual(resp.status_code, expected)
 
+    def test_get_version(self):
+        """HealthView returns the version of the service"""
+        resp = self.app.get('/api/1/inf/insightiq/healthcheck')
+
+        self.assertEqual(resp.json['version'], healthcheck.VERSION)
+
+    @patch.object(healthcheck, 'pkg_resources')
+    def test_get_version_cached(self, fake_pkg_resources):
+        """HealthView does not look up the version on every request"""
+        self.app.get('/api/1/inf/insightiq/healthcheck')
+
+        self.assertFalse(fake_pkg_resources.get_distribution.called)
+
+    @patch.object(healthcheck, 'PROBE')
+    def test_get_shallow(self, fake_PROBE):
+        """HealthView does not check dependencies by default"""
+        resp = self.app.get('/api/1/inf/insightiq/healthcheck')
+
+        self.assertFalse(fake_PROBE.status.called)
+        self.assertTrue('dependencies' not in resp.json)
+
+    @patch.object(healthcheck, 'PROBE')
+    def test_get_deep(self, fake_PROBE):
+        """HealthView returns the state of dependencies when ``deep=true``"""
+        fake_PROBE.status.return_value = {'broker': {'ok': True, 'error': None, 'checked': 1}}
+        resp = self.app.get('/api/1/inf/insightiq/healthcheck?deep=true')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['dependencies'], fake_PROBE.status.return_value)
+
+    @patch.object(healthcheck, 'PROBE')
+    def test_get_deep_failure(self, fake_PROBE):
+        """HealthView returns HTTP 503 when a dependency failed its check"""
+        fake_PROBE.status.return_value = {'broker': {'ok': True, 'error': None, 'checked': 1},
+                                          'vcenter': {'ok': False, 'error': 'timed out', 'checked': 1}}
+        resp = self.app.get('/api/1/inf/insightiq/healthcheck?deep=true')
+
+        self.assertEqual(resp.status_code, 503)
+
+    @patch.object(healthcheck, 'PROBE')
+    def test_get_deep_optional_failure(self, fake_PROBE):
+        """HealthView returns HTTP 200 when only a dependency the API can work without failed its check"""
+        fake_PROBE.status.return_value = {'broker': {'ok': True, 'error': None, 'checked': 1, 'required': True},
+                                          'images': {'ok': False, 'error': 'not mounted', 'checked': 1, 'required': False}}
+        resp = self.app.get('/api/1/inf/insightiq/healthcheck?deep=true')
+
+        self.assertEqual(resp.status_code, 200)
+
+    @patch.object(healthcheck, 'PROBE')
+    def test_get_deep_unknown(self, fake_PROBE):
+        """HealthView returns HTTP 200 when a dependency has not been checked yet"""
+        fake_PROBE.status.return_value = {'broker': {'ok': None, 'error': 'Not checked yet', 'checked': None}}
+        resp = self.app.get('/api/1/inf/insightiq/healthcheck?deep=true')
+
+        self.assertEqual(resp.status_code, 200)
+
 
 if __name__ == '__main__':
     unittest.main()
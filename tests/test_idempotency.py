@@ -0,0 +1,156 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in idempotency.py
+"""
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_insightiq_api.lib import idempotency
+
+
+class TestRequestIndex(unittest.TestCase):
+    """A set of test cases for the RequestIndex object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.index = idempotency.RequestIndex(self.directory, ttl=60, max_entries=3, sweep_interval=0)
+
+    def test_claim_new(self):
+        """``claim`` returns the supplied task id for a new request"""
+        output = self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+
+        self.assertEqual(output, ('task1', False))
+
+    def test_claim_seen(self):
+        """``claim`` returns the original task id for a repeated request"""
+        self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+
+        output = self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task1', True))
+
+    def test_claim_shared(self):
+        """``claim`` sees the request ids saved by other processes that share the directory"""
+        self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+        other = idempotency.RequestIndex(self.directory, ttl=60, max_entries=3)
+
+        output = other.claim('bob', 'create', 'req1', {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task1', True))
+
+    def test_claim_per_user(self):
+        """``claim`` doesn't mix up the request ids of different users"""
+        self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+
+        output = self.index.claim('alice', 'create', 'req1', {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task2', False))
+
+    def test_claim_per_action(self):
+        """``claim`` doesn't mix up the request ids of different actions"""
+        self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+
+        output = self.index.claim('bob', 'delete', 'req1', {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task2', False))
+
+    def test_claim_different_body(self):
+        """``claim`` raises ValueError when a request id is reused for a different request"""
+        self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+
+        with self.assertRaises(ValueError):
+            self.index.claim('bob', 'create', 'req1', {'name': 'b'}, 'task2')
+
+    def test_claim_no_id(self):
+        """``claim`` doesn't remember requests without an X-REQUEST-ID"""
+        self.index.claim('bob', 'create', idempotency.NO_ID, {'name': 'a'}, 'task1')
+
+        output = self.index.claim('bob', 'create', idempotency.NO_ID, {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task2', False))
+        self.assertEqual(len(self.index), 0)
+
+    def test_claim_disabled(self):
+        """``claim`` doesn't remember anything when the TTL is zero"""
+        index = idempotency.RequestIndex(self.directory, ttl=0)
+        index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+
+        output = index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task2', False))
+
+    @patch.object(idempotency.time, 'time')
+    def test_claim_expired(self, fake_time):
+        """``claim`` forgets request ids after the TTL"""
+        fake_time.return_value = 100
+        self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+        fake_time.return_value = 161
+
+        output = self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task2', False))
+
+    def test_max_entries(self):
+        """``claim`` forgets the oldest request ids once the index is full"""
+        for num in range(4):
+            self.index.claim('bob', 'create', 'req{}'.format(num), {}, 'task{}'.format(num))
+
+        output = self.index.claim('bob', 'create', 'req0', {}, 'again')
+
+        self.assertEqual(output, ('again', False))
+        self.assertEqual(len(self.index), 3)
+
+    @patch.object(idempotency.time, 'time')
+    def test_sweep_interval(self, fake_time):
+        """``claim`` only drops old request ids once per sweep interval"""
+        index = idempotency.RequestIndex(self.directory, ttl=60, max_entries=3, sweep_interval=30)
+        fake_time.return_value = 100
+        for num in range(5):
+            index.claim('bob', 'create', 'req{}'.format(num), {}, 'task{}'.format(num))
+        between_sweeps = len(index)
+        fake_time.return_value = 130
+
+        index.claim('bob', 'create', 'req5', {}, 'task5')
+
+        self.assertEqual(between_sweeps, 5)
+        self.assertEqual(len(index), 3)
+
+    @patch.object(idempotency.time, 'time')
+    def test_sweep_shared(self, fake_time):
+        """``claim`` doesn't sweep when another process that shares the directory just did"""
+        other = idempotency.RequestIndex(self.directory, ttl=60, max_entries=1, sweep_interval=30)
+        index = idempotency.RequestIndex(self.directory, ttl=60, max_entries=1, sweep_interval=30)
+        fake_time.return_value = 100
+        other.claim('bob', 'create', 'req1', {}, 'task1')
+
+        index.claim('bob', 'create', 'req2', {}, 'task2')
+
+        self.assertEqual(len(index), 2)
+
+    @patch.object(idempotency.time, 'time')
+    def test_sweep_clock_moved_back(self, fake_time):
+        """``claim`` sweeps when the last sweep looks like it's in the future"""
+        index = idempotency.RequestIndex(self.directory, ttl=60, max_entries=1, sweep_interval=30)
+        fake_time.return_value = 1000
+        index.claim('bob', 'create', 'req1', {}, 'task1')
+        fake_time.return_value = 100
+
+        index.claim('bob', 'create', 'req2', {}, 'task2')
+
+        self.assertEqual(len(index), 1)
+
+    def test_forget(self):
+        """``forget`` lets the request id be used for a new task"""
+        self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task1')
+        self.index.forget('bob', 'create', 'req1')
+
+        output = self.index.claim('bob', 'create', 'req1', {'name': 'a'}, 'task2')
+
+        self.assertEqual(output, ('task2', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
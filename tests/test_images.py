@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in images.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_insightiq_api.lib import images
+
+
+class TestImageCatalog(unittest.TestCase):
+    """A set of test cases for the ImageCatalog object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        open(os.path.join(self.images_dir, 'InsightIQ_4.1.2.ova'), 'w').close()
+        self.catalog = images.ImageCatalog(self.images_dir)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.images_dir)
+
+    def test_versions(self):
+        """``ImageCatalog.versions`` returns the available versions of InsightIQ"""
+        versions, _ = self.catalog.versions()
+        expected = ['4.1.2']
+
+        self.assertEqual(versions, expected)
+
+    def test_versions_cached(self):
+        """``ImageCatalog.versions`` does not list the directory if it's unchanged"""
+        self.catalog.versions()
+        with patch.object(images.os, 'listdir') as fake_listdir:
+            self.catalog.versions()
+
+        self.assertFalse(fake_listdir.called)
+
+    def test_versions_etag_stable(self):
+        """``ImageCatalog.versions`` returns the same ETag if the images are unchanged"""
+        _, etag1 = self.catalog.versions()
+        _, etag2 = images.ImageCatalog(self.images_dir).versions()
+
+        self.assertEqual(etag1, etag2)
+
+    def test_versions_new_image(self):
+        """``ImageCatalog.versions`` picks up newly added images"""
+        _, etag1 = self.catalog.versions()
+        open(os.path.join(self.images_dir, 'InsightIQ_4.2.0.ova'), 'w').close()
+        os.utime(self.images_dir, ns=(0, 1234))
+        versions, etag2 = self.catalog.versions()
+
+        self.assertEqual(sorted(versions), ['4.1.2', '4.2.0'])
+        self.assertNotEqual(etag1, etag2)
+
+    def test_versions_no_dir(self):
+        """``ImageCatalog.versions`` raises OSError if the images directory is missing"""
+        catalog = images.ImageCatalog(os.path.join(self.images_dir, 'nope'))
+
+        with self.assertRaises(OSError):
+            catalog.versions()
+
+
+class TestConvertName(unittest.TestCase):
+    """A set of test cases for the convert_name function"""
+    def test_convert_name(self):
+        """``convert_name`` defaults to converting versions to images"""
+        output = images.convert_name('4.1.2')
+        expected = 'InsightIQ_4.1.2.ova'
+
+        self.assertEqual(output, expected)
+
+    def test_convert_name_to_version(self):
+        """``convert_name`` can convert from versions to image names"""
+        output = images.convert_name('InsightIQ_4.1.2.ova', to_version=True)
+        expected = '4.1.2'
+
+        self.assertEqual(output, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
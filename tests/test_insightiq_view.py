@@ -2,6 +2,8 @@
 """
 A suite of tests for the insightiqView object
 """
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -34,6 +36,14 @@ class TestInsightIQView(unittest.TestCase):
         cls.fake_task.id = 'asdf-asdf-asdf'
         app.celery_app.send_task.return_value = cls.fake_task
 
+    def fresh_requests(self):
+        """Give the test its own, empty, X-REQUEST-ID index"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = patch.object(insightiq, 'REQUESTS', insightiq.RequestIndex(directory, ttl=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_v1_deprecated(self):
         """InsightIQView - GET on /api/1/inf/insightiq returns an HTTP 404"""
         resp = self.app.get('/api/1/inf/insightiq',
@@ -108,6 +118,66 @@ class TestInsightIQView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_post_retry(self):
+        """InsightIQView - POST with a repeated X-REQUEST-ID returns the original task, without sending another"""
+        self.fresh_requests()
+        headers = {'X-Auth': self.token, 'X-REQUEST-ID': 'retry-me'}
+        body = {'name': "myIIQ", 'image': "4.1.2", 'network': "someNetwork"}
+        self.app.application.celery_app.send_task.side_effect = lambda name, args, task_id: MagicMock(id=task_id)
+        first = self.app.post('/api/2/inf/insightiq', headers=headers, json=body)
+
+        second = self.app.post('/api/2/inf/insightiq', headers=headers, json=body)
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+        self.assertEqual(first.json['content']['task-id'], second.json['content']['task-id'])
+        self.assertEqual(second.headers['Idempotent-Replayed'], 'true')
+
+    def test_post_retry_conflict(self):
+        """InsightIQView - POST that reuses an X-REQUEST-ID for a different body returns an HTTP 409"""
+        self.fresh_requests()
+        headers = {'X-Auth': self.token, 'X-REQUEST-ID': 'retry-me'}
+        self.app.post('/api/2/inf/insightiq', headers=headers,
+                      json={'name': "myIIQ", 'image': "4.1.2", 'network': "someNetwork"})
+
+        resp = self.app.post('/api/2/inf/insightiq', headers=headers,
+                             json={'name': "otherIIQ", 'image': "4.1.2", 'network': "someNetwork"})
+
+        self.assertEqual(resp.status_code, 409)
+
+    def test_post_send_fails(self):
+        """InsightIQView - POST that fails to send the task doesn't block a retry"""
+        self.fresh_requests()
+        headers = {'X-Auth': self.token, 'X-REQUEST-ID': 'retry-me'}
+        body = {'name': "myIIQ", 'image': "4.1.2", 'network': "someNetwork"}
+        self.app.application.celery_app.send_task.side_effect = [RuntimeError('broker down'), self.fake_task]
+        with self.assertRaises(RuntimeError):
+            self.app.post('/api/2/inf/insightiq', headers=headers, json=body)
+
+        self.app.post('/api/2/inf/insightiq', headers=headers, json=body)
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_delete_retry(self):
+        """InsightIQView - DELETE with a repeated X-REQUEST-ID only sends one task"""
+        self.fresh_requests()
+        headers = {'X-Auth': self.token, 'X-REQUEST-ID': 'retry-me'}
+        self.app.delete('/api/2/inf/insightiq', headers=headers, json={'name': "myIIQ"})
+        self.app.delete('/api/2/inf/insightiq', headers=headers, json={'name': "myIIQ"})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_task_queued(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/task/<id> includes the place in line of a waiting deploy"""
+        result = self.app.application.celery_app.AsyncResult.return_value
+        result.status = 'QUEUED'
+        result.info = {'position': 2}
+
+        resp = self.app.get('/api/2/inf/insightiq/task/asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content']['progress'], {'position': 2})
+
     def test_get_image_task(self):
         """InsightIQView - GET on /api/2/inf/insightiq/image returns a task-id"""
         resp = self.app.get('/api/2/inf/insightiq/image',
@@ -128,6 +198,239 @@ class TestInsightIQView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    @patch.object(insightiq, 'IMAGE_CATALOG')
+    @patch.object(insightiq, 'const', insightiq.const._replace(VLAB_INSIGHTIQ_SYNC_IMAGES=True))
+    def test_get_image_sync(self, fake_IMAGE_CATALOG):
+        """InsightIQView - GET on /api/2/inf/insightiq/image returns the images without a task when enabled"""
+        fake_IMAGE_CATALOG.versions.return_value = (['4.1.2'], 'someEtag')
+        resp = self.app.get('/api/2/inf/insightiq/image',
+                            headers={'X-Auth': self.token})
+
+        expected = {'content': {'image': ['4.1.2']}, 'error': None, 'params': {}}
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, expected)
+        self.assertEqual(resp.headers['ETag'], '"someEtag"')
+
+    @patch.object(insightiq, 'IMAGE_CATALOG')
+    @patch.object(insightiq, 'const', insightiq.const._replace(VLAB_INSIGHTIQ_SYNC_IMAGES=True))
+    def test_get_image_sync_not_modified(self, fake_IMAGE_CATALOG):
+        """InsightIQView - GET on /api/2/inf/insightiq/image returns HTTP 304 if the client has the current images"""
+        fake_IMAGE_CATALOG.versions.return_value = (['4.1.2'], 'someEtag')
+        resp = self.app.get('/api/2/inf/insightiq/image',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"someEtag"'})
+
+        self.assertEqual(resp.status_code, 304)
+
+    @patch.object(insightiq, 'IMAGE_CATALOG')
+    @patch.object(insightiq, 'const', insightiq.const._replace(VLAB_INSIGHTIQ_SYNC_IMAGES=True))
+    def test_get_image_sync_no_dir(self, fake_IMAGE_CATALOG):
+        """InsightIQView - GET on /api/2/inf/insightiq/image falls back to a task if the images are not readable"""
+        fake_IMAGE_CATALOG.versions.side_effect = OSError('testing')
+        resp = self.app.get('/api/2/inf/insightiq/image',
+                            headers={'X-Auth': self.token})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+
+    def test_post_batch_names(self):
+        """InsightIQView - POST on /api/2/inf/insightiq/batch creates the supplied names with one task"""
+        resp = self.app.post('/api/2/inf/insightiq/batch',
+                             headers={'X-Auth': self.token},
+                             json={'names': ['iiq1', 'iiq2'], 'image': "4.1.2", 'network': "someNetwork"})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        task_name, task_args = the_args
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content']['task-id'], 'asdf-asdf-asdf')
+        self.assertEqual(task_name, 'insightiq.create_batch')
+        self.assertEqual(task_args[1], ['iiq1', 'iiq2'])
+
+    def test_post_batch_count(self):
+        """InsightIQView - POST on /api/2/inf/insightiq/batch names the instances with a prefix and count"""
+        self.app.post('/api/2/inf/insightiq/batch',
+                      headers={'X-Auth': self.token},
+                      json={'count': 3, 'prefix': 'iiq-', 'image': "4.1.2", 'network': "someNetwork"})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        _, task_args = the_args
+
+        self.assertEqual(task_args[1], ['iiq-1', 'iiq-2', 'iiq-3'])
+
+    def test_post_batch_both(self):
+        """InsightIQView - POST on /api/2/inf/insightiq/batch requires names, or a count and prefix; not both"""
+        resp = self.app.post('/api/2/inf/insightiq/batch',
+                             headers={'X-Auth': self.token},
+                             json={'names': ['iiq1'], 'count': 3, 'prefix': 'iiq-',
+                                   'image': "4.1.2", 'network': "someNetwork"})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_delete_batch_names(self):
+        """InsightIQView - DELETE on /api/2/inf/insightiq/batch deletes the supplied names with one task"""
+        resp = self.app.delete('/api/2/inf/insightiq/batch',
+                               headers={'X-Auth': self.token},
+                               json={'names': ['iiq1', 'iiq2']})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        task_name, task_args = the_args
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(task_name, 'insightiq.delete_batch')
+        self.assertEqual(task_args[1], ['iiq1', 'iiq2'])
+
+    def test_delete_batch_all(self):
+        """InsightIQView - DELETE on /api/2/inf/insightiq/batch can delete every instance"""
+        self.app.delete('/api/2/inf/insightiq/batch',
+                        headers={'X-Auth': self.token},
+                        json={'all': True})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        _, task_args = the_args
+
+        self.assertEqual(task_args[1], None)
+
+    def test_delete_batch_all_false(self):
+        """InsightIQView - DELETE on /api/2/inf/insightiq/batch rejects 'all' being false"""
+        resp = self.app.delete('/api/2/inf/insightiq/batch',
+                               headers={'X-Auth': self.token},
+                               json={'all': False})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_task_progress(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/task returns the partial results of a running task"""
+        fake_result = MagicMock()
+        fake_result.status = 'PROGRESS'
+        fake_result.info = {'created': {'iiq1': {}}, 'failed': {}}
+        self.app.application.celery_app.AsyncResult.return_value = fake_result
+        resp = self.app.get('/api/2/inf/insightiq/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        expected = {'status': 'PROGRESS', 'progress': {'created': {'iiq1': {}}, 'failed': {}}}
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content'], expected)
+
+    def test_task_done(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/task returns the result of a finished task"""
+        fake_result = MagicMock()
+        fake_result.status = 'SUCCESS'
+        fake_result.result = {'content': {'worked': True}, 'error': None, 'params': {}}
+        self.app.application.celery_app.AsyncResult.return_value = fake_result
+        resp = self.app.get('/api/2/inf/insightiq/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'worked': True})
+
+
+    @patch.object(insightiq, 'task_events')
+    def test_task_events_long_poll(self, fake_task_events):
+        """InsightIQView - GET on /api/2/inf/insightiq/task/<id>/events returns the next event"""
+        fake_task_events.return_value = iter([('someId', {'status': 'PROGRESS', 'progress': {}, 'result': None})])
+        resp = self.app.get('/api/2/inf/insightiq/task/asdf-asdf-asdf/events?last=oldId',
+                            headers={'X-Auth': self.token})
+
+        expected = {'event-id': 'someId', 'status': 'PROGRESS', 'progress': {}, 'result': None}
+        _, _, last_id = fake_task_events.call_args[0]
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], expected)
+        self.assertEqual(last_id, 'oldId')
+
+    @patch.object(insightiq, 'task_events')
+    def test_task_events_long_poll_timeout(self, fake_task_events):
+        """InsightIQView - GET on /api/2/inf/insightiq/task/<id>/events returns HTTP 202 if nothing changed"""
+        fake_task_events.return_value = iter([])
+        resp = self.app.get('/api/2/inf/insightiq/task/asdf-asdf-asdf/events?last=oldId',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content'], {'event-id': 'oldId'})
+
+    @patch.object(insightiq, 'task_events')
+    def test_task_events_sse(self, fake_task_events):
+        """InsightIQView - GET on /api/2/inf/insightiq/task/<id>/events streams Server-Sent Events"""
+        fake_task_events.return_value = iter([('id1', {'status': 'PROGRESS', 'progress': {}, 'result': None}),
+                                              ('id2', {'status': 'SUCCESS', 'progress': None, 'result': {}})])
+        resp = self.app.get('/api/2/inf/insightiq/task/asdf-asdf-asdf/events',
+                            headers={'X-Auth': self.token, 'Accept': 'text/event-stream'})
+
+        body = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertTrue(body.startswith('id: id1\nevent: status\n'))
+        self.assertTrue('id: id2\nevent: done\n' in body)
+
+    @patch.object(insightiq, 'task_events')
+    def test_task_events_sse_reconnect(self, fake_task_events):
+        """InsightIQView - GET on /api/2/inf/insightiq/task/<id>/events resumes from the Last-Event-ID header"""
+        fake_task_events.return_value = iter([])
+        resp = self.app.get('/api/2/inf/insightiq/task/asdf-asdf-asdf/events',
+                            headers={'X-Auth': self.token, 'Accept': 'text/event-stream', 'Last-Event-ID': 'id1'})
+        resp.get_data()
+        _, _, last_id = fake_task_events.call_args[0]
+
+        self.assertEqual(last_id, 'id1')
+
+
+    @patch.object(insightiq, 'ADMINS', frozenset(['bob']))
+    def test_inventory(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/inventory returns a task-id for admins"""
+        resp = self.app.get('/api/2/inf/insightiq/inventory?page=2&per_page=50',
+                            headers={'X-Auth': self.token, 'X-REQUEST-ID': 'myId'})
+
+        task_name, the_args = self.app.application.celery_app.send_task.call_args[0]
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content']['task-id'], 'asdf-asdf-asdf')
+        self.assertEqual(task_name, 'insightiq.inventory')
+        self.assertEqual(the_args, [2, 50, 'myId'])
+
+    def test_inventory_not_admin(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/inventory returns HTTP 403 for non-admins"""
+        resp = self.app.get('/api/2/inf/insightiq/inventory',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    @patch.object(insightiq, 'ADMINS', frozenset(['bob']))
+    def test_inventory_bad_page(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/inventory returns HTTP 400 for a bad page"""
+        for query in ('page=0', 'page=one', 'per_page=0', 'per_page=1001'):
+            resp = self.app.get('/api/2/inf/insightiq/inventory?{}'.format(query),
+                                headers={'X-Auth': self.token})
+
+            self.assertEqual(resp.status_code, 400)
+
+    def test_tasks(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/tasks lists the user's tasks"""
+        backend = self.app.application.celery_app.backend
+        backend.user_tasks.return_value = ['task-1']
+        backend.get_task_meta.return_value = {'status': 'SUCCESS'}
+        resp = self.app.get('/api/2/inf/insightiq/tasks',
+                            headers={'X-Auth': self.token})
+
+        expected = {'tasks': [{'task-id': 'task-1', 'status': 'SUCCESS'}]}
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], expected)
+        backend.user_tasks.assert_called_with('bob')
+
+    def test_tasks_not_supported(self):
+        """InsightIQView - GET on /api/2/inf/insightiq/tasks returns HTTP 400 if the result backend can't list tasks"""
+        self.app.application.celery_app.backend = object()
+        resp = self.app.get('/api/2/inf/insightiq/tasks',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+
 
 if __name__ == '__main__':
     unittest.main()
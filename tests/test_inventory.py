@@ -0,0 +1,396 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in inventory.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_insightiq_api.lib.worker import inventory
+
+
+def _make_obj(obj, **props):
+    """Build a fake PropertyCollector ObjectContent"""
+    content = MagicMock()
+    content.obj = obj
+    prop_set = []
+    for name, value in props.items():
+        prop = MagicMock()
+        prop.name = name
+        prop.val = value
+        prop_set.append(prop)
+    content.propSet = prop_set
+    return content
+
+
+def _make_result(objects, token=None):
+    """Build a fake RetrieveResult"""
+    result = MagicMock()
+    result.objects = objects
+    result.token = token
+    return result
+
+
+class TestInventory(unittest.TestCase):
+    """A set of test cases for the inventory.py module"""
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        cls.meta = {'component': 'InsightIQ',
+                    'created': 1234,
+                    'version': '4.1.2',
+                    'configured': False,
+                    'generation': 1}
+
+    def test_retrieve(self):
+        """``retrieve`` returns a mapping of objects to their properties"""
+        fake_vcenter = MagicMock()
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_vcenter.content.propertyCollector.RetrievePropertiesEx.return_value = _make_result([_make_obj(the_vm, name='myIIQ')])
+
+        output = inventory.retrieve(fake_vcenter, MagicMock())
+        expected = {the_vm: {'name': 'myIIQ'}}
+
+        self.assertEqual(output, expected)
+
+    def test_retrieve_pages(self):
+        """``retrieve`` reads every page of results"""
+        fake_vcenter = MagicMock()
+        vm1 = inventory.vim.VirtualMachine('vm-1')
+        vm2 = inventory.vim.VirtualMachine('vm-2')
+        collector = fake_vcenter.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = _make_result([_make_obj(vm1, name='one')], token='more')
+        collector.ContinueRetrievePropertiesEx.return_value = _make_result([_make_obj(vm2, name='two')])
+
+        output = inventory.retrieve(fake_vcenter, MagicMock())
+        expected = {vm1: {'name': 'one'}, vm2: {'name': 'two'}}
+
+        self.assertEqual(output, expected)
+
+    def test_retrieve_no_results(self):
+        """``retrieve`` returns an empty dictionary when vCenter finds nothing"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.propertyCollector.RetrievePropertiesEx.return_value = None
+
+        output = inventory.retrieve(fake_vcenter, MagicMock())
+
+        self.assertEqual(output, {})
+
+    @patch.object(inventory, 'retrieve')
+    def test_folder_vms(self, fake_retrieve):
+        """``folder_vms`` returns the same data as ``virtual_machine.get_info``"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        user_net = inventory.vim.Network('net-1')
+        other_net = inventory.vim.Network('net-2')
+        nic = MagicMock()
+        nic.ipAddress = ['10.7.7.7', 'fe80::1']
+        fake_retrieve.return_value = {the_vm: {'name': 'myIIQ',
+                                               'runtime.powerState': 'poweredOn',
+                                               'config.annotation': ujson.dumps(self.meta),
+                                               'guest.net': [nic],
+                                               'network': [user_net, other_net]},
+                                      user_net: {'name': 'alice_frontend'},
+                                      other_net: {'name': 'bob_frontend'}}
+
+        output = inventory.folder_vms(MagicMock(), inventory.vim.Folder('group-v1'), 'alice')
+        expected = {'myIIQ': {'state': 'poweredOn',
+                              'console': None,
+                              'ips': ['10.7.7.7'],
+                              'networks': ['frontend'],
+                              'moid': 'vm-1',
+                              'meta': self.meta}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(inventory, 'retrieve')
+    def test_folder_vms_no_config(self, fake_retrieve):
+        """``folder_vms`` sets default meta data for VMs that are still being deployed"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_retrieve.return_value = {the_vm: {'name': 'myIIQ'}}
+
+        output = inventory.folder_vms(MagicMock(), inventory.vim.Folder('group-v1'), 'alice')
+
+        self.assertEqual(output['myIIQ']['meta'], inventory.UNKNOWN_META)
+
+    @patch.object(inventory, 'retrieve')
+    def test_folder_vms_bad_notes(self, fake_retrieve):
+        """``folder_vms`` sets default meta data for VMs with non-JSON notes"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_retrieve.return_value = {the_vm: {'name': 'myIIQ', 'config.annotation': 'not json'}}
+
+        output = inventory.folder_vms(MagicMock(), inventory.vim.Folder('group-v1'), 'alice')
+
+        self.assertEqual(output['myIIQ']['meta'], inventory.UNKNOWN_META)
+
+    @patch.object(inventory, 'add_consoles')
+    @patch.object(inventory, 'retrieve')
+    def test_vm_info(self, fake_retrieve, fake_add_consoles):
+        """``vm_info`` returns the same data as ``virtual_machine.get_info``, naming only the VM's networks"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        user_net = inventory.vim.Network('net-1')
+        fake_retrieve.return_value = {the_vm: {'name': 'myIIQ',
+                                               'runtime.powerState': 'poweredOn',
+                                               'config.annotation': ujson.dumps(self.meta),
+                                               'network': [user_net]},
+                                      user_net: {'name': 'alice_frontend'}}
+
+        output = inventory.vm_info(MagicMock(), the_vm, 'alice')
+        expected = {'state': 'poweredOn',
+                    'console': None,
+                    'ips': [],
+                    'networks': ['frontend'],
+                    'moid': 'vm-1',
+                    'meta': self.meta}
+
+        self.assertEqual(output, expected)
+        self.assertEqual(fake_add_consoles.call_args[0][1], {'myIIQ': output})
+
+    def test_find_folder(self):
+        """``find_folder`` looks up the user's folder by name"""
+        inventory._FOLDERS.clear()
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.return_value = inventory.vim.Folder('group-v1')
+
+        output = inventory.find_folder(fake_vcenter, 'alice')
+
+        self.assertEqual(output._moId, 'group-v1')
+        self.assertEqual(inventory._FOLDERS, {'alice': 'group-v1'})
+
+    @patch.object(inventory.vim, 'Folder')
+    def test_find_folder_cached(self, fake_Folder):
+        """``find_folder`` does not search vCenter for a folder it already found"""
+        inventory._FOLDERS.clear()
+        inventory._FOLDERS['alice'] = 'group-v1'
+        fake_vcenter = MagicMock()
+        fake_Folder.return_value.name = 'alice'
+
+        output = inventory.find_folder(fake_vcenter, 'alice')
+
+        self.assertTrue(output is fake_Folder.return_value)
+        self.assertFalse(fake_vcenter.get_by_name.called)
+
+    @patch.object(inventory.vim, 'Folder')
+    def test_find_folder_renamed(self, fake_Folder):
+        """``find_folder`` searches vCenter again if the cached folder was renamed"""
+        inventory._FOLDERS.clear()
+        inventory._FOLDERS['alice'] = 'group-v1'
+        fake_vcenter = MagicMock()
+        fake_Folder.return_value.name = 'bob'
+        fake_vcenter.get_by_name.return_value._moId = 'group-v2'
+
+        inventory.find_folder(fake_vcenter, 'alice')
+
+        self.assertTrue(fake_vcenter.get_by_name.called)
+        self.assertEqual(inventory._FOLDERS, {'alice': 'group-v2'})
+
+    def test_find_folder_deleted(self):
+        """``find_folder`` searches vCenter again if the cached folder was deleted"""
+        inventory._FOLDERS.clear()
+        inventory._FOLDERS['alice'] = 'group-v1'
+        fake_vcenter = MagicMock()
+        fake_vcenter._conn._stub.InvokeAccessor.side_effect = inventory.vmodl.fault.ManagedObjectNotFound()
+        fake_vcenter.get_by_name.return_value._moId = 'group-v2'
+
+        inventory.find_folder(fake_vcenter, 'alice')
+
+        self.assertTrue(fake_vcenter.get_by_name.called)
+
+    def test_find_folder_no_folder(self):
+        """``find_folder`` raises ValueError if the user has no folder"""
+        inventory._FOLDERS.clear()
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            inventory.find_folder(fake_vcenter, 'alice')
+
+    def test_find_vm(self):
+        """``find_vm`` returns the VM found by the SearchIndex"""
+        fake_vcenter = MagicMock()
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_vcenter.content.searchIndex.FindChild.return_value = the_vm
+
+        output = inventory.find_vm(fake_vcenter, MagicMock(), 'myIIQ')
+
+        self.assertTrue(output is the_vm)
+
+    def test_find_vm_none(self):
+        """``find_vm`` returns None when there's no VM with the supplied name"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+
+        output = inventory.find_vm(fake_vcenter, MagicMock(), 'myIIQ')
+
+        self.assertTrue(output is None)
+
+    def test_find_vm_not_vm(self):
+        """``find_vm`` returns None when the named child is not a VM"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = inventory.vim.Folder('group-v7')
+
+        output = inventory.find_vm(fake_vcenter, MagicMock(), 'myIIQ')
+
+        self.assertTrue(output is None)
+
+    @patch.object(inventory, 'retrieve')
+    def test_get_meta(self, fake_retrieve):
+        """``get_meta`` returns the meta data stored in the VM's notes"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_retrieve.return_value = {the_vm: {'config.annotation': ujson.dumps(self.meta)}}
+
+        output = inventory.get_meta(MagicMock(), the_vm)
+
+        self.assertEqual(output, self.meta)
+
+    @patch.object(inventory, 'retrieve')
+    def test_get_meta_unknown(self, fake_retrieve):
+        """``get_meta`` returns default meta data for VMs without notes"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_retrieve.return_value = {}
+
+        output = inventory.get_meta(MagicMock(), the_vm)
+
+        self.assertEqual(output, inventory.UNKNOWN_META)
+
+    @patch.object(inventory, '_console_url_maker')
+    @patch.object(inventory, 'folder_vms')
+    def test_insightiq_vms(self, fake_folder_vms, fake_console_url_maker):
+        """``insightiq_vms`` only returns InsightIQ VMs"""
+        fake_console_url_maker.return_value.return_value = 'https://some-console-url'
+        fake_folder_vms.return_value = {'myIIQ': {'moid': 'vm-1', 'meta': self.meta},
+                                        'otherVM': {'moid': 'vm-2', 'meta': inventory.UNKNOWN_META}}
+
+        output = inventory.insightiq_vms(MagicMock(), MagicMock(), 'alice')
+        expected = {'myIIQ': {'moid': 'vm-1', 'meta': self.meta, 'console': 'https://some-console-url'}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(inventory, '_console_url_maker')
+    @patch.object(inventory, 'folder_vms')
+    def test_insightiq_vms_none(self, fake_folder_vms, fake_console_url_maker):
+        """``insightiq_vms`` does not make console URLs when there are no InsightIQ VMs"""
+        fake_folder_vms.return_value = {'otherVM': {'moid': 'vm-2', 'meta': inventory.UNKNOWN_META}}
+
+        inventory.insightiq_vms(MagicMock(), MagicMock(), 'alice')
+
+        self.assertFalse(fake_console_url_maker.called)
+
+    @patch.object(inventory, 'retrieve')
+    def test_insightiq_objects(self, fake_retrieve):
+        """``insightiq_objects`` returns the InsightIQ VMs and their power state"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        other_vm = inventory.vim.VirtualMachine('vm-2')
+        fake_retrieve.return_value = {the_vm: {'name': 'myIIQ',
+                                               'runtime.powerState': 'poweredOn',
+                                               'config.annotation': ujson.dumps(self.meta)},
+                                      other_vm: {'name': 'otherVM',
+                                                 'runtime.powerState': 'poweredOn'}}
+
+        output = inventory.insightiq_objects(MagicMock(), inventory.vim.Folder('group-v1'))
+        expected = {'myIIQ': (the_vm, 'poweredOn')}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(inventory, 'retrieve')
+    def test_every_insightiq(self, fake_retrieve):
+        """``every_insightiq`` groups the InsightIQ VMs by the folder they're in, then by version"""
+        alice = inventory.vim.Folder('group-v1')
+        bob = inventory.vim.Folder('group-v2')
+        vm1 = inventory.vim.VirtualMachine('vm-1')
+        vm2 = inventory.vim.VirtualMachine('vm-2')
+        other_vm = inventory.vim.VirtualMachine('vm-3')
+        user_net = inventory.vim.Network('net-1')
+        fake_retrieve.return_value = {alice: {'name': 'alice'},
+                                      bob: {'name': 'bob'},
+                                      user_net: {'name': 'alice_frontend'},
+                                      vm1: {'name': 'myIIQ',
+                                            'parent': alice,
+                                            'runtime.powerState': 'poweredOn',
+                                            'config.annotation': ujson.dumps(self.meta),
+                                            'network': [user_net]},
+                                      vm2: {'name': 'myIIQ',
+                                            'parent': bob,
+                                            'runtime.powerState': 'poweredOff',
+                                            'config.annotation': ujson.dumps(self.meta)},
+                                      other_vm: {'name': 'otherVM', 'parent': alice}}
+
+        output = inventory.every_insightiq(MagicMock(), inventory.vim.Folder('group-v0'))
+
+        self.assertEqual(sorted(output.keys()), ['alice', 'bob'])
+        self.assertEqual(list(output['alice']['4.1.2'].keys()), ['myIIQ'])
+        self.assertEqual(output['alice']['4.1.2']['myIIQ']['networks'], ['frontend'])
+        self.assertEqual(output['bob']['4.1.2']['myIIQ']['state'], 'poweredOff')
+
+    @patch.object(inventory, 'retrieve')
+    def test_every_insightiq_no_parent(self, fake_retrieve):
+        """``every_insightiq`` skips VMs whose folder wasn't found"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_retrieve.return_value = {the_vm: {'name': 'myIIQ',
+                                               'parent': inventory.vim.Folder('group-v9'),
+                                               'config.annotation': ujson.dumps(self.meta)}}
+
+        output = inventory.every_insightiq(MagicMock(), inventory.vim.Folder('group-v0'))
+
+        self.assertEqual(output, {})
+
+    @patch.object(inventory, 'retrieve')
+    def test_every_insightiq_standby(self, fake_retrieve):
+        """``every_insightiq`` leaves out the standby VMs"""
+        holding = inventory.vim.Folder('group-v1')
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_retrieve.return_value = {holding: {'name': 'insightiq-standby'},
+                                      the_vm: {'name': 'insightiq-standby-4.1.2-aaaa',
+                                               'parent': holding,
+                                               'config.annotation': ujson.dumps(self.meta)}}
+
+        output = inventory.every_insightiq(MagicMock(), inventory.vim.Folder('group-v0'))
+
+        self.assertEqual(output, {})
+
+    @patch.object(inventory, 'retrieve')
+    def test_network_names(self, fake_retrieve):
+        """``network_names`` maps the name of every network to the network"""
+        fake_vcenter = MagicMock()
+        fake_stub = MagicMock()
+        fake_vcenter.content.viewManager.CreateContainerView.return_value = inventory.vim.view.ContainerView('session[1]', stub=fake_stub)
+        network = inventory.vim.Network('network-1')
+        fake_retrieve.return_value = {network: {'name': 'alice_frontend'}}
+
+        output = inventory.network_names(fake_vcenter)
+        expected = {'alice_frontend': network}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(inventory, 'retrieve')
+    def test_network_names_destroys_view(self, fake_retrieve):
+        """``network_names`` destroys the container view, even if the query fails"""
+        fake_vcenter = MagicMock()
+        fake_stub = MagicMock()
+        fake_vcenter.content.viewManager.CreateContainerView.return_value = inventory.vim.view.ContainerView('session[1]', stub=fake_stub)
+        fake_retrieve.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            inventory.network_names(fake_vcenter)
+
+        self.assertEqual(fake_stub.InvokeMethod.call_args[0][1].wsdlName, 'DestroyView')
+
+    @patch.object(inventory.OpenSSL.crypto, 'load_certificate')
+    @patch.object(inventory.ssl, 'get_server_certificate')
+    def test_console_url_maker(self, fake_get_server_certificate, fake_load_certificate):
+        """``_console_url_maker`` acquires a new clone ticket for every URL"""
+        fake_vcenter = MagicMock()
+        fake_load_certificate.return_value.digest.return_value = b'AA:BB'
+        session_manager = fake_vcenter.content.sessionManager
+        session_manager.AcquireCloneTicket.side_effect = ['ticket1', 'ticket2']
+
+        console_url = inventory._console_url_maker(fake_vcenter)
+        url1 = console_url('vm-1', 'myIIQ')
+        url2 = console_url('vm-2', 'otherIIQ')
+
+        self.assertTrue('sessionTicket=ticket1' in url1)
+        self.assertTrue('sessionTicket=ticket2' in url2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in metrics.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+from celery.app.task import Context
+
+from vlab_insightiq_api.lib import metrics
+
+
+def sample(name, **labels):
+    """Read the current value of a metric"""
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(unittest.TestCase):
+    """A set of test cases for the metrics.py module"""
+    def test_vcenter_call(self):
+        """``vcenter_call`` records how long a call to vCenter took"""
+        before = sample('insightiq_vcenter_call_seconds_count', call='testing')
+        with metrics.vcenter_call('testing'):
+            pass
+
+        after = sample('insightiq_vcenter_call_seconds_count', call='testing')
+
+        self.assertEqual(after - before, 1)
+
+    def test_vcenter_call_error(self):
+        """``vcenter_call`` counts calls that fail"""
+        before = sample('insightiq_vcenter_call_errors_total', call='testing')
+        with self.assertRaises(RuntimeError):
+            with metrics.vcenter_call('testing'):
+                raise RuntimeError('testing')
+
+        after = sample('insightiq_vcenter_call_errors_total', call='testing')
+
+        self.assertEqual(after - before, 1)
+
+    def test_record_upload(self):
+        """``record_upload`` records the bytes uploaded, and the throughput"""
+        before = sample('insightiq_ova_upload_bytes_total')
+        metrics.record_upload(2048, 2)
+
+        after = sample('insightiq_ova_upload_bytes_total')
+
+        self.assertEqual(after - before, 2048)
+
+    def test_stamp_enqueued(self):
+        """``_stamp_enqueued`` adds the time the task was sent to the message headers"""
+        headers = {}
+        metrics._stamp_enqueued(headers=headers)
+
+        self.assertTrue(metrics.ENQUEUED_HEADER in headers)
+
+    @patch.object(metrics.time, 'time')
+    def test_task_started(self, fake_time):
+        """``_task_started`` records how long the task waited in the queue"""
+        fake_time.return_value = 110
+        fake_task = MagicMock()
+        fake_task.name = 'insightiq.testing'
+        fake_task.request = Context({metrics.ENQUEUED_HEADER: 100})
+        before = sample('insightiq_task_queue_wait_seconds_sum', task='insightiq.testing')
+
+        metrics._task_started(task=fake_task)
+        after = sample('insightiq_task_queue_wait_seconds_sum', task='insightiq.testing')
+
+        self.assertEqual(after - before, 10)
+
+    @patch.object(metrics.time, 'time')
+    def test_task_finished(self, fake_time):
+        """``_task_finished`` records how long the task took to run"""
+        fake_time.return_value = 130
+        fake_task = MagicMock()
+        fake_task.name = 'insightiq.testing'
+        fake_task.request = Context({'vlab_started': 100})
+        before = sample('insightiq_task_seconds_sum', task='insightiq.testing', state='SUCCESS')
+
+        metrics._task_finished(task=fake_task, state='SUCCESS')
+        after = sample('insightiq_task_seconds_sum', task='insightiq.testing', state='SUCCESS')
+
+        self.assertEqual(after - before, 30)
+
+    def test_instrument_app(self):
+        """``instrument_app`` records the latency of every API route"""
+        app = Flask(__name__)
+        app.add_url_rule('/api/testing/<name>', 'testing', lambda name: 'ok')
+        metrics.instrument_app(app)
+        labels = {'method': 'GET', 'route': '/api/testing/<name>', 'status': '200'}
+        before = sample('insightiq_api_request_seconds_count', **labels)
+
+        app.test_client().get('/api/testing/foo')
+        after = sample('insightiq_api_request_seconds_count', **labels)
+
+        self.assertEqual(after - before, 1)
+
+    def test_exposition(self):
+        """``exposition`` renders the metrics in the Prometheus text format"""
+        body, content_type = metrics.exposition()
+
+        self.assertTrue(b'insightiq_task_seconds' in body)
+        self.assertTrue(content_type.startswith('text/plain'))
+
+    @patch.object(metrics, 'start_http_server')
+    def test_serve_worker_metrics(self, fake_start_http_server):
+        """``_serve_worker_metrics`` serves metrics on the configured port"""
+        metrics._serve_worker_metrics()
+
+        the_args, _ = fake_start_http_server.call_args
+
+        self.assertEqual(the_args[0], metrics.const.VLAB_INSIGHTIQ_WORKER_METRICS_PORT)
+
+    @patch.object(metrics, 'const', metrics.const._replace(VLAB_INSIGHTIQ_WORKER_METRICS_PORT=0))
+    @patch.object(metrics, 'start_http_server')
+    def test_serve_worker_metrics_disabled(self, fake_start_http_server):
+        """``_serve_worker_metrics`` does nothing if the port is zero"""
+        metrics._serve_worker_metrics()
+
+        self.assertFalse(fake_start_http_server.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of unit tests for the MetricsView object
+"""
+import unittest
+
+from flask import Flask
+
+from vlab_insightiq_api.lib.views import metrics
+
+
+class TestMetricsView(unittest.TestCase):
+    """A suite of test cases for the MetricsView object"""
+
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        metrics.MetricsView.register(app)
+        app.config['TESTING'] = True
+        cls.app = app.test_client()
+
+    def test_get(self):
+        """MetricsView for /api/1/inf/insightiq/metrics supports GET"""
+        resp = self.app.get('/api/1/inf/insightiq/metrics')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(b'insightiq_api_request_seconds' in resp.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in mirror.py
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_insightiq_api.lib.worker import mirror
+
+
+META = {'component': 'InsightIQ', 'created': 1234, 'version': '4.1.2', 'configured': False, 'generation': 1}
+
+
+def make_change(name, val, op='assign'):
+    """Make a fake PropertyCollector Change"""
+    change = MagicMock()
+    change.name = name
+    change.val = val
+    change.op = op
+    return change
+
+
+def make_update(objects, version='1', truncated=False):
+    """Make a fake WaitForUpdatesEx result from a list of (obj, kind, {prop: value})"""
+    obj_updates = []
+    for obj, kind, props in objects:
+        obj_update = MagicMock()
+        obj_update.obj = obj
+        obj_update.kind = kind
+        obj_update.changeSet = [make_change(x, y) for x, y in props.items()]
+        obj_updates.append(obj_update)
+    filter_update = MagicMock()
+    filter_update.objectSet = obj_updates
+    update = MagicMock()
+    update.filterSet = [filter_update]
+    update.version = version
+    update.truncated = truncated
+    return update
+
+
+class TestInventoryMirror(unittest.TestCase):
+    """A set of test cases for the InventoryMirror object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.fake_vcenter.get_vm_folder.return_value = mirror.vim.Folder('group-v0')
+        self.collector = self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        self.mirror = mirror.InventoryMirror(lambda: self.fake_vcenter, 'vlab', wait=5, max_age=30)
+        self.folder = mirror.vim.Folder('group-v1')
+        self.the_vm = mirror.vim.VirtualMachine('vm-1')
+        self.initial = make_update([(self.folder, 'enter', {'name': 'alice'}),
+                                    (self.the_vm, 'enter', {'name': 'myIIQ',
+                                                            'parent': self.folder,
+                                                            'runtime.powerState': 'poweredOn',
+                                                            'config.annotation': ujson.dumps(META)})])
+
+    def follow(self, *updates):
+        """Have the mirror apply some updates. Raises RuntimeError once they've all been applied."""
+        self.collector.WaitForUpdatesEx.side_effect = list(updates) + [RuntimeError('testing')]
+        with self.assertRaises(RuntimeError):
+            self.mirror._follow(threading.Event())
+
+    def test_user_vms(self):
+        """``user_vms`` returns a user's InsightIQ instances, stamped with the version"""
+        self.follow(self.initial)
+
+        output = self.mirror.user_vms('alice')
+
+        self.assertEqual(list(output.data.keys()), ['myIIQ'])
+        self.assertEqual(output.data['myIIQ']['state'], 'poweredOn')
+        self.assertEqual(output.version, '1')
+
+    def test_user_vms_no_folder(self):
+        """``user_vms`` returns None for a user the mirror has no folder for"""
+        self.follow(self.initial)
+
+        output = self.mirror.user_vms('bob')
+
+        self.assertTrue(output is None)
+
+    def test_user_vms_behind(self):
+        """``user_vms`` returns None if the mirror isn't current as of ``since``"""
+        self.follow(self.initial)
+
+        output = self.mirror.user_vms('alice', since=mirror.time.time() + 1)
+
+        self.assertTrue(output is None)
+
+    def test_user_vms_too_old(self):
+        """``user_vms`` returns None if the mirror hasn't heard from vCenter recently"""
+        self.follow(self.initial)
+
+        with patch.object(mirror.time, 'time', return_value=mirror.time.time() + 31):
+            output = self.mirror.user_vms('alice')
+
+        self.assertTrue(output is None)
+
+    def test_modify(self):
+        """The mirror applies changes to the properties of a VM"""
+        self.follow(self.initial, make_update([(self.the_vm, 'modify', {'runtime.powerState': 'poweredOff'})], version='2'))
+
+        output = self.mirror.user_vms('alice')
+
+        self.assertEqual(output.data['myIIQ']['state'], 'poweredOff')
+        self.assertEqual(output.version, '2')
+
+    def test_leave(self):
+        """The mirror forgets VMs that are deleted"""
+        self.follow(self.initial, make_update([(self.the_vm, 'leave', {})], version='2'))
+
+        output = self.mirror.user_vms('alice')
+
+        self.assertEqual(output.data, {})
+
+    def test_truncated(self):
+        """The mirror doesn't answer lookups until it has the whole inventory"""
+        self.initial.truncated = True
+        self.follow(self.initial)
+
+        output = self.mirror.user_vms('alice')
+
+        self.assertTrue(output is None)
+
+    def test_owners(self):
+        """``owners`` groups every InsightIQ instance by owner and version"""
+        self.follow(self.initial)
+
+        output = self.mirror.owners()
+
+        self.assertEqual(list(output.data['alice']['4.1.2'].keys()), ['myIIQ'])
+
+    def test_owners_standby(self):
+        """``owners`` leaves out the standby VMs"""
+        holding = mirror.vim.Folder('group-v2')
+        standby_vm = mirror.vim.VirtualMachine('vm-2')
+        self.follow(make_update([(holding, 'enter', {'name': 'insightiq-standby'}),
+                                 (standby_vm, 'enter', {'name': 'insightiq-standby-4.1.2-aaaa',
+                                                        'parent': holding,
+                                                        'runtime.powerState': 'poweredOn',
+                                                        'config.annotation': ujson.dumps(META)})]))
+
+        output = self.mirror.owners()
+
+        self.assertEqual(output.data, {})
+
+    def test_find_vm(self):
+        """``find_vm`` returns the VM, bound to the caller's session"""
+        self.follow(self.initial)
+        fake_stub = MagicMock()
+        fake_stub.InvokeAccessor.return_value = 'myIIQ'
+        caller = MagicMock()
+        caller._conn._stub = fake_stub
+
+        output = self.mirror.find_vm(caller, 'alice', 'myIIQ')
+
+        self.assertEqual(output._moId, 'vm-1')
+        self.assertTrue(output._stub is fake_stub)
+
+    def test_find_vm_deleted(self):
+        """``find_vm`` returns None if the VM was deleted since the mirror last heard from vCenter"""
+        self.follow(self.initial)
+        caller = MagicMock()
+        caller._conn._stub.InvokeAccessor.side_effect = mirror.vmodl.fault.ManagedObjectNotFound()
+
+        output = self.mirror.find_vm(caller, 'alice', 'myIIQ')
+
+        self.assertTrue(output is None)
+
+    def test_find_vm_unknown(self):
+        """``find_vm`` returns None for a VM the mirror doesn't know of"""
+        self.follow(self.initial)
+
+        output = self.mirror.find_vm(MagicMock(), 'alice', 'newIIQ')
+
+        self.assertTrue(output is None)
+
+    def test_cleanup(self):
+        """The mirror destroys its PropertyCollector, and logs out, when it stops following vCenter"""
+        self.follow(self.initial)
+
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+        self.assertTrue(self.fake_vcenter.close.called)
+
+    def test_stop(self):
+        """``stop`` forgets the inventory"""
+        self.follow(self.initial)
+
+        self.mirror.stop()
+
+        self.assertTrue(self.mirror.owners() is None)
+
+    @patch.object(mirror, 'logger')
+    def test_run_logs_errors(self, fake_logger):
+        """The mirror logs why it lost vCenter before it tries again"""
+        stopped = threading.Event()
+        self.fake_vcenter.get_vm_folder.side_effect = RuntimeError('bad login')
+        with patch.object(stopped, 'wait', side_effect=lambda x: stopped.set()):
+            self.mirror._run(stopped)
+
+        self.assertTrue(fake_logger.exception.called)
+
+    @patch.object(mirror.threading, 'Thread')
+    def test_start_once(self, fake_Thread):
+        """``start`` only starts one thread per process"""
+        self.mirror.start()
+        self.mirror.start()
+
+        self.assertEqual(fake_Thread.call_count, 1)
+
+
+class TestSnapshot(unittest.TestCase):
+    """A set of test cases for saving and reading the inventory snapshot"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'inventory.json')
+
+    def test_round_trip(self):
+        """``read_snapshot`` returns the inventory a mirror saved"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_vm_folder.return_value = mirror.vim.Folder('group-v0')
+        collector = fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        folder = mirror.vim.Folder('group-v1')
+        the_vm = mirror.vim.VirtualMachine('vm-1')
+        collector.WaitForUpdatesEx.side_effect = [make_update([(folder, 'enter', {'name': 'alice'}),
+                                                               (the_vm, 'enter', {'name': 'myIIQ',
+                                                                                  'parent': folder,
+                                                                                  'config.annotation': ujson.dumps(META)})]),
+                                                  RuntimeError('testing')]
+        the_mirror = mirror.InventoryMirror(lambda: fake_vcenter, 'vlab', snapshot=self.path)
+        with self.assertRaises(RuntimeError):
+            the_mirror._follow(threading.Event())
+
+        output = mirror.read_snapshot(self.path)
+
+        self.assertEqual(list(output.data['alice']['4.1.2'].keys()), ['myIIQ'])
+        self.assertEqual(output.version, '1')
+
+    def test_missing(self):
+        """``read_snapshot`` returns None when there's no snapshot"""
+        output = mirror.read_snapshot(self.path)
+
+        self.assertTrue(output is None)
+
+    def test_old(self):
+        """``read_snapshot`` returns None when the snapshot is older than ``since``"""
+        with open(self.path, 'w') as the_file:
+            ujson.dump({'version': '1', 'as_of': 100, 'owners': {}}, the_file)
+
+        output = mirror.read_snapshot(self.path, since=200)
+
+        self.assertTrue(output is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
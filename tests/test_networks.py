@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in networks.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib.worker import networks
+
+
+class TestNetworkIndex(unittest.TestCase):
+    """A set of test cases for the NetworkIndex object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.index = networks.NetworkIndex(ttl=300)
+        self.vcenter = MagicMock()
+        self.stub = self.vcenter._conn._stub
+        self.stub.InvokeAccessor.return_value = 'alice_frontend'
+
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup(self, fake_network_names):
+        """``NetworkIndex.lookup`` returns the network with the supplied name"""
+        fake_network_names.return_value = {'alice_frontend': networks.inventory.vim.Network('network-1')}
+
+        output = self.index.lookup(self.vcenter, 'alice_frontend')
+
+        self.assertEqual(output._moId, 'network-1')
+
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup_cached(self, fake_network_names):
+        """``NetworkIndex.lookup`` does not reload the index for a known network"""
+        fake_network_names.return_value = {'alice_frontend': networks.inventory.vim.Network('network-1')}
+
+        self.index.lookup(self.vcenter, 'alice_frontend')
+        self.index.lookup(self.vcenter, 'alice_frontend')
+
+        self.assertEqual(fake_network_names.call_count, 1)
+
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup_session(self, fake_network_names):
+        """``NetworkIndex.lookup`` returns networks tied to the supplied vCenter session"""
+        fake_network_names.return_value = {'alice_frontend': networks.inventory.vim.Network('network-1')}
+        self.index.lookup(self.vcenter, 'alice_frontend')
+
+        output = self.index.lookup(self.vcenter, 'alice_frontend')
+
+        self.assertTrue(output._stub is self.stub)
+
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup_miss(self, fake_network_names):
+        """``NetworkIndex.lookup`` reloads the index when the network is not known"""
+        fake_network_names.side_effect = [{'alice_frontend': networks.inventory.vim.Network('network-1')},
+                                          {'alice_frontend': networks.inventory.vim.Network('network-1'),
+                                           'alice_backend': networks.inventory.vim.Network('network-2')}]
+        self.index.lookup(self.vcenter, 'alice_frontend')
+
+        output = self.index.lookup(self.vcenter, 'alice_backend')
+
+        self.assertEqual(output._moId, 'network-2')
+
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup_no_network(self, fake_network_names):
+        """``NetworkIndex.lookup`` raises KeyError if the network does not exist"""
+        fake_network_names.return_value = {}
+
+        with self.assertRaises(KeyError):
+            self.index.lookup(self.vcenter, 'alice_frontend')
+
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup_renamed(self, fake_network_names):
+        """``NetworkIndex.lookup`` reloads the index if a known network was renamed"""
+        fake_network_names.side_effect = [{'alice_frontend': networks.inventory.vim.Network('network-1')},
+                                          {'alice_frontend': networks.inventory.vim.Network('network-3')}]
+        self.index.lookup(self.vcenter, 'alice_frontend')
+        self.stub.InvokeAccessor.return_value = 'alice_renamed'
+
+        output = self.index.lookup(self.vcenter, 'alice_frontend')
+
+        self.assertEqual(output._moId, 'network-3')
+
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup_deleted(self, fake_network_names):
+        """``NetworkIndex.lookup`` reloads the index if a known network was deleted"""
+        fake_network_names.side_effect = [{'alice_frontend': networks.inventory.vim.Network('network-1')},
+                                          {'alice_frontend': networks.inventory.vim.Network('network-3')}]
+        self.index.lookup(self.vcenter, 'alice_frontend')
+        self.stub.InvokeAccessor.side_effect = networks.vmodl.fault.ManagedObjectNotFound()
+
+        output = self.index.lookup(self.vcenter, 'alice_frontend')
+
+        self.assertEqual(output._moId, 'network-3')
+
+    @patch.object(networks.time, 'time')
+    @patch.object(networks.inventory, 'network_names')
+    def test_lookup_expired(self, fake_network_names, fake_time):
+        """``NetworkIndex.lookup`` reloads the index once the TTL has passed"""
+        fake_network_names.return_value = {'alice_frontend': networks.inventory.vim.Network('network-1')}
+        fake_time.return_value = 1000
+        self.index.lookup(self.vcenter, 'alice_frontend')
+        fake_time.return_value = 2000
+
+        self.index.lookup(self.vcenter, 'alice_frontend')
+
+        self.assertEqual(fake_network_names.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
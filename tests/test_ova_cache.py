@@ -0,0 +1,229 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in ova_cache.py
+"""
+import io
+import os
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib.worker import ova_cache
+
+
+OVF = '<Envelope><NetworkSection><Network ovf:name="VM Network"></Network></NetworkSection></Envelope>'
+DISK = b'pretend this is a VMDK' * 100
+
+
+def make_ova(ova_path, disk=DISK, checksum=None):
+    """Write a small, but valid, OVA file"""
+    checksum = checksum if checksum else hashlib.sha256(disk).hexdigest()
+    manifest = 'SHA256(iiq-disk1.vmdk)= {}\n'.format(checksum).encode()
+    with tarfile.open(ova_path, mode='w') as tar:
+        for name, data in [('iiq.ovf', OVF.encode()), ('iiq.mf', manifest), ('iiq-disk1.vmdk', disk)]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+class TestOvaCache(unittest.TestCase):
+    """A set of test cases for the ova_cache.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ova_path = os.path.join(self.tmp_dir, 'InsightIQ_4.1.2.ova')
+        make_ova(self.ova_path)
+        patcher = patch.object(ova_cache, 'const', ova_cache.const._replace(VLAB_INSIGHTIQ_CACHE_DIR=self.tmp_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ova_cache._CACHE.clear()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_meta(self):
+        """``get_meta`` returns the OVF, networks, and disk locations of an OVA"""
+        meta = ova_cache.get_meta(self.ova_path)
+
+        self.assertEqual(meta.ovf, OVF)
+        self.assertEqual(meta.networks, ['VM Network'])
+        self.assertEqual(list(meta.disks.keys()), ['iiq-disk1.vmdk'])
+
+    @patch.object(ova_cache, '_scan')
+    def test_get_meta_cached(self, fake_scan):
+        """``get_meta`` only scans an OVA once"""
+        fake_scan.return_value = ova_cache.ImageMeta(ovf=OVF, networks=[], disks={})
+        ova_cache.get_meta(self.ova_path)
+        ova_cache.get_meta(self.ova_path)
+
+        self.assertEqual(fake_scan.call_count, 1)
+
+    def test_get_meta_saved(self):
+        """``get_meta`` loads the parsed OVA from disk in a new process"""
+        ova_cache.get_meta(self.ova_path)
+        ova_cache._CACHE.clear()
+        with patch.object(ova_cache, '_scan') as fake_scan:
+            meta = ova_cache.get_meta(self.ova_path)
+
+        self.assertFalse(fake_scan.called)
+        self.assertEqual(meta.networks, ['VM Network'])
+
+    def test_get_meta_changed(self):
+        """``get_meta`` scans the OVA again if the file was replaced"""
+        ova_cache.get_meta(self.ova_path)
+        make_ova(self.ova_path, disk=b'a different disk' * 200)
+        os.utime(self.ova_path, ns=(0, 1234))
+
+        meta = ova_cache.get_meta(self.ova_path)
+        _, size = meta.disks['iiq-disk1.vmdk']
+
+        self.assertEqual(size, len(b'a different disk' * 200))
+
+    def test_get_meta_missing(self):
+        """``get_meta`` raises FileNotFoundError if the OVA does not exist"""
+        with self.assertRaises(FileNotFoundError):
+            ova_cache.get_meta(os.path.join(self.tmp_dir, 'InsightIQ_0.0.0.ova'))
+
+    def test_get_meta_bad_checksum(self):
+        """``get_meta`` raises ValueError if a file does not match the manifest"""
+        make_ova(self.ova_path, checksum='ab' * 32)
+
+        with self.assertRaises(ValueError):
+            ova_cache.get_meta(self.ova_path)
+
+    def test_get_meta_not_tar(self):
+        """``get_meta`` raises ValueError if the OVA is not a tarball"""
+        with open(self.ova_path, 'wb') as the_file:
+            the_file.write(b'not an OVA')
+
+        with self.assertRaises(ValueError):
+            ova_cache.get_meta(self.ova_path)
+
+    def test_get_meta_truncated(self):
+        """``get_meta`` raises ValueError if the OVA was only partially copied"""
+        with open(self.ova_path, 'rb') as the_file:
+            data = the_file.read()
+        with open(self.ova_path, 'wb') as the_file:
+            the_file.write(data[:2600])
+
+        with self.assertRaises(ValueError):
+            ova_cache.get_meta(self.ova_path)
+
+    def test_open_ova(self):
+        """``open_ova`` returns an object that reads disks straight from the OVA"""
+        ova = ova_cache.open_ova(self.ova_path)
+        try:
+            disk = ova._disks['iiq-disk1.vmdk']
+            data = disk.read()
+        finally:
+            ova.close()
+
+        self.assertEqual(data, DISK)
+        self.assertEqual(disk.size, len(DISK))
+
+    def test_open_ova_networks(self):
+        """``open_ova`` returns an object with the networks of the OVA"""
+        ova = ova_cache.open_ova(self.ova_path)
+        ova.close()
+
+        self.assertEqual(ova.networks, ['VM Network'])
+        self.assertEqual(ova.vmdks, ['iiq-disk1.vmdk'])
+
+    def test_open_ova_progress(self):
+        """``open_ova`` returns an object that reports how much of the disks have been read"""
+        percents = []
+        ova = ova_cache.open_ova(self.ova_path)
+        ova.on_progress = percents.append
+        try:
+            disk = ova._disks['iiq-disk1.vmdk']
+            disk.read(len(DISK) // 2)
+            disk.read()
+        finally:
+            ova.close()
+
+        self.assertEqual(percents, [50, 100])
+
+    @patch.object(ova_cache.upload, 'upload_disks')
+    def test_deploy(self, fake_upload_disks):
+        """``CachedOva.deploy`` uploads the disks, then completes the lease"""
+        fake_lease = MagicMock()
+        ova = ova_cache.open_ova(self.ova_path)
+        try:
+            ova.deploy(MagicMock(), fake_lease, 'some.host')
+        finally:
+            ova.close()
+
+        self.assertTrue(fake_upload_disks.called)
+        self.assertTrue(fake_lease.Complete.called)
+        self.assertEqual(ova.upload_stats, fake_upload_disks.return_value)
+
+    @patch.object(ova_cache.upload, 'upload_disks')
+    def test_deploy_failure(self, fake_upload_disks):
+        """``CachedOva.deploy`` aborts the lease if an upload fails"""
+        fake_upload_disks.side_effect = [RuntimeError('testing')]
+        fake_lease = MagicMock()
+        ova = ova_cache.open_ova(self.ova_path)
+        try:
+            with self.assertRaises(RuntimeError):
+                ova.deploy(MagicMock(), fake_lease, 'some.host')
+        finally:
+            ova.close()
+
+        self.assertTrue(fake_lease.Abort.called)
+        self.assertFalse(fake_lease.Complete.called)
+
+
+class TestTarMember(unittest.TestCase):
+    """A set of test cases for the TarMember object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'data')
+        with open(self.path, 'wb') as the_file:
+            the_file.write(b'0123456789')
+        self.handle = ova_cache.FileHandle(self.path)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.handle.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read(self):
+        """``TarMember.read`` only reads the bytes of the member"""
+        member = ova_cache.TarMember(self.handle, 2, 5)
+
+        self.assertEqual(member.read(), b'23456')
+        self.assertEqual(member.read(), b'')
+
+    def test_read_chunks(self):
+        """``TarMember.read`` supports reading in chunks"""
+        member = ova_cache.TarMember(self.handle, 2, 5)
+
+        self.assertEqual(member.read(3), b'234')
+        self.assertEqual(member.read(3), b'56')
+
+    def test_seek(self):
+        """``TarMember.seek`` is relative to the start of the member"""
+        member = ova_cache.TarMember(self.handle, 2, 5)
+        member.read()
+        member.seek(0, 0)
+
+        self.assertEqual(member.read(2), b'23')
+        self.assertEqual(member.tell(), 2)
+
+    def test_read_interleaved(self):
+        """``TarMember.read`` isn't affected by reads of other members of the same tarball"""
+        first = ova_cache.TarMember(self.handle, 0, 5)
+        second = ova_cache.TarMember(self.handle, 5, 5)
+
+        output = [first.read(2), second.read(2), first.read(2), second.read(2)]
+
+        self.assertEqual(output, [b'01', b'56', b'23', b'78'])
+
+
+if __name__ == '__main__':
+    unittest.main()
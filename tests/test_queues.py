@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in queues.py
+"""
+import unittest
+
+from celery import Celery
+
+from vlab_insightiq_api.lib import queues
+
+
+class TestQueues(unittest.TestCase):
+    """A set of test cases for the queues.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.app = Celery('testing', broker='memory://')
+        queues.configure(self.app)
+
+    def route(self, task_name, **options):
+        """Ask the Celery app where a task would be sent"""
+        return self.app.amqp.router.route(options, task_name)
+
+    def test_show(self):
+        """``configure`` sends insightiq.show to the read queue"""
+        output = self.route('insightiq.show')
+
+        self.assertEqual(output['queue'].name, queues.READ_QUEUE)
+
+    def test_image(self):
+        """``configure`` sends insightiq.image to the read queue"""
+        output = self.route('insightiq.image')
+
+        self.assertEqual(output['queue'].name, queues.READ_QUEUE)
+
+    def test_inventory(self):
+        """``configure`` sends insightiq.inventory to the read queue"""
+        output = self.route('insightiq.inventory')
+
+        self.assertEqual(output['queue'].name, queues.READ_QUEUE)
+
+    def test_create(self):
+        """``configure`` sends insightiq.create to the write queue"""
+        output = self.route('insightiq.create')
+
+        self.assertEqual(output['queue'].name, queues.WRITE_QUEUE)
+
+    def test_priority(self):
+        """``configure`` gives reads a higher priority than writes"""
+        read = self.route('insightiq.show')
+        write = self.route('insightiq.delete')
+
+        self.assertTrue(read['priority'] > write['priority'])
+
+    def test_background_priority(self):
+        """``configure`` puts refilling the standby pool behind deploys"""
+        background = self.route('insightiq.standby_refill')
+        write = self.route('insightiq.create')
+
+        self.assertEqual(background['queue'].name, queues.WRITE_QUEUE)
+        self.assertTrue(background['priority'] < write['priority'])
+
+    def test_priority_override(self):
+        """``configure`` lets the sender pick a different priority"""
+        output = self.route('insightiq.create', priority=1)
+
+        self.assertEqual(output['priority'], 1)
+
+    def test_max_priority(self):
+        """``configure`` creates queues that support priorities"""
+        for queue in self.app.conf.task_queues:
+            self.assertEqual(queue.queue_arguments['x-max-priority'], queues.MAX_PRIORITY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in results.py
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from celery import Celery
+from celery.app.task import Context
+
+from vlab_insightiq_api.lib import results
+
+
+class TestResults(unittest.TestCase):
+    """A set of test cases for the results.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        patcher = patch.object(results, 'const', results.const._replace(VLAB_INSIGHTIQ_RESULT_DIR=self.tmp_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = Celery('testing', broker='memory://', backend=results.BACKEND_PATH)
+        self.app.conf.result_expires = 60
+        self.backend = self.app.backend
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def make_request(self, task='insightiq.show', args=('alice', 'someTxn')):
+        """Make a fake task request context"""
+        return Context(task=task, args=list(args))
+
+    def test_backend_name(self):
+        """``backend_name`` keeps the rpc backend by default"""
+        self.assertEqual(results.backend_name(), 'rpc://')
+
+    def test_backend_name_file(self):
+        """``backend_name`` returns the FileBackend when configured to use files"""
+        with patch.object(results, 'const', results.const._replace(VLAB_INSIGHTIQ_RESULT_BACKEND='file')):
+            self.assertEqual(results.backend_name(), results.BACKEND_PATH)
+
+    def test_store_result(self):
+        """``FileBackend`` can read a result from another process"""
+        self.backend.store_result('task-1', {'content': {}, 'error': None}, 'SUCCESS', request=self.make_request())
+        other = Celery('testing', broker='memory://', backend=results.BACKEND_PATH).backend
+
+        output = other.get_task_meta('task-1')
+
+        self.assertEqual(output['status'], 'SUCCESS')
+        self.assertEqual(output['result'], {'content': {}, 'error': None})
+
+    def test_store_result_twice(self):
+        """``FileBackend`` can read a result more than once"""
+        self.backend.store_result('task-1', {'content': {}, 'error': None}, 'SUCCESS', request=self.make_request())
+
+        self.backend.get_task_meta('task-1')
+        output = self.backend.get_task_meta('task-1', cache=False)
+
+        self.assertEqual(output['status'], 'SUCCESS')
+
+    def test_expired(self):
+        """``FileBackend`` forgets results older than the TTL"""
+        self.backend.store_result('task-1', {'content': {}, 'error': None}, 'SUCCESS', request=self.make_request())
+        key = self.backend.get_key_for_task('task-1')
+        os.utime(self.backend._filename(key), (0, 0))
+
+        output = self.backend.get_task_meta('task-1')
+
+        self.assertEqual(output['status'], 'PENDING')
+        self.assertFalse(os.path.exists(self.backend._filename(key)))
+
+    def test_user_tasks(self):
+        """``FileBackend.user_tasks`` returns the tasks a user ran, newest first"""
+        self.backend.store_result('task-1', {}, 'SUCCESS', request=self.make_request())
+        self.backend.store_result('task-2', {}, 'SUCCESS', request=self.make_request())
+        self.backend.store_result('task-3', {}, 'SUCCESS', request=self.make_request(args=('bob', 'someTxn')))
+        an_older_time = time.time() - 10
+        os.utime(self.backend._filename(self.backend.get_key_for_task('task-1')), (an_older_time, an_older_time))
+
+        output = self.backend.user_tasks('alice')
+
+        self.assertEqual(output, ['task-2', 'task-1'])
+
+    def test_user_tasks_expired(self):
+        """``FileBackend.user_tasks`` drops expired tasks from the index"""
+        self.backend.store_result('task-1', {}, 'SUCCESS', request=self.make_request())
+        os.utime(self.backend._filename(self.backend.get_key_for_task('task-1')), (0, 0))
+
+        output = self.backend.user_tasks('alice')
+
+        self.assertEqual(output, [])
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'users', 'alice')), [])
+
+    def test_userless_task(self):
+        """``FileBackend`` does not index tasks that are not run for a user"""
+        self.backend.store_result('task-1', {}, 'SUCCESS', request=self.make_request(task='insightiq.image', args=('someTxn',)))
+
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'users')), [])
+
+    def test_inventory_task(self):
+        """``FileBackend`` stores the result of the admin inventory, whose first argument is the page"""
+        self.backend.store_result('task-1', {'content': {}, 'error': None}, 'SUCCESS',
+                                  request=self.make_request(task='insightiq.inventory', args=(1, 100, 'someTxn')))
+
+        output = self.backend.get_task_meta('task-1')
+
+        self.assertEqual(output['status'], 'SUCCESS')
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'users')), [])
+
+    def test_standby_refill_task(self):
+        """``FileBackend`` does not index refilling standby VMs under a user named after the image"""
+        self.backend.store_result('task-1', {}, 'SUCCESS',
+                                  request=self.make_request(task='insightiq.standby_refill', args=('4.1.2', 'someTxn')))
+
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'users')), [])
+
+    def test_cleanup(self):
+        """``FileBackend.cleanup`` deletes expired results"""
+        self.backend.store_result('task-1', {}, 'SUCCESS', request=self.make_request())
+        key = self.backend.get_key_for_task('task-1')
+        os.utime(self.backend._filename(key), (0, 0))
+
+        self.backend.cleanup()
+
+        self.assertFalse(os.path.exists(self.backend._filename(key)))
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'users', 'alice')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in session.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib.worker import session
+
+
+class TestSessionPool(unittest.TestCase):
+    """A set of test cases for the SessionPool object"""
+
+    def test_session(self):
+        """``SessionPool.session`` logs into vCenter when the pool is empty"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+
+        with pool.session() as vcenter:
+            pass
+
+        self.assertTrue(vcenter is fake_factory.return_value)
+
+    def test_session_reuse(self):
+        """``SessionPool.session`` reuses idle sessions instead of logging in again"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+
+        with pool.session():
+            pass
+        with pool.session():
+            pass
+
+        self.assertEqual(fake_factory.call_count, 1)
+
+    def test_session_concurrent(self):
+        """``SessionPool.session`` hands out different sessions to concurrent users"""
+        fake_factory = MagicMock()
+        fake_factory.side_effect = [MagicMock(), MagicMock()]
+        pool = session.SessionPool(fake_factory)
+
+        with pool.session() as vcenter1:
+            with pool.session() as vcenter2:
+                pass
+
+        self.assertFalse(vcenter1 is vcenter2)
+
+    def test_session_size(self):
+        """``SessionPool.session`` logs out of sessions once the pool is full"""
+        fake_vcenter1 = MagicMock()
+        fake_vcenter2 = MagicMock()
+        fake_factory = MagicMock()
+        fake_factory.side_effect = [fake_vcenter1, fake_vcenter2]
+        pool = session.SessionPool(fake_factory, size=1)
+
+        with pool.session():
+            with pool.session():
+                pass
+
+        self.assertEqual(fake_vcenter1.close.call_count + fake_vcenter2.close.call_count, 1)
+
+    @patch.object(session.time, 'time')
+    def test_session_keepalive(self, fake_time):
+        """``SessionPool.session`` checks if idle sessions are still logged in"""
+        fake_time.side_effect = [100, 500, 500]
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory, keepalive=60)
+
+        with pool.session() as vcenter:
+            pass
+        with pool.session():
+            pass
+
+        self.assertEqual(fake_factory.call_count, 1)
+        self.assertTrue(vcenter.content.sessionManager.currentSession is not None)
+
+    @patch.object(session.time, 'time')
+    def test_session_expired(self, fake_time):
+        """``SessionPool.session`` logs in again if the idle session expired"""
+        fake_time.side_effect = [100, 500, 500]
+        fake_factory = MagicMock()
+        fake_factory.return_value.content.sessionManager.currentSession = None
+        pool = session.SessionPool(fake_factory, keepalive=60)
+
+        with pool.session():
+            pass
+        with pool.session():
+            pass
+
+        self.assertEqual(fake_factory.call_count, 2)
+
+    def test_session_not_authenticated(self):
+        """``SessionPool.session`` discards sessions that raise NotAuthenticated"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+
+        with self.assertRaises(session.vim.fault.NotAuthenticated):
+            with pool.session():
+                raise session.vim.fault.NotAuthenticated()
+        with pool.session():
+            pass
+
+        self.assertEqual(fake_factory.call_count, 2)
+
+    def test_session_other_error(self):
+        """``SessionPool.session`` keeps the session if the task raises a non-session error"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+
+        with self.assertRaises(ValueError):
+            with pool.session():
+                raise ValueError('testing')
+        with pool.session():
+            pass
+
+        self.assertEqual(fake_factory.call_count, 1)
+
+    @patch.object(session.os, 'getpid')
+    def test_session_fork(self, fake_getpid):
+        """``SessionPool.session`` does not reuse sessions from a parent process"""
+        fake_getpid.side_effect = [1, 1, 1, 2, 2, 2]
+        fake_factory = MagicMock()
+        fake_factory.side_effect = [MagicMock(), MagicMock()]
+        pool = session.SessionPool(fake_factory)
+
+        with pool.session() as vcenter:
+            pass
+        with pool.session():
+            pass
+
+        self.assertEqual(fake_factory.call_count, 2)
+        self.assertFalse(vcenter.close.called)
+
+    def test_run(self):
+        """``SessionPool.run`` calls the function with a session, and returns its answer"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+
+        output = pool.run(lambda vcenter, x: (vcenter, x), 'foo')
+
+        self.assertEqual(output, (fake_factory.return_value, 'foo'))
+
+    def test_run_expired(self):
+        """``SessionPool.run`` logs in again, and retries once, when the session expired"""
+        fake_factory = MagicMock()
+        fake_factory.side_effect = [MagicMock(), MagicMock()]
+        pool = session.SessionPool(fake_factory)
+        fake_func = MagicMock()
+        fake_func.side_effect = [session.vim.fault.NotAuthenticated(), 'worked']
+
+        output = pool.run(fake_func)
+
+        self.assertEqual(output, 'worked')
+        self.assertEqual(fake_factory.call_count, 2)
+
+    def test_run_expired_twice(self):
+        """``SessionPool.run`` only retries once"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+        fake_func = MagicMock()
+        fake_func.side_effect = session.vim.fault.NotAuthenticated()
+
+        with self.assertRaises(session.vim.fault.NotAuthenticated):
+            pool.run(fake_func)
+
+        self.assertEqual(fake_func.call_count, 2)
+
+    def test_run_other_error(self):
+        """``SessionPool.run`` doesn't retry errors that aren't about the session"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+        fake_func = MagicMock()
+        fake_func.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            pool.run(fake_func)
+
+        self.assertEqual(fake_func.call_count, 1)
+
+    def test_clear(self):
+        """``SessionPool.clear`` logs out of all idle sessions"""
+        fake_factory = MagicMock()
+        pool = session.SessionPool(fake_factory)
+
+        with pool.session() as vcenter:
+            pass
+        pool.clear()
+
+        self.assertTrue(vcenter.close.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in standby.py
+"""
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib.worker import standby
+
+
+ON = standby.vim.VirtualMachinePowerState.poweredOn
+OFF = standby.vim.VirtualMachinePowerState.poweredOff
+
+
+class TestStandby(unittest.TestCase):
+    """A set of test cases for the standby.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings = standby.const._replace(VLAB_INSIGHTIQ_STANDBY_SIZE=2,
+                                          VLAB_INSIGHTIQ_STANDBY_VERSIONS='4.1.2, 4.2.0',
+                                          VLAB_INSIGHTIQ_CACHE_DIR=self.cache_dir)
+        patcher = patch.object(standby, 'const', settings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_versions(self):
+        """``versions`` returns the configured versions"""
+        self.assertEqual(standby.versions(), ['4.1.2', '4.2.0'])
+
+    def test_versions_disabled(self):
+        """``versions`` returns an empty list when the pool size is zero"""
+        with patch.object(standby, 'const', standby.const._replace(VLAB_INSIGHTIQ_STANDBY_SIZE=0)):
+            self.assertEqual(standby.versions(), [])
+
+    def test_enabled(self):
+        """``enabled`` is only True for the configured versions"""
+        self.assertTrue(standby.enabled('4.2.0'))
+        self.assertFalse(standby.enabled('4.3.1'))
+
+    def test_standby_name(self):
+        """``standby_name`` makes unique names that contain the version"""
+        first = standby.standby_name('4.1.2')
+        second = standby.standby_name('4.1.2')
+
+        self.assertTrue(first.startswith('insightiq-standby-4.1.2-'))
+        self.assertNotEqual(first, second)
+
+    @patch.object(standby.inventory, 'find_folder')
+    def test_folder_makes(self, fake_find_folder):
+        """``folder`` creates the holding folder when it does not exist"""
+        fake_vcenter = MagicMock()
+        fake_find_folder.side_effect = [ValueError('no folder'), 'theFolder']
+
+        output = standby.folder(fake_vcenter)
+
+        self.assertEqual(output, 'theFolder')
+        fake_vcenter.create_vm_folder.assert_called_with('vlab/insightiq-standby')
+
+    @patch.object(standby.inventory, 'insightiq_objects')
+    def test_find_standby(self, fake_insightiq_objects):
+        """``find_standby`` only returns the standby VMs of the version"""
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': ('vm1', ON),
+                                               'insightiq-standby-4.2.0-bbbb': ('vm2', ON)}
+
+        output = standby.find_standby(MagicMock(), 'theFolder', '4.1.2')
+
+        self.assertEqual(list(output.keys()), ['insightiq-standby-4.1.2-aaaa'])
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` moves a powered on standby VM into the user's folder, and renames it"""
+        fake_vm = _standby_vm(fake_find_folder.return_value)
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (MagicMock(), OFF),
+                                               'insightiq-standby-4.1.2-bbbb': (fake_vm, ON)}
+
+        output = standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is fake_vm)
+        fake_find_folder.return_value.MoveIntoFolder_Task.assert_called_with([fake_vm])
+        fake_vm.Rename_Task.assert_called_with('myIIQ')
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_change_version(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` renames the VM only if no one changed it since it was looked up"""
+        fake_vm = _standby_vm(fake_find_folder.return_value)
+        fake_vm.config.changeVersion = 'v1'
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (fake_vm, ON)}
+
+        standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+        spec = fake_vm.ReconfigVM_Task.call_args[0][0]
+
+        self.assertEqual(spec.changeVersion, 'v1')
+        self.assertTrue(spec.name.startswith('insightiq-standby-claim-'))
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_lost_race(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` tries the next standby VM when another task claimed the first one"""
+        taken = _standby_vm(fake_find_folder.return_value)
+        taken.ReconfigVM_Task.side_effect = None
+        fake_vm = _standby_vm(fake_find_folder.return_value)
+        fake_consume_task.side_effect = lambda task: _fail_task(task, taken.ReconfigVM_Task.return_value)
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (taken, ON),
+                                               'insightiq-standby-4.1.2-bbbb': (fake_vm, ON)}
+
+        output = standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is fake_vm)
+        self.assertFalse(taken.Rename_Task.called)
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_renamed(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` does not move a VM whose name isn't the claim name after renaming it"""
+        fake_vm = _standby_vm(fake_find_folder.return_value)
+        fake_vm.ReconfigVM_Task.side_effect = None
+        fake_vm.name = 'someone-else'
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (fake_vm, ON)}
+
+        output = standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_find_folder.return_value.MoveIntoFolder_Task.called)
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_moved(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` does not take a VM that's no longer in the holding folder"""
+        fake_vm = _standby_vm(MagicMock())
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (fake_vm, ON)}
+
+        output = standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_find_folder.return_value.MoveIntoFolder_Task.called)
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_move_fails(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` puts the VM back in the pool if moving it to the user's folder fails"""
+        fake_vm = _standby_vm(fake_find_folder.return_value)
+        move = fake_find_folder.return_value.MoveIntoFolder_Task.return_value
+        fake_consume_task.side_effect = lambda task: _fail_task(task, move)
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (fake_vm, ON)}
+
+        with self.assertRaises(RuntimeError):
+            standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+        new_name = fake_vm.Rename_Task.call_args[0][0]
+
+        self.assertTrue(new_name.startswith('insightiq-standby-4.1.2-'))
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_none(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` returns None when no standby VM is powered on"""
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (MagicMock(), OFF)}
+
+        output = standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_booting(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` skips standby VMs that are still booting"""
+        booting = _standby_vm(fake_find_folder.return_value)
+        booting.guest.ipAddress = None
+        fake_vm = _standby_vm(fake_find_folder.return_value)
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (booting, ON),
+                                               'insightiq-standby-4.1.2-bbbb': (fake_vm, ON)}
+
+        output = standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is fake_vm)
+        self.assertFalse(booting.ReconfigVM_Task.called)
+
+    @patch.object(standby, 'consume_task')
+    @patch.object(standby.inventory, 'insightiq_objects')
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_none_booted(self, fake_find_folder, fake_insightiq_objects, fake_consume_task):
+        """``claim`` returns None when every powered on standby VM is still booting"""
+        booting = MagicMock()
+        booting.guest.ipAddress = None
+        fake_insightiq_objects.return_value = {'insightiq-standby-4.1.2-aaaa': (booting, ON)}
+
+        output = standby.claim(MagicMock(), '4.1.2', 'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(standby.inventory, 'find_folder')
+    def test_claim_bad_name(self, fake_find_folder):
+        """``claim`` raises ValueError for an invalid machine name"""
+        with self.assertRaises(ValueError):
+            standby.claim(MagicMock(), '4.1.2', 'alice', 'my_IIQ!', MagicMock())
+
+
+def _standby_vm(holding_folder):
+    """Make a fake, booted standby VM that takes the name it's reconfigured with"""
+    the_vm = MagicMock()
+    the_vm.guest.ipAddress = '192.168.1.10'
+    the_vm.parent = holding_folder
+    the_vm.config.changeVersion = '2026-01-01T00:00:00.000000Z'
+
+    def reconfigure(spec):
+        the_vm.name = spec.name
+        return MagicMock()
+
+    the_vm.ReconfigVM_Task.side_effect = reconfigure
+    return the_vm
+
+
+def _fail_task(task, failing):
+    """Stand in for ``consume_task``, failing only one of the tasks"""
+    if task is failing:
+        raise RuntimeError('Cannot complete operation due to concurrent modification by another operation.')
+
+
+if __name__ == '__main__':
+    unittest.main()
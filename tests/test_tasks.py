@@ -2,27 +2,39 @@
 """
 A suite of tests for the functions in tasks.py
 """
+import inspect
 import unittest
 from unittest.mock import patch, MagicMock
 
+from celery.exceptions import Retry
+
 from vlab_insightiq_api.lib.worker import tasks
 
 
 class TestTasks(unittest.TestCase):
     """A set of test cases for tasks.py"""
+    def setUp(self):
+        """Runs before every test case"""
+        patcher = patch.object(tasks, 'show_cache')
+        self.fake_show_cache = patcher.start()
+        self.fake_show_cache.get.return_value = None
+        self.addCleanup(patcher.stop)
+
     @patch.object(tasks, 'vmware')
     def test_show_ok(self, fake_vmware):
         """``show`` returns a dictionary when everything works as expected"""
-        fake_vmware.show_insightiq.return_value = {'worked': True}
+        fake_vmware.mirrored_insightiq.return_value = None
+        fake_vmware.show_insightiq.return_value = {'myIIQ': {'worked': True}}
 
         output = tasks.show(username='bob', txn_id='myId')
-        expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
+        expected = {'content' : {'myIIQ': {'worked': True}}, 'error': None, 'params': {}}
 
         self.assertEqual(output, expected)
 
     @patch.object(tasks, 'vmware')
     def test_show_value_error(self, fake_vmware):
         """``show`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.mirrored_insightiq.return_value = None
         fake_vmware.show_insightiq.side_effect = [ValueError("testing")]
 
         output = tasks.show(username='bob', txn_id='myId')
@@ -30,6 +42,73 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_show_cached(self, fake_vmware):
+        """``show`` returns the cached result without calling vCenter"""
+        self.fake_show_cache.get.return_value = {'cached': True}
+
+        output = tasks.show(username='bob', txn_id='myId')
+        expected = {'content' : {'cached': True}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_vmware.show_insightiq.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_cached_consoles(self, fake_vmware):
+        """``show`` doesn't call vCenter to make console URLs for a cached result"""
+        self.fake_show_cache.get.return_value = {'myIIQ': {'console': None}}
+
+        output = tasks.show(username='bob', txn_id='myId')
+
+        self.assertEqual(output['content'], {'myIIQ': {'console': None}})
+        self.assertFalse(fake_vmware.add_consoles.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_no_cached_consoles(self, fake_vmware):
+        """``show`` doesn't cache console URLs, because their tickets are single use"""
+        fake_vmware.mirrored_insightiq.return_value = None
+        fake_vmware.show_insightiq.return_value = {'myIIQ': {'console': 'https://vcenter/ticket'}}
+
+        output = tasks.show(username='bob', txn_id='myId')
+        _, cached, _ = self.fake_show_cache.set.call_args[0]
+
+        self.assertEqual(cached, {'myIIQ': {'console': None}})
+        self.assertEqual(output['content'], {'myIIQ': {'console': 'https://vcenter/ticket'}})
+
+    @patch.object(tasks, 'vmware')
+    def test_show_mirror(self, fake_vmware):
+        """``show`` answers from the inventory mirror when it's caught up with the user's last change"""
+        self.fake_show_cache.changed.return_value = 100
+        fake_vmware.mirrored_insightiq.return_value = MagicMock(data={'myIIQ': {}}, version='7', as_of=105)
+
+        output = tasks.show(username='bob', txn_id='myId')
+        _, since = fake_vmware.mirrored_insightiq.call_args
+        _, _, cached_as_of = self.fake_show_cache.set.call_args[0]
+
+        self.assertEqual(output['content'], {'myIIQ': {}})
+        self.assertFalse(fake_vmware.show_insightiq.called)
+        self.assertEqual(since, {'since': 100})
+        self.assertEqual(cached_as_of, 105)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_sets_cache(self, fake_vmware):
+        """``show`` caches the result it obtained from vCenter"""
+        fake_vmware.show_insightiq.return_value = {'worked': True}
+
+        tasks.show(username='bob', txn_id='myId')
+
+        self.assertTrue(self.fake_show_cache.set.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_error_not_cached(self, fake_vmware):
+        """``show`` does not cache errors"""
+        fake_vmware.mirrored_insightiq.return_value = None
+        fake_vmware.show_insightiq.side_effect = [ValueError("testing")]
+
+        tasks.show(username='bob', txn_id='myId')
+
+        self.assertFalse(self.fake_show_cache.set.called)
+
     @patch.object(tasks, 'vmware')
     def test_create_ok(self, fake_vmware):
         """``create`` returns a dictionary when everything works as expected"""
@@ -50,6 +129,15 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_create_invalidates(self, fake_vmware):
+        """``create`` invalidates the user's cached ``show`` result"""
+        fake_vmware.create_insightiq.return_value = {'worked': True}
+
+        tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someNetwork', txn_id='myId')
+
+        self.fake_show_cache.invalidate.assert_called_with('bob')
+
     @patch.object(tasks, 'vmware')
     def test_delete_ok(self, fake_vmware):
         """``delete`` returns a dictionary when everything works as expected"""
@@ -70,6 +158,178 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_delete_invalidates(self, fake_vmware):
+        """``delete`` invalidates the user's cached ``show`` result, even if the delete failed"""
+        fake_vmware.delete_insightiq.side_effect = [ValueError("testing")]
+
+        tasks.delete(username='bob', machine_name='myIIQ', txn_id='myId')
+
+        self.fake_show_cache.invalidate.assert_called_with('bob')
+
+    @patch.object(tasks, 'const', tasks.const._replace(VLAB_INSIGHTIQ_ASYNC_DELETE=True))
+    @patch.object(tasks, 'vmware')
+    def test_delete_async(self, fake_vmware):
+        """``delete`` does not block on vCenter when async deletes are enabled"""
+        fake_vmware.delete_insightiq.return_value = 'task-1234'
+        fake_vmware.destroy_done.return_value = False
+
+        with self.assertRaises(Retry):
+            tasks.delete(username='bob', machine_name='myIIQ', txn_id='myId')
+
+        fake_vmware.delete_insightiq.assert_called_with('bob', 'myIIQ', unittest.mock.ANY, wait=False)
+
+    @patch.object(tasks, 'vmware')
+    def test_delete_tracking(self, fake_vmware):
+        """``delete`` only checks on the vCenter task when retried"""
+        fake_vmware.destroy_done.return_value = True
+
+        output = tasks.delete(username='bob', machine_name='myIIQ', txn_id='myId', vcenter_task='task-1234')
+        expected = {'content' : {}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_vmware.delete_insightiq.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_delete_tracking_failed(self, fake_vmware):
+        """``delete`` sets the error if vCenter fails to destroy the VM"""
+        fake_vmware.destroy_done.side_effect = RuntimeError('testing')
+
+        output = tasks.delete(username='bob', machine_name='myIIQ', txn_id='myId', vcenter_task='task-1234')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_delete_blocking_failed(self, fake_vmware):
+        """``delete`` sets the error if the vCenter task it blocked on failed"""
+        fake_vmware.delete_insightiq.side_effect = RuntimeError('testing')
+
+        output = tasks.delete(username='bob', machine_name='myIIQ', txn_id='myId')
+
+        self.assertEqual(output['error'], 'testing')
+
+    @patch.object(tasks, 'vmware')
+    def test_delete_blocking(self, fake_vmware):
+        """``delete`` does not track a vCenter task when it blocked on the delete"""
+        fake_vmware.delete_insightiq.return_value = None
+
+        tasks.delete(username='bob', machine_name='myIIQ', txn_id='myId')
+
+        self.assertFalse(fake_vmware.destroy_done.called)
+
+    @patch.object(tasks.create, 'update_state')
+    @patch.object(tasks, 'vmware')
+    def test_create_progress(self, fake_vmware, fake_update_state):
+        """``create`` publishes the phase of the deploy as the task's progress"""
+        def fake_create(username, machine_name, image, network, logger, progress, written):
+            progress('uploading', 42)
+            return {}
+        fake_vmware.create_insightiq.side_effect = fake_create
+
+        tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someLAN', txn_id='myId')
+
+        fake_update_state.assert_called_with(state='PROGRESS', meta={'phase': 'uploading', 'percent': 42})
+
+    @patch.object(tasks, 'admission')
+    @patch.object(tasks, 'vmware')
+    def test_create_written(self, fake_vmware, fake_admission):
+        """``create`` frees up its deploy slot once the VM is written, before the deploy is done"""
+        fake_admission.admit.return_value = (True, 0)
+        def fake_create(username, machine_name, image, network, logger, progress, written):
+            written()
+            self.assertTrue(fake_admission.release.called)
+            return {}
+        fake_vmware.create_insightiq.side_effect = fake_create
+
+        output = tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someLAN', txn_id='myId')
+
+        self.assertEqual(output['error'], None)
+
+    @patch.object(tasks, '_shared_results', return_value=True)
+    @patch.object(tasks.app, 'AsyncResult')
+    @patch.object(tasks.create, 'delay')
+    def test_create_batch(self, fake_delay, fake_AsyncResult, fake_shared_results):
+        """``create_batch`` sends an ``insightiq.create`` task per instance, and returns what they made"""
+        fake_delay.side_effect = lambda username, name, image, network, txn_id: MagicMock(id='task-{}'.format(name))
+        fake_AsyncResult.return_value.state = 'SUCCESS'
+        fake_AsyncResult.return_value.result = {'content': {'iiq1': {'worked': True}}, 'error': None, 'params': {}}
+
+        output = tasks.create_batch(username='bob', machine_names=['iiq1'], image='4.1.2',
+                                    network='someLAN', txn_id='myId')
+        expected = {'content' : {'created': {'iiq1': {'worked': True}}, 'failed': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        fake_delay.assert_called_with('bob', 'iiq1', '4.1.2', 'someLAN', 'myId')
+        fake_AsyncResult.assert_called_with('task-iiq1')
+
+    @patch.object(tasks, '_shared_results', return_value=True)
+    @patch.object(tasks.app, 'AsyncResult')
+    @patch.object(tasks.create, 'delay')
+    def test_create_batch_partial(self, fake_delay, fake_AsyncResult, fake_shared_results):
+        """``create_batch`` sets the error if some instances could not be created"""
+        results = {'task-iiq1': MagicMock(state='SUCCESS', result={'content': {'iiq1': {}}, 'error': None}),
+                   'task-iiq2': MagicMock(state='SUCCESS', result={'content': {}, 'error': 'testing'}),
+                   'task-iiq3': MagicMock(state='FAILURE', result=RuntimeError('killed'))}
+        fake_AsyncResult.side_effect = lambda task_id: results[task_id]
+
+        output = tasks.create_batch(username='bob', machine_names=['iiq1', 'iiq2', 'iiq3'], image='4.1.2',
+                                    network='someLAN', txn_id='myId',
+                                    children={x: 'task-{}'.format(x) for x in ['iiq1', 'iiq2', 'iiq3']})
+
+        self.assertEqual(output['error'], 'Failed to create 2 of 3 instances')
+        self.assertEqual(output['content']['failed'], {'iiq2': 'testing', 'iiq3': 'killed'})
+        self.assertFalse(fake_delay.called)
+
+    @patch.object(tasks, '_shared_results', return_value=False)
+    @patch.object(tasks.create, 'delay')
+    def test_create_batch_rpc(self, fake_delay, fake_shared_results):
+        """``create_batch`` fails without sending anything when it can't read the results of other tasks"""
+        output = tasks.create_batch(username='bob', machine_names=['iiq1'], image='4.1.2',
+                                    network='someLAN', txn_id='myId')
+
+        self.assertTrue(output['error'])
+        self.assertFalse(fake_delay.called)
+
+    @patch.object(tasks.create_batch, 'update_state')
+    @patch.object(tasks, '_resend')
+    @patch.object(tasks.app, 'AsyncResult')
+    def test_create_batch_progress(self, fake_AsyncResult, fake_resend, fake_update_state):
+        """``create_batch`` reports the instances that are done, and checks again later, while some are still being made"""
+        results = {'task-iiq1': MagicMock(state='SUCCESS', result={'content': {'iiq1': {'worked': True}}, 'error': None}),
+                   'task-iiq2': MagicMock(state='PROGRESS')}
+        fake_AsyncResult.side_effect = lambda task_id: results[task_id]
+        fake_resend.side_effect = tasks.Ignore()
+        children = {'iiq1': 'task-iiq1', 'iiq2': 'task-iiq2'}
+
+        with self.assertRaises(tasks.Ignore):
+            tasks.create_batch(username='bob', machine_names=['iiq1', 'iiq2'], image='4.1.2',
+                               network='someLAN', txn_id='myId', children=children)
+        _, countdown = fake_resend.call_args[0]
+
+        fake_update_state.assert_called_with(state='PROGRESS', meta={'created': {'iiq1': {'worked': True}}, 'failed': {}})
+        self.assertEqual(fake_resend.call_args[1], {'children': children})
+        self.assertEqual(countdown, tasks.const.VLAB_INSIGHTIQ_TASK_POLL_INTERVAL)
+
+    @patch.object(tasks, 'vmware')
+    def test_delete_batch(self, fake_vmware):
+        """``delete_batch`` returns the deleted and failed instances"""
+        fake_vmware.delete_insightiqs.return_value = (['iiq1'], {})
+
+        output = tasks.delete_batch(username='bob', machine_names=['iiq1'], txn_id='myId')
+        expected = {'content' : {'deleted': ['iiq1'], 'failed': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_delete_batch_partial(self, fake_vmware):
+        """``delete_batch`` sets the error if some instances could not be deleted"""
+        fake_vmware.delete_insightiqs.return_value = (['iiq1'], {'iiq2': 'testing'})
+
+        output = tasks.delete_batch(username='bob', machine_names=None, txn_id='myId')
+
+        self.assertEqual(output['error'], 'Failed to delete 1 of 2 instances')
+
     @patch.object(tasks, 'vmware')
     def test_image(self, fake_vmware):
         """``image`` returns a dictionary when everything works as expected"""
@@ -80,6 +340,61 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_inventory(self, fake_vmware, fake_inventory_cache):
+        """``inventory`` returns a page of owners, and totals for every owner"""
+        fake_vmware.mirrored_inventory.return_value = None
+        fake_inventory_cache.get.return_value = None
+        fake_vmware.inventory_insightiq.return_value = {'alice': {'4.1.2': {'a1': {}, 'a2': {}}},
+                                                         'bob': {'4.1.2': {'b1': {}}, '4.1.3': {'b2': {}}},
+                                                         'sam': {'4.1.3': {'s1': {}}}}
+
+        output = tasks.inventory(page=2, per_page=2, txn_id='myId')
+
+        self.assertEqual(list(output['content']['owners'].keys()), ['sam'])
+        self.assertEqual(output['content']['pages'], 2)
+        self.assertEqual(output['content']['total_owners'], 3)
+        self.assertEqual(output['content']['total_vms'], 5)
+        self.assertEqual(output['content']['versions'], {'4.1.2': 3, '4.1.3': 2})
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_inventory_cached(self, fake_vmware, fake_inventory_cache):
+        """``inventory`` pages through the cached inventory without calling vCenter"""
+        fake_inventory_cache.get.return_value = {'owners': {'alice': {'4.1.2': {'a1': {}}}}, 'generated': 1234}
+
+        output = tasks.inventory(page=1, per_page=10, txn_id='myId')
+
+        self.assertFalse(fake_vmware.inventory_insightiq.called)
+        self.assertEqual(output['content']['generated'], 1234)
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_inventory_mirror(self, fake_vmware, fake_inventory_cache):
+        """``inventory`` pages through the inventory mirror without calling vCenter"""
+        fake_inventory_cache.get.return_value = None
+        fake_vmware.mirrored_inventory.return_value = MagicMock(data={'alice': {'4.1.2': {'a1': {}}}}, version='7', as_of=1234)
+
+        output = tasks.inventory(page=1, per_page=10, txn_id='myId')
+
+        self.assertFalse(fake_vmware.inventory_insightiq.called)
+        self.assertEqual(output['content']['total_vms'], 1)
+        self.assertEqual(output['content']['generated'], 1234)
+
+    @patch.object(tasks, 'inventory_cache')
+    @patch.object(tasks, 'vmware')
+    def test_inventory_value_error(self, fake_vmware, fake_inventory_cache):
+        """``inventory`` sets the error in the dictionary to the ValueError message, and caches nothing"""
+        fake_vmware.mirrored_inventory.return_value = None
+        fake_inventory_cache.get.return_value = None
+        fake_vmware.inventory_insightiq.side_effect = [ValueError("testing")]
+
+        output = tasks.inventory(page=1, per_page=10, txn_id='myId')
+
+        self.assertEqual(output['error'], 'testing')
+        self.assertFalse(fake_inventory_cache.set.called)
+
     @patch.object(tasks, 'vmware')
     def test_modify_network(self, fake_vmware):
         """``modify_network`` returns an empty content dictionary upon success"""
@@ -105,5 +420,203 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_modify_network_invalidates(self, fake_vmware):
+        """``modify_network`` invalidates the user's cached ``show`` result"""
+        tasks.modify_network(username='pat',
+                             machine_name='myIIQ',
+                             new_network='wootTown',
+                             txn_id='someTransactionID')
+
+        self.fake_show_cache.invalidate.assert_called_with('pat')
+
+    @patch.object(tasks.create, 'apply_async')
+    @patch.object(tasks.create, 'update_state')
+    @patch.object(tasks, 'admission')
+    @patch.object(tasks, 'vmware')
+    def test_create_queued(self, fake_vmware, fake_admission, fake_update_state, fake_apply_async):
+        """``create`` goes back on the queue when it's not its turn to deploy"""
+        fake_admission.admit.return_value = (False, 3)
+
+        with self.assertRaises(tasks.Ignore):
+            tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someNetwork', txn_id='myId')
+
+        fake_update_state.assert_called_with(state='QUEUED', meta={'position': 3})
+        self.assertTrue(fake_apply_async.called)
+        self.assertFalse(fake_vmware.create_insightiq.called)
+
+    @patch.object(tasks.create, 'apply_async')
+    @patch.object(tasks.create, 'update_state')
+    @patch.object(tasks, 'admission')
+    def test_wait_for_slot_request_options(self, fake_admission, fake_update_state, fake_apply_async):
+        """``_wait_for_slot`` puts the task back on the queue with the options of the original request"""
+        fake_admission.admit.return_value = (False, 3)
+        fake_admission.interval = 5
+        tasks.create.push_request(id='task-1', args=['bob', 'myIIQ', '4.1.2', 'someNetwork', 'myId'], kwargs={},
+                                  reply_to='someReplyQueue', correlation_id='task-1',
+                                  delivery_info={'exchange': '', 'routing_key': 'deploys', 'priority': 4})
+        self.addCleanup(tasks.create.pop_request)
+
+        with self.assertRaises(tasks.Ignore):
+            tasks._wait_for_slot(tasks.create, 'bob', MagicMock())
+        _, the_kwargs = fake_apply_async.call_args
+
+        self.assertEqual(the_kwargs['reply_to'], 'someReplyQueue')
+        self.assertEqual(the_kwargs['task_id'], 'task-1')
+        self.assertEqual(the_kwargs['queue'], 'deploys')
+        self.assertEqual(the_kwargs['priority'], 4)
+        self.assertEqual(the_kwargs['countdown'], 5)
+
+    @patch.object(tasks.create_batch, 'signature_from_request')
+    def test_resend_kwargs(self, fake_signature_from_request):
+        """``_resend`` runs the task again with the same keyword arguments, plus the supplied ones"""
+        tasks.create_batch.push_request(id='task-1', args=['bob'], kwargs={'children': {'a': 'old'}, 'other': 1})
+        self.addCleanup(tasks.create_batch.pop_request)
+
+        with self.assertRaises(tasks.Ignore):
+            tasks._resend(tasks.create_batch, 2, children={'a': 'new'})
+        the_kwargs = fake_signature_from_request.call_args[1]
+
+        self.assertEqual(the_kwargs, {'kwargs': {'children': {'a': 'new'}, 'other': 1}, 'countdown': 2})
+
+    @patch.object(tasks, 'admission')
+    @patch.object(tasks, 'vmware')
+    def test_create_releases_slot(self, fake_vmware, fake_admission):
+        """``create`` frees up its deploy slot when it's done"""
+        fake_admission.admit.return_value = (True, 0)
+        fake_vmware.create_insightiq.side_effect = [RuntimeError('testing')]
+
+        with self.assertRaises(RuntimeError):
+            tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someNetwork', txn_id='myId')
+
+        self.assertTrue(fake_admission.release.called)
+
+    @patch.object(tasks, 'standby_refill')
+    @patch.object(tasks.standby, 'enabled', return_value=True)
+    @patch.object(tasks, 'vmware')
+    def test_create_refills_standby(self, fake_vmware, fake_enabled, fake_standby_refill):
+        """``create`` sends a task to replace the standby VM it used"""
+        fake_vmware.create_insightiq.return_value = {'worked': True}
+
+        tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someNetwork', txn_id='myId')
+
+        fake_standby_refill.delay.assert_called_with('4.1.2', 'myId')
+
+    @patch.object(tasks, 'standby_refill')
+    @patch.object(tasks, 'vmware')
+    def test_create_no_standby(self, fake_vmware, fake_standby_refill):
+        """``create`` does not refill the standby pool of versions that don't have one"""
+        fake_vmware.create_insightiq.return_value = {'worked': True}
+
+        tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someNetwork', txn_id='myId')
+
+        self.assertFalse(fake_standby_refill.delay.called)
+
+    @patch.object(tasks, 'const', tasks.const._replace(VLAB_INSIGHTIQ_IP_AT_POWER_ON=True))
+    @patch.object(tasks, 'fill_ip')
+    @patch.object(tasks, 'vmware')
+    def test_create_fill_ip(self, fake_vmware, fake_fill_ip):
+        """``create`` sends a task to fill in the IP when it doesn't wait for one"""
+        fake_vmware.create_insightiq.return_value = {'myIIQ': {'ips': []}}
+
+        tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someNetwork', txn_id='myId')
+
+        self.assertTrue(fake_fill_ip.delay.called)
+
+    @patch.object(tasks, 'fill_ip')
+    @patch.object(tasks, 'vmware')
+    def test_create_no_fill_ip(self, fake_vmware, fake_fill_ip):
+        """``create`` doesn't send a task to fill in the IP by default"""
+        fake_vmware.create_insightiq.return_value = {'myIIQ': {'ips': ['10.1.1.1']}}
+
+        tasks.create(username='bob', machine_name='myIIQ', image='4.1.2', network='someNetwork', txn_id='myId')
+
+        self.assertFalse(fake_fill_ip.delay.called)
+
+    @patch.object(tasks, 'app')
+    @patch.object(tasks, 'vmware')
+    def test_fill_ip(self, fake_vmware, fake_app):
+        """``fill_ip`` adds the IP to the result of the create task"""
+        fake_vmware.wait_for_ip.return_value = {'myIIQ': {'ips': ['10.1.1.1']}}
+        fake_app.AsyncResult.return_value.state = 'SUCCESS'
+        fake_app.AsyncResult.return_value.result = {'content': {'myIIQ': {'ips': []}}, 'error': None, 'params': {}}
+
+        tasks.fill_ip(username='bob', machine_name='myIIQ', create_task_id='someTask', txn_id='myId')
+        the_args, _ = fake_app.backend.store_result.call_args
+        expected = ('someTask', {'content': {'myIIQ': {'ips': ['10.1.1.1']}}, 'error': None, 'params': {}}, 'SUCCESS')
+
+        self.assertEqual(the_args, expected)
+
+    @patch.object(tasks, 'app')
+    @patch.object(tasks, 'vmware')
+    def test_fill_ip_error(self, fake_vmware, fake_app):
+        """``fill_ip`` doesn't change the create result when the VM never gets an IP"""
+        fake_vmware.wait_for_ip.side_effect = [RuntimeError('testing')]
+
+        output = tasks.fill_ip(username='bob', machine_name='myIIQ', create_task_id='someTask', txn_id='myId')
+
+        self.assertEqual(output['error'], 'testing')
+        self.assertFalse(fake_app.backend.store_result.called)
+
+    @patch.object(tasks.standby_refill, 'delay')
+    @patch.object(tasks, 'vmware')
+    def test_standby_refill(self, fake_vmware, fake_delay):
+        """``standby_refill`` returns the names of the new standby VMs"""
+        fake_vmware.refill_standby.return_value = ['insightiq-standby-4.1.2-aaaa']
+
+        output = tasks.standby_refill(image='4.1.2', txn_id='myId')
+        expected = {'content' : {'created': ['insightiq-standby-4.1.2-aaaa']}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks.standby_refill, 'delay')
+    @patch.object(tasks, 'vmware')
+    def test_standby_refill_next(self, fake_vmware, fake_delay):
+        """``standby_refill`` sends another refill task after deploying a standby VM"""
+        fake_vmware.refill_standby.return_value = ['insightiq-standby-4.1.2-aaaa']
+
+        tasks.standby_refill(image='4.1.2', txn_id='myId')
+
+        fake_delay.assert_called_with('4.1.2', 'myId')
+
+    @patch.object(tasks.standby_refill, 'delay')
+    @patch.object(tasks, 'vmware')
+    def test_standby_refill_full(self, fake_vmware, fake_delay):
+        """``standby_refill`` stops sending refill tasks once the pool is full"""
+        fake_vmware.refill_standby.return_value = []
+
+        tasks.standby_refill(image='4.1.2', txn_id='myId')
+
+        self.assertFalse(fake_delay.called)
+
+    @patch.object(tasks.standby_refill, 'delay')
+    @patch.object(tasks, 'vmware')
+    def test_standby_refill_value_error(self, fake_vmware, fake_delay):
+        """``standby_refill`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.refill_standby.side_effect = [ValueError('testing')]
+
+        output = tasks.standby_refill(image='4.1.2', txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'standby_refill')
+    @patch.object(tasks.standby, 'versions', return_value=['4.1.2', '4.2.0'])
+    def test_fill_standby(self, fake_versions, fake_standby_refill):
+        """Starting a worker sends a refill task for every standby version"""
+        tasks._fill_standby()
+
+        self.assertEqual(fake_standby_refill.delay.call_count, 2)
+
+    def test_user_tasks(self):
+        """Every task whose first argument is the username is indexed by the result backend"""
+        found = set()
+        for name, task in tasks.app.tasks.items():
+            params = list(inspect.signature(task.run).parameters)
+            if params[:1] == ['username']:
+                found.add(name)
+
+        self.assertEqual(found, tasks.results.USER_TASKS)
+
 if __name__ == '__main__':
     unittest.main()
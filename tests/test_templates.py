@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in templates.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib.worker import templates
+
+
+class TestTemplates(unittest.TestCase):
+    """A set of test cases for the templates.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.ova_path = os.path.join(self.cache_dir, 'InsightIQ_4.1.2.ova')
+        with open(self.ova_path, 'w') as the_file:
+            the_file.write('not really an OVA')
+        patcher = patch.object(templates, 'const', templates.const._replace(VLAB_INSIGHTIQ_CACHE_DIR=self.cache_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.cache_dir)
+
+    def test_template_name(self):
+        """``template_name`` includes the version of InsightIQ"""
+        output = templates.template_name('4.1.2', self.ova_path)
+
+        self.assertTrue(output.startswith('insightiq-template-4.1.2-'))
+
+    def test_template_name_stable(self):
+        """``template_name`` returns the same name for an unchanged OVA"""
+        name1 = templates.template_name('4.1.2', self.ova_path)
+        name2 = templates.template_name('4.1.2', self.ova_path)
+
+        self.assertEqual(name1, name2)
+
+    def test_template_name_changed(self):
+        """``template_name`` returns a new name when the OVA file is replaced"""
+        name1 = templates.template_name('4.1.2', self.ova_path)
+        with open(self.ova_path, 'w') as the_file:
+            the_file.write('a newer build of the same version')
+        name2 = templates.template_name('4.1.2', self.ova_path)
+
+        self.assertNotEqual(name1, name2)
+
+    def test_template_name_valid_vm_name(self):
+        """``template_name`` returns a name that can be used for a VM"""
+        output = templates.template_name('4.1.2', self.ova_path)
+
+        self.assertTrue(templates.re.match(templates.HOSTNAME_REGEX, output))
+
+    @patch.object(templates, '_build_template')
+    @patch.object(templates, 'inventory')
+    def test_get_template(self, fake_inventory, fake_build_template):
+        """``get_template`` returns an existing template without building a new one"""
+        fake_template = MagicMock()
+        fake_inventory.find_vm.return_value = fake_template
+
+        output = templates.get_template(MagicMock(), MagicMock(), self.ova_path, '4.1.2',
+                                        MagicMock(), 'alice', MagicMock())
+
+        self.assertTrue(output is fake_template)
+        self.assertFalse(fake_build_template.called)
+
+    @patch.object(templates, '_build_template')
+    @patch.object(templates, 'inventory')
+    def test_get_template_builds(self, fake_inventory, fake_build_template):
+        """``get_template`` builds the template if it doesn't exist"""
+        fake_inventory.find_vm.return_value = None
+
+        output = templates.get_template(MagicMock(), MagicMock(), self.ova_path, '4.1.2',
+                                        MagicMock(), 'alice', MagicMock())
+
+        self.assertTrue(output is fake_build_template.return_value)
+
+    @patch.object(templates, '_build_template')
+    @patch.object(templates, 'inventory')
+    def test_get_template_built_while_waiting(self, fake_inventory, fake_build_template):
+        """``get_template`` does not build the template if it was built while waiting on the lock"""
+        fake_template = MagicMock()
+        fake_inventory.find_vm.side_effect = [None, fake_template]
+
+        output = templates.get_template(MagicMock(), MagicMock(), self.ova_path, '4.1.2',
+                                        MagicMock(), 'alice', MagicMock())
+
+        self.assertTrue(output is fake_template)
+        self.assertFalse(fake_build_template.called)
+
+    def test_template_folder_missing(self):
+        """``_template_folder`` creates the template folder if it doesn't exist"""
+        fake_vcenter = MagicMock()
+        fake_folder = MagicMock()
+        fake_vcenter.get_vm_folder.side_effect = [FileNotFoundError('testing'), fake_folder]
+
+        output = templates._template_folder(fake_vcenter)
+
+        self.assertTrue(output is fake_folder)
+        self.assertTrue(fake_vcenter.create_vm_folder.called)
+
+    @patch.object(templates, 'consume_task')
+    @patch.object(templates.virtual_machine, 'deploy_from_ova')
+    def test_build_template(self, fake_deploy_from_ova, fake_consume_task):
+        """``_build_template`` snapshots the imported VM, then turns it into a template"""
+        the_vm = fake_deploy_from_ova.return_value
+
+        templates._build_template(MagicMock(), MagicMock(), MagicMock(), 'alice',
+                                  'insightiq-template-4.1.2-asdf', MagicMock(), MagicMock())
+
+        self.assertTrue(the_vm.CreateSnapshot_Task.called)
+        self.assertTrue(the_vm.MarkAsTemplate.called)
+
+    @patch.object(templates, 'consume_task')
+    @patch.object(templates.virtual_machine, 'deploy_from_ova')
+    def test_build_template_error(self, fake_deploy_from_ova, fake_consume_task):
+        """``_build_template`` destroys the imported VM if it cannot be made into a template"""
+        the_vm = fake_deploy_from_ova.return_value
+        the_vm.MarkAsTemplate.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            templates._build_template(MagicMock(), MagicMock(), MagicMock(), 'alice',
+                                      'insightiq-template-4.1.2-asdf', MagicMock(), MagicMock())
+
+        self.assertTrue(the_vm.Destroy_Task.called)
+
+    @patch.object(templates, 'vim')
+    @patch.object(templates.virtual_machine, 'power')
+    @patch.object(templates.virtual_machine, 'change_network')
+    @patch.object(templates, 'consume_task')
+    @patch.object(templates, 'get_template')
+    @patch.object(templates, 'inventory')
+    def test_linked_clone(self, fake_inventory, fake_get_template, fake_consume_task, fake_change_network, fake_power, fake_vim):
+        """``linked_clone`` clones the template, connects the network, then powers on the new VM"""
+        fake_network_map = MagicMock()
+
+        output = templates.linked_clone(MagicMock(), MagicMock(), self.ova_path, '4.1.2', fake_network_map,
+                                        'alice', 'myIIQ', MagicMock())
+
+        self.assertTrue(output is fake_consume_task.return_value)
+        self.assertTrue(fake_get_template.return_value.CloneVM_Task.called)
+        fake_change_network.assert_called_with(output, fake_network_map.network)
+        fake_power.assert_called_with(output, state='on')
+
+    @patch.object(templates, 'get_template')
+    def test_linked_clone_bad_name(self, fake_get_template):
+        """``linked_clone`` raises ValueError if the name is not a valid hostname"""
+        with self.assertRaises(ValueError):
+            templates.linked_clone(MagicMock(), MagicMock(), self.ova_path, '4.1.2', MagicMock(),
+                                   'alice', 'my_IIQ', MagicMock())
+
+
+if __name__ == '__main__':
+    unittest.main()
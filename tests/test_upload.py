@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in upload.py
+"""
+import io
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_insightiq_api.lib.worker import upload
+
+
+class FakeDisk(io.BytesIO):
+    """A disk with a ``size``, like a TarMember"""
+    def __init__(self, data):
+        super(FakeDisk, self).__init__(data)
+        self.size = len(data)
+
+
+class TestUpload(unittest.TestCase):
+    """A set of test cases for the upload.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        patcher = patch.object(upload.http.client, 'HTTPSConnection')
+        self.fake_conn = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake_conn.return_value.getresponse.return_value.status = 200
+
+    def sent(self):
+        """The bytes sent to the fake connection"""
+        return b''.join(x[0][0] for x in self.fake_conn.return_value.send.call_args_list)
+
+    def test_upload_disk(self):
+        """``upload_disk`` sends the whole disk, in chunks"""
+        disk = FakeDisk(b'0123456789')
+
+        output = upload.upload_disk('https://host/nfc/disk-0.vmdk', 'disk-0.vmdk', disk, chunk_size=3, read_ahead=2)
+
+        self.assertEqual(self.sent(), b'0123456789')
+        self.assertEqual(self.fake_conn.return_value.send.call_count, 4)
+        self.assertEqual(output.size, 10)
+
+    def test_upload_disk_headers(self):
+        """``upload_disk`` sets the Content-Length of the disk"""
+        disk = FakeDisk(b'0123456789')
+
+        upload.upload_disk('https://host/nfc/disk-0.vmdk', 'disk-0.vmdk', disk)
+
+        self.fake_conn.return_value.putheader.assert_any_call('Content-Length', '10')
+
+    def test_upload_disk_rejected(self):
+        """``upload_disk`` raises RuntimeError if the host rejects the disk"""
+        self.fake_conn.return_value.getresponse.return_value.status = 500
+
+        with self.assertRaises(RuntimeError):
+            upload.upload_disk('https://host/nfc/disk-0.vmdk', 'disk-0.vmdk', FakeDisk(b'0123'))
+
+    def test_upload_disks(self):
+        """``upload_disks`` uploads every disk in the import spec, to the host of the lease"""
+        lease = MagicMock()
+        lease.info.deviceUrl = [MagicMock(importKey='key-0', url='https://*/nfc/disk-0.vmdk'),
+                                MagicMock(importKey='key-1', url='https://*/nfc/disk-1.vmdk')]
+        file_items = [MagicMock(path='disk-0.vmdk', deviceId='key-0'),
+                      MagicMock(path='disk-1.vmdk', deviceId='key-1'),
+                      MagicMock(path='not-in-the-ova.iso', deviceId='key-2')]
+        disks = {'disk-0.vmdk': FakeDisk(b'0123'), 'disk-1.vmdk': FakeDisk(b'4567')}
+
+        output = upload.upload_disks(lease, file_items, disks, 'esxi01')
+        hosts = sorted(x[0][0] for x in self.fake_conn.call_args_list)
+
+        self.assertEqual([x.disk for x in output], ['disk-0.vmdk', 'disk-1.vmdk'])
+        self.assertEqual(hosts, ['esxi01', 'esxi01'])
+
+    @patch.object(upload, 'upload_disk')
+    def test_upload_disks_failed(self, fake_upload_disk):
+        """``upload_disks`` stops the other uploads as soon as one disk fails"""
+        finished = []
+        def fake_upload(url, name, disk, chunk_size, read_ahead, cancelled):
+            if name == 'disk-0.vmdk':
+                raise RuntimeError('testing')
+            # A big disk; only stops when told to
+            if cancelled.wait(5):
+                raise RuntimeError('cancelled')
+            finished.append(name)
+        fake_upload_disk.side_effect = fake_upload
+        lease = MagicMock()
+        lease.info.deviceUrl = [MagicMock(importKey='key-{}'.format(x), url='https://*/nfc/disk-{}.vmdk'.format(x)) for x in range(3)]
+        file_items = [MagicMock(path='disk-{}.vmdk'.format(x), deviceId='key-{}'.format(x)) for x in range(3)]
+        disks = {'disk-{}.vmdk'.format(x): FakeDisk(b'0123') for x in range(3)}
+
+        with self.assertRaises(RuntimeError) as the_error:
+            upload.upload_disks(lease, file_items, disks, 'esxi01', parallel=2)
+
+        self.assertEqual(str(the_error.exception), 'testing')
+        self.assertEqual(finished, [])
+
+    def test_upload_disk_cancelled(self):
+        """``upload_disk`` stops sending once the upload is cancelled"""
+        cancelled = upload.threading.Event()
+        cancelled.set()
+
+        with self.assertRaises(RuntimeError):
+            upload.upload_disk('https://host/nfc/disk-0.vmdk', 'disk-0.vmdk', FakeDisk(b'0123'), cancelled=cancelled)
+
+        self.assertFalse(self.fake_conn.return_value.send.called)
+
+    def test_upload_disks_no_url(self):
+        """``upload_disks`` raises RuntimeError if the lease has no URL for a disk"""
+        lease = MagicMock()
+        lease.info.deviceUrl = []
+        file_items = [MagicMock(path='disk-0.vmdk', deviceId='key-0')]
+
+        with self.assertRaises(RuntimeError):
+            upload.upload_disks(lease, file_items, {'disk-0.vmdk': FakeDisk(b'0123')}, 'esxi01')
+
+
+class TestReadAhead(unittest.TestCase):
+    """A set of test cases for the ReadAhead object"""
+    def test_chunks(self):
+        """``ReadAhead`` returns the file in chunks, then an empty chunk"""
+        chunks = upload.ReadAhead(io.BytesIO(b'0123456'), 3, 2)
+
+        output = [chunks.next_chunk() for _ in range(4)]
+        chunks.stop()
+
+        self.assertEqual(output, [b'012', b'345', b'6', b''])
+
+    def test_error(self):
+        """``ReadAhead`` raises the error from reading the file"""
+        the_file = MagicMock()
+        the_file.read.side_effect = OSError('testing')
+        chunks = upload.ReadAhead(the_file, 3, 2)
+
+        with self.assertRaises(OSError):
+            chunks.next_chunk()
+        chunks.stop()
+
+    def test_stop(self):
+        """``ReadAhead.stop`` stops the reader before the end of the file"""
+        chunks = upload.ReadAhead(io.BytesIO(b'0' * 1000), 1, 2)
+        chunks.next_chunk()
+
+        chunks.stop()
+
+        self.assertFalse(chunks._thread.is_alive())
+
+
+class TestLeaseProgress(unittest.TestCase):
+    """A set of test cases for the LeaseProgress object"""
+    def test_progress(self):
+        """``LeaseProgress`` reports the progress to the lease until the block ends"""
+        lease = MagicMock()
+        with upload.LeaseProgress(lease, lambda: 42, interval=0.01):
+            while not lease.Progress.called:
+                pass
+
+        lease.Progress.assert_called_with(42)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@
 A suite of tests for the functions in vmware.py
 """
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, PropertyMock
 
 from vlab_insightiq_api.lib.worker import vmware
 
@@ -14,20 +14,28 @@ class TestVMware(unittest.TestCase):
     def setUpClass(cls):
         vmware.logger = MagicMock()
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    def setUp(self):
+        """Runs before every test case"""
+        # Don't let a pooled session from one test leak into the next
+        vmware.SESSIONS.clear()
+        vmware.inventory._FOLDERS.clear()
+        vmware.NETWORKS.clear()
+        patcher = patch.object(vmware.networks.inventory, 'network_names')
+        self.network_names = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(vmware.guest, 'wait_for_ip')
+        self.wait_for_ip = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch.object(vmware.inventory, 'insightiq_vms')
     @patch.object(vmware, 'vCenter')
-    def test_show_insightiq(self, fake_vCenter, fake_get_info):
+    def test_show_insightiq(self, fake_vCenter, fake_insightiq_vms):
         """``show_insightiq`` returns a dictionary when everything works as expected"""
-        fake_vm = MagicMock()
-        fake_vm.name = 'myIIQ'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta': {'component': 'InsightIQ',
-                                               'created': 1234,
-                                               'version': '4.1.2',
-                                               'configured': False,
-                                               'generation': 1}}
+        fake_insightiq_vms.return_value = {'myIIQ': {'meta': {'component': 'InsightIQ',
+                                                              'created': 1234,
+                                                              'version': '4.1.2',
+                                                              'configured': False,
+                                                              'generation': 1}}}
 
         output = vmware.show_insightiq(username='alice')
         expected = {'myIIQ':{'meta': {'component': 'InsightIQ',
@@ -38,30 +46,112 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.inventory, 'insightiq_vms')
     @patch.object(vmware, 'vCenter')
-    def test_show_insightiq_nothing(self, fake_vCenter, fake_get_info):
+    def test_show_insightiq_nothing(self, fake_vCenter, fake_insightiq_vms):
         """``show_insightiq`` returns an empty dictionary no insightiq is found"""
-        fake_vm = MagicMock()
-        fake_vm.name = 'myIIQ'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta': {'component': 'otherThing',
-                                               'created': 1234,
-                                               'version': '4.1.2',
-                                               'configured': False,
-                                               'generation': 1}}
+        fake_insightiq_vms.return_value = {}
 
         output = vmware.show_insightiq(username='alice')
         expected = {}
 
         self.assertEqual(output, expected)
 
+    def test_mirrored_insightiq_off(self):
+        """``mirrored_insightiq`` returns None when the inventory mirror is off"""
+        output = vmware.mirrored_insightiq('alice', since=0)
+
+        self.assertTrue(output is None)
+
+    @patch.object(vmware.inventory, 'add_consoles')
+    @patch.object(vmware, 'vCenter')
+    @patch.object(vmware, 'MIRROR')
+    def test_mirrored_insightiq(self, fake_MIRROR, fake_vCenter, fake_add_consoles):
+        """``mirrored_insightiq`` answers from the inventory mirror, and adds console URLs"""
+        fake_MIRROR.user_vms.return_value = vmware.mirror.Lookup({'myIIQ': {'moid': 'vm-1'}}, '7', 1234)
+
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_INSIGHTIQ_MIRROR=True)):
+            output = vmware.mirrored_insightiq('alice', since=100)
+
+        self.assertEqual(output.data, {'myIIQ': {'moid': 'vm-1'}})
+        self.assertTrue(fake_add_consoles.called)
+        fake_MIRROR.user_vms.assert_called_with('alice', since=100)
+
+    @patch.object(vmware.inventory, 'add_consoles')
+    @patch.object(vmware, 'vCenter')
+    def test_add_consoles_empty(self, fake_vCenter, fake_add_consoles):
+        """``add_consoles`` doesn't use a vCenter session when there are no VMs"""
+        vmware.add_consoles({})
+
+        self.assertFalse(fake_add_consoles.called)
+        self.assertFalse(fake_vCenter.called)
+
+    @patch.object(vmware.mirror, 'read_snapshot')
+    @patch.object(vmware, 'MIRROR')
+    def test_mirrored_inventory_snapshot(self, fake_MIRROR, fake_read_snapshot):
+        """``mirrored_inventory`` reads the snapshot when this process's mirror isn't current"""
+        fake_MIRROR.owners.return_value = None
+        fake_read_snapshot.return_value = vmware.mirror.Lookup({}, '7', 1234)
+        const = vmware.const._replace(VLAB_INSIGHTIQ_MIRROR=True, VLAB_INSIGHTIQ_MIRROR_SNAPSHOT='/tmp/inventory.json')
+
+        with patch.object(vmware, 'const', const):
+            output = vmware.mirrored_inventory(since=100)
+
+        self.assertEqual(output.as_of, 1234)
+
+    @patch.object(vmware.mirror, 'read_snapshot')
+    @patch.object(vmware, 'MIRROR')
+    def test_mirrored_inventory_snapshot_no_mirror(self, fake_MIRROR, fake_read_snapshot):
+        """``mirrored_inventory`` reads the snapshot in processes that don't run a mirror"""
+        fake_read_snapshot.return_value = vmware.mirror.Lookup({}, '7', 1234)
+        const = vmware.const._replace(VLAB_INSIGHTIQ_MIRROR=False, VLAB_INSIGHTIQ_MIRROR_SNAPSHOT='/tmp/inventory.json')
+
+        with patch.object(vmware, 'const', const):
+            output = vmware.mirrored_inventory(since=100)
+
+        self.assertEqual(output.as_of, 1234)
+        self.assertFalse(fake_MIRROR.start.called)
+
+    @patch.object(vmware, '_find_insightiq')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'vCenter')
+    @patch.object(vmware, 'MIRROR')
+    def test_delete_insightiq_mirror(self, fake_MIRROR, fake_vCenter, fake_power, fake_consume_task, fake_find_insightiq):
+        """``delete_insightiq`` finds the VM with the inventory mirror, instead of searching vCenter"""
+        the_vm = MagicMock()
+        fake_MIRROR.find_vm.return_value = the_vm
+
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_INSIGHTIQ_MIRROR=True)):
+            vmware.delete_insightiq(username='bob', machine_name='myIIQ', logger=MagicMock())
+
+        self.assertFalse(fake_find_insightiq.called)
+        self.assertTrue(the_vm.Destroy_Task.called)
+
+    @patch.object(vmware.inventory, 'every_insightiq')
+    @patch.object(vmware, 'vCenter')
+    def test_inventory_insightiq(self, fake_vCenter, fake_every_insightiq):
+        """``inventory_insightiq`` looks for InsightIQ instances under the vLab top level folder"""
+        fake_every_insightiq.return_value = {'alice': {'4.1.2': {'myIIQ': {}}}}
+
+        output = vmware.inventory_insightiq()
+        folder_name = fake_vCenter.return_value.get_vm_folder.call_args[0][0]
+
+        self.assertEqual(output, {'alice': {'4.1.2': {'myIIQ': {}}}})
+        self.assertEqual(folder_name, vmware.const.INF_VCENTER_TOP_LVL_DIR)
+
+    @patch.object(vmware, 'vCenter')
+    def test_inventory_insightiq_no_folder(self, fake_vCenter):
+        """``inventory_insightiq`` raises ValueError if the vLab top level folder doesn't exist"""
+        fake_vCenter.return_value.get_vm_folder.side_effect = FileNotFoundError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.inventory_insightiq()
+
     @patch.object(vmware.virtual_machine, 'set_meta')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'Ova')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, 'vCenter')
     def test_create_insightiq(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_consume_task, fake_set_meta):
@@ -69,8 +159,56 @@ class TestVMware(unittest.TestCase):
         fake_logger = MagicMock()
         fake_deploy_from_ova.return_value.name = 'myIIQ'
         fake_Ova.return_value.networks = ['vLabNetwork']
+        fake_Ova.return_value.size = 1024
+        fake_get_info.return_value = {'worked' : True}
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        output = vmware.create_insightiq(username='alice',
+                                         machine_name='myIIQ',
+                                         image='4.1.2',
+                                         network='someNetwork',
+                                         logger=fake_logger)
+        expected = {'myIIQ' : {'worked': True}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_written(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta, fake_power):
+        """``create_insightiq`` calls ``written`` once the OVA is uploaded, before powering on the VM"""
+        calls = []
+        fake_Ova.return_value.networks = ['vLabNetwork']
+        fake_Ova.return_value.size = 1024
+        fake_power.side_effect = lambda the_vm, state: calls.append('power')
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        vmware.create_insightiq(username='alice',
+                                machine_name='myIIQ',
+                                image='4.1.2',
+                                network='someNetwork',
+                                logger=MagicMock(),
+                                written=lambda: calls.append('written'))
+
+        self.assertEqual(calls, ['written', 'power'])
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_INSIGHTIQ_LINKED_CLONES=True))
+    @patch.object(vmware.templates, 'linked_clone')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_linked_clone(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta, fake_linked_clone):
+        """``create_insightiq`` makes a linked clone instead of uploading the OVA when linked clones are enabled"""
+        fake_logger = MagicMock()
+        fake_linked_clone.return_value.name = 'myIIQ'
+        fake_Ova.return_value.networks = ['vLabNetwork']
         fake_get_info.return_value = {'worked' : True}
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someNetwork': vmware.vim.Network(moId='asdf')}
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
 
         output = vmware.create_insightiq(username='alice',
                                          machine_name='myIIQ',
@@ -80,10 +218,210 @@ class TestVMware(unittest.TestCase):
         expected = {'myIIQ' : {'worked': True}}
 
         self.assertEqual(output, expected)
+        self.assertFalse(fake_deploy_from_ova.called)
+
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'claim')
+    @patch.object(vmware.inventory, 'find_vm', return_value=None)
+    @patch.object(vmware.inventory, 'find_folder')
+    @patch.object(vmware.virtual_machine, 'change_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_standby(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta,
+                                      fake_change_network, fake_find_folder, fake_find_vm, fake_claim, fake_enabled):
+        """``create_insightiq`` claims a standby VM instead of deploying, when one is ready"""
+        fake_get_info.return_value = {'worked' : True}
+        network = vmware.vim.Network(moId='asdf')
+        self.network_names.return_value = {'someNetwork': network}
+
+        output = vmware.create_insightiq(username='alice',
+                                         machine_name='myIIQ',
+                                         image='4.1.2',
+                                         network='someNetwork',
+                                         logger=MagicMock())
+        expected = {'myIIQ' : {'worked': True}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_deploy_from_ova.called)
+        self.assertFalse(fake_Ova.called)
+        fake_change_network.assert_called_with(fake_claim.return_value, network)
+
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'claim')
+    @patch.object(vmware.inventory, 'find_vm', return_value=None)
+    @patch.object(vmware.inventory, 'find_folder')
+    @patch.object(vmware.virtual_machine, 'change_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_standby_written(self, fake_vCenter, fake_get_info, fake_set_meta, fake_change_network,
+                                              fake_find_folder, fake_find_vm, fake_claim, fake_enabled):
+        """``create_insightiq`` calls ``written`` once it's claimed a standby VM"""
+        written = MagicMock()
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        vmware.create_insightiq(username='alice',
+                                machine_name='myIIQ',
+                                image='4.1.2',
+                                network='someNetwork',
+                                logger=MagicMock(),
+                                written=written)
+
+        self.assertTrue(written.called)
+
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'claim')
+    @patch.object(vmware.inventory, 'find_vm', return_value=None)
+    @patch.object(vmware.inventory, 'find_folder')
+    @patch.object(vmware.virtual_machine, 'change_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_standby_new_ip(self, fake_vCenter, fake_get_info, fake_set_meta, fake_change_network,
+                                             fake_find_folder, fake_find_vm, fake_claim, fake_enabled):
+        """``create_insightiq`` waits for the claimed standby VM to get an IP on the user's network"""
+        nic = MagicMock()
+        nic.ipAddress = ['10.1.1.1']
+        fake_claim.return_value.guest.net = [nic]
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        vmware.create_insightiq(username='alice',
+                                machine_name='myIIQ',
+                                image='4.1.2',
+                                network='someNetwork',
+                                logger=MagicMock())
+        _, the_kwargs = self.wait_for_ip.call_args
+
+        self.assertEqual(the_kwargs['ignore'], ['10.1.1.1'])
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_INSIGHTIQ_IP_AT_POWER_ON=True))
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_at_power_on(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta, fake_power):
+        """``create_insightiq`` doesn't wait for an IP when VLAB_INSIGHTIQ_IP_AT_POWER_ON is set"""
+        fake_Ova.return_value.networks = ['vLabNetwork']
+        fake_Ova.return_value.size = 1024
+        fake_get_info.return_value = {'worked' : True}
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        vmware.create_insightiq(username='alice',
+                                machine_name='myIIQ',
+                                image='4.1.2',
+                                network='someNetwork',
+                                logger=MagicMock())
+
+        self.assertFalse(self.wait_for_ip.called)
+
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'claim', return_value=None)
+    @patch.object(vmware.inventory, 'find_vm', return_value=None)
+    @patch.object(vmware.inventory, 'find_folder')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_standby_empty(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta,
+                                            fake_power, fake_find_folder, fake_find_vm, fake_claim, fake_enabled):
+        """``create_insightiq`` deploys a new VM when no standby VM is ready"""
+        fake_Ova.return_value.networks = ['vLabNetwork']
+        fake_Ova.return_value.size = 1024
+        fake_get_info.return_value = {'worked' : True}
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        vmware.create_insightiq(username='alice',
+                                machine_name='myIIQ',
+                                image='4.1.2',
+                                network='someNetwork',
+                                logger=MagicMock())
+
+        self.assertTrue(fake_deploy_from_ova.called)
+
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'claim')
+    @patch.object(vmware.inventory, 'find_vm')
+    @patch.object(vmware.inventory, 'find_folder')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_standby_exists(self, fake_vCenter, fake_find_folder, fake_find_vm, fake_claim, fake_enabled):
+        """``create_insightiq`` does not claim a standby VM if the user already has a VM with that name"""
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        with self.assertRaises(ValueError):
+            vmware.create_insightiq(username='alice',
+                                    machine_name='myIIQ',
+                                    image='4.1.2',
+                                    network='someNetwork',
+                                    logger=MagicMock())
+        self.assertFalse(fake_claim.called)
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_INSIGHTIQ_STANDBY_SIZE=3,
+                                                         VLAB_INSIGHTIQ_STANDBY_NETWORK='holding'))
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'refill_lock')
+    @patch.object(vmware.standby, 'find_standby', return_value={'insightiq-standby-4.1.2-aaaa': None})
+    @patch.object(vmware.standby, 'folder')
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_standby(self, fake_vCenter, fake_Ova, fake_deploy, fake_folder, fake_find_standby, fake_refill_lock, fake_enabled):
+        """``refill_standby`` deploys only one standby VM, even when the pool is missing several"""
+        fake_Ova.return_value.networks = ['vLabNetwork']
+        self.network_names.return_value = {'holding': vmware.vim.Network(moId='asdf')}
+
+        output = vmware.refill_standby('4.1.2', MagicMock())
+
+        self.assertEqual(len(output), 1)
+        self.assertEqual(fake_deploy.call_count, 1)
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_INSIGHTIQ_STANDBY_SIZE=1))
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'refill_lock')
+    @patch.object(vmware.standby, 'find_standby', return_value={'insightiq-standby-4.1.2-aaaa': None})
+    @patch.object(vmware.standby, 'folder')
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_standby_full(self, fake_vCenter, fake_deploy, fake_folder, fake_find_standby, fake_refill_lock, fake_enabled):
+        """``refill_standby`` deploys nothing when the pool is full"""
+        output = vmware.refill_standby('4.1.2', MagicMock())
+
+        self.assertEqual(output, [])
+        self.assertFalse(fake_deploy.called)
+
+    @patch.object(vmware.standby, 'enabled', return_value=True)
+    @patch.object(vmware.standby, 'refill_lock')
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_standby_busy(self, fake_vCenter, fake_deploy, fake_refill_lock, fake_enabled):
+        """``refill_standby`` returns right away when another task is already refilling"""
+        fake_refill_lock.return_value.__enter__.return_value.held = False
+
+        output = vmware.refill_standby('4.1.2', MagicMock())
+
+        self.assertEqual(output, [])
+        self.assertFalse(fake_vCenter.called)
+        self.assertFalse(fake_deploy.called)
+
+    @patch.object(vmware.standby, 'enabled', return_value=False)
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_standby_disabled(self, fake_vCenter, fake_deploy, fake_enabled):
+        """``refill_standby`` does nothing for versions without a standby pool"""
+        output = vmware.refill_standby('4.1.2', MagicMock())
+
+        self.assertEqual(output, [])
+        self.assertFalse(fake_deploy.called)
 
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'Ova')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, 'vCenter')
     def test_create_insightiq_value_error(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_consume_task):
@@ -91,7 +429,7 @@ class TestVMware(unittest.TestCase):
         fake_logger = MagicMock()
         fake_Ova.return_value.networks = ['vLabNetwork']
         fake_get_info.return_value = {'worked' : True}
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someNetwork': vmware.vim.Network(moId='asdf')}
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
 
         with self.assertRaises(ValueError):
             vmware.create_insightiq(username='alice',
@@ -101,8 +439,8 @@ class TestVMware(unittest.TestCase):
                                     logger=fake_logger)
 
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'Ova')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, 'vCenter')
     def test_create_insightiq_bad_version(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_consume_task):
@@ -110,7 +448,7 @@ class TestVMware(unittest.TestCase):
         fake_logger = MagicMock()
         fake_Ova.side_effect = FileNotFoundError('testing')
         fake_get_info.return_value = {'worked' : True}
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someNetwork': vmware.vim.Network(moId='asdf')}
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
 
         with self.assertRaises(ValueError):
             vmware.create_insightiq(username='alice',
@@ -119,45 +457,252 @@ class TestVMware(unittest.TestCase):
                                     network='not a thing',
                                     logger=fake_logger)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_corrupt_image(self, fake_vCenter, fake_deploy_from_ova, fake_open_ova):
+        """``create_insightiq`` raises ValueError before uploading a corrupted image"""
+        fake_logger = MagicMock()
+        fake_open_ova.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.create_insightiq(username='alice',
+                                    machine_name='myIIQ',
+                                    image='4.1.2',
+                                    network='someNetwork',
+                                    logger=fake_logger)
+
+        self.assertFalse(fake_deploy_from_ova.called)
+
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_progress(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta, fake_power):
+        """``create_insightiq`` reports each phase of the deploy"""
+        fake_progress = MagicMock()
+        fake_Ova.return_value.networks = ['vLabNetwork']
+        fake_Ova.return_value.size = 1024
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+
+        vmware.create_insightiq(username='alice',
+                                machine_name='myIIQ',
+                                image='4.1.2',
+                                network='someNetwork',
+                                logger=MagicMock(),
+                                progress=fake_progress)
+        phases = [x[0][0] for x in fake_progress.call_args_list]
+        expected = ['uploading', 'powering on', 'setting meta', 'waiting for IP']
+
+        self.assertEqual(phases, expected)
+
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_insightiq_upload_progress(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta, fake_power):
+        """``create_insightiq`` reports how much of the OVA has been uploaded"""
+        fake_progress = MagicMock()
+        fake_Ova.return_value.networks = ['vLabNetwork']
+        fake_Ova.return_value.size = 1024
+        self.network_names.return_value = {'someNetwork': vmware.vim.Network(moId='asdf')}
+        fake_deploy_from_ova.side_effect = lambda vcenter, ova, *args, **kwargs: ova.on_progress(42)
+
+        vmware.create_insightiq(username='alice',
+                                machine_name='myIIQ',
+                                image='4.1.2',
+                                network='someNetwork',
+                                logger=MagicMock(),
+                                progress=fake_progress)
+
+        fake_progress.assert_any_call('uploading', 42)
+
+    @patch.object(vmware, 'inventory')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware.virtual_machine, 'power')
     @patch.object(vmware, 'vCenter')
-    def test_delete_insightiq(self, fake_vCenter, fake_power, fake_consume_task, fake_get_info):
+    def test_delete_insightiq(self, fake_vCenter, fake_power, fake_consume_task, fake_inventory):
         """``delete_insightiq`` powers off the VM then deletes it"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
-        fake_vm.name = 'myIIQ'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta': {'component': 'InsightIQ',
-                                               'created': 1234,
-                                               'version': '4.1.2',
-                                               'configured': False,
-                                               'generation': 1}}
+        fake_inventory.find_vm.return_value = fake_vm
+        fake_inventory.get_meta.return_value = {'component': 'InsightIQ',
+                                                'created': 1234,
+                                                'version': '4.1.2',
+                                                'configured': False,
+                                                'generation': 1}
         vmware.delete_insightiq(username='alice', machine_name='myIIQ', logger=fake_logger)
 
         self.assertTrue(fake_power.called)
         self.assertTrue(fake_vm.Destroy_Task.called)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'inventory')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware.virtual_machine, 'power')
     @patch.object(vmware, 'vCenter')
-    def test_delete_insightiq_value_error(self, fake_vCenter, fake_power, fake_consume_task, fake_get_info):
-        """``delete_insightiq`` raises ValueError if no InsightiQ machine has the supplied name"""
+    def test_delete_insightiq_no_wait(self, fake_vCenter, fake_power, fake_consume_task, fake_inventory):
+        """``delete_insightiq`` returns the vCenter task moId instead of blocking when wait=False"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
-        fake_vm.name = 'myIIQ'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'worked': True, 'note': "InsightIQ=4.1.2"}
+        fake_vm.Destroy_Task.return_value._moId = 'task-1234'
+        fake_inventory.find_vm.return_value = fake_vm
+        fake_inventory.get_meta.return_value = {'component': 'InsightIQ'}
+
+        output = vmware.delete_insightiq(username='alice', machine_name='myIIQ', logger=fake_logger, wait=False)
+
+        self.assertEqual(output, 'task-1234')
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_insightiqs(self, fake_vCenter, fake_consume_task, fake_inventory):
+        """``delete_insightiqs`` powers off and destroys every VM supplied"""
+        vm1 = MagicMock()
+        vm2 = MagicMock()
+        fake_inventory.insightiq_objects.return_value = {'iiq1': (vm1, 'poweredOn'), 'iiq2': (vm2, 'poweredOff')}
+
+        deleted, failed = vmware.delete_insightiqs('alice', ['iiq1', 'iiq2'], MagicMock())
+
+        self.assertEqual(sorted(deleted), ['iiq1', 'iiq2'])
+        self.assertEqual(failed, {})
+        self.assertTrue(vm1.PowerOffVM_Task.called)
+        self.assertFalse(vm2.PowerOffVM_Task.called)
+        self.assertTrue(vm1.Destroy_Task.called)
+        self.assertTrue(vm2.Destroy_Task.called)
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_insightiqs_all(self, fake_vCenter, fake_consume_task, fake_inventory):
+        """``delete_insightiqs`` destroys every InsightIQ instance when no names are supplied"""
+        fake_inventory.insightiq_objects.return_value = {'iiq1': (MagicMock(), 'poweredOff'),
+                                                         'iiq2': (MagicMock(), 'poweredOff')}
+
+        deleted, _ = vmware.delete_insightiqs('alice', None, MagicMock())
+
+        self.assertEqual(deleted, ['iiq1', 'iiq2'])
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_insightiqs_missing(self, fake_vCenter, fake_consume_task, fake_inventory):
+        """``delete_insightiqs`` reports names that are not InsightIQ instances"""
+        fake_inventory.insightiq_objects.return_value = {'iiq1': (MagicMock(), 'poweredOff')}
+
+        deleted, failed = vmware.delete_insightiqs('alice', ['iiq1', 'nope'], MagicMock())
+
+        self.assertEqual(deleted, ['iiq1'])
+        self.assertEqual(list(failed.keys()), ['nope'])
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_insightiqs_power_off_fails(self, fake_vCenter, fake_consume_task, fake_inventory):
+        """``delete_insightiqs`` does not destroy a VM that failed to power off"""
+        vm1 = MagicMock()
+        vm2 = MagicMock()
+        fake_inventory.insightiq_objects.return_value = {'iiq1': (vm1, 'poweredOn'), 'iiq2': (vm2, 'poweredOff')}
+        fake_consume_task.side_effect = [RuntimeError('testing'), None]
+
+        deleted, failed = vmware.delete_insightiqs('alice', ['iiq1', 'iiq2'], MagicMock())
+
+        self.assertEqual(deleted, ['iiq2'])
+        self.assertEqual(failed, {'iiq1': 'testing'})
+        self.assertFalse(vm1.Destroy_Task.called)
+
+    @patch.object(vmware, 'vim')
+    @patch.object(vmware, 'vCenter')
+    def test_task_done(self, fake_vCenter, fake_vim):
+        """``task_done`` returns True once the vCenter task succeeded"""
+        fake_vim.Task.return_value.info.state = fake_vim.TaskInfo.State.success
+
+        self.assertTrue(vmware.task_done('task-1234'))
+
+    @patch.object(vmware, 'vim')
+    @patch.object(vmware, 'vCenter')
+    def test_task_done_running(self, fake_vCenter, fake_vim):
+        """``task_done`` returns False while the vCenter task is running"""
+        fake_vim.Task.return_value.info.state = fake_vim.TaskInfo.State.running
+
+        self.assertFalse(vmware.task_done('task-1234'))
+
+    @patch.object(vmware, 'vim')
+    @patch.object(vmware, 'vCenter')
+    def test_task_done_error(self, fake_vCenter, fake_vim):
+        """``task_done`` raises RuntimeError if the vCenter task failed"""
+        fake_vim.Task.return_value.info.state = fake_vim.TaskInfo.State.error
+
+        with self.assertRaises(RuntimeError):
+            vmware.task_done('task-1234')
+
+    @patch.object(vmware.vim, 'Task')
+    @patch.object(vmware, 'vCenter')
+    def test_task_done_purged(self, fake_vCenter, fake_Task):
+        """``task_done`` returns None if vCenter no longer knows about the task"""
+        type(fake_Task.return_value).info = PropertyMock(side_effect=vmware.vmodl.fault.ManagedObjectNotFound())
+
+        self.assertTrue(vmware.task_done('task-1234') is None)
+
+    @patch.object(vmware, '_lookup_insightiq')
+    @patch.object(vmware, 'task_done', return_value=None)
+    @patch.object(vmware, 'vCenter')
+    def test_destroy_done_purged(self, fake_vCenter, fake_task_done, fake_lookup_insightiq):
+        """``destroy_done`` returns True if vCenter forgot the task, and the VM is gone"""
+        fake_lookup_insightiq.return_value = None
+
+        self.assertTrue(vmware.destroy_done('task-1234', 'alice', 'myIIQ'))
+
+    @patch.object(vmware, '_lookup_insightiq')
+    @patch.object(vmware, 'task_done', return_value=None)
+    @patch.object(vmware, 'vCenter')
+    def test_destroy_done_purged_failed(self, fake_vCenter, fake_task_done, fake_lookup_insightiq):
+        """``destroy_done`` raises RuntimeError if vCenter forgot the task, and the VM still exists"""
+        fake_lookup_insightiq.return_value = MagicMock()
+
+        with self.assertRaises(RuntimeError):
+            vmware.destroy_done('task-1234', 'alice', 'myIIQ')
+
+    @patch.object(vmware, '_lookup_insightiq')
+    @patch.object(vmware, 'task_done', return_value=False)
+    @patch.object(vmware, 'vCenter')
+    def test_destroy_done_running(self, fake_vCenter, fake_task_done, fake_lookup_insightiq):
+        """``destroy_done`` doesn't look for the VM while the vCenter task is running"""
+        self.assertFalse(vmware.destroy_done('task-1234', 'alice', 'myIIQ'))
+        self.assertFalse(fake_lookup_insightiq.called)
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_insightiq_value_error(self, fake_vCenter, fake_power, fake_consume_task, fake_inventory):
+        """``delete_insightiq`` raises ValueError if no InsightiQ machine has the supplied name"""
+        fake_logger = MagicMock()
+        fake_inventory.find_vm.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.delete_insightiq(username='alice', machine_name='not a thing', logger=fake_logger)
 
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_insightiq_not_insightiq(self, fake_vCenter, fake_power, fake_consume_task, fake_inventory):
+        """``delete_insightiq`` raises ValueError if the named VM is not an InsightIQ instance"""
+        fake_logger = MagicMock()
+        fake_vm = MagicMock()
+        fake_inventory.find_vm.return_value = fake_vm
+        fake_inventory.get_meta.return_value = {'component': 'OneFS'}
+
+        with self.assertRaises(ValueError):
+            vmware.delete_insightiq(username='alice', machine_name='myOneFS', logger=fake_logger)
+
+        self.assertFalse(fake_vm.Destroy_Task.called)
+
     @patch.object(vmware.os, 'listdir')
     def test_list_images(self, fake_listdir):
         """``list_images`` returns a list of images when everything works as expected"""
@@ -168,34 +713,37 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
-    def test_convert_name(self):
-        """``convert_name`` defaults to converting versions to images"""
-        output = vmware.convert_name('4.1.2')
-        expected = 'InsightIQ_4.1.2.ova'
-
-        self.assertEqual(output, expected)
+    @patch.object(vmware.inventory, 'vm_info')
+    @patch.object(vmware, '_find_insightiq')
+    @patch.object(vmware.inventory, 'find_folder')
+    @patch.object(vmware, 'vCenter')
+    def test_wait_for_ip(self, fake_vCenter, fake_find_folder, fake_find_insightiq, fake_get_info):
+        """``wait_for_ip`` returns the instance's info once it has an IP"""
+        fake_get_info.return_value = {'ips': ['10.1.1.1']}
 
-    def test_convert_name_to_version(self):
-        """``convert_name`` can convert from versions to image names"""
-        output = vmware.convert_name('InsightIQ_4.1.2.ova', to_version=True)
-        expected = '4.1.2'
+        output = vmware.wait_for_ip(username='alice', machine_name='myIIQ')
+        expected = {'myIIQ': {'ips': ['10.1.1.1']}}
 
         self.assertEqual(output, expected)
+        self.assertTrue(self.wait_for_ip.called)
+
+    @patch.object(vmware, '_find_insightiq', return_value=None)
+    @patch.object(vmware.inventory, 'find_folder')
+    @patch.object(vmware, 'vCenter')
+    def test_wait_for_ip_no_vm(self, fake_vCenter, fake_find_folder, fake_find_insightiq):
+        """``wait_for_ip`` raises ValueError if the instance does not exist"""
+        with self.assertRaises(ValueError):
+            vmware.wait_for_ip(username='alice', machine_name='myIIQ')
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'inventory')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware, 'vCenter')
-    def test_update_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    def test_update_network(self, fake_vCenter, fake_consume_task, fake_inventory, fake_change_network):
         """``update_network`` Returns None upon success"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myIIQ'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'InsightIQ'}}
+        self.network_names.return_value = {'wootTown' : vmware.vim.Network(moId='network-1')}
+        fake_inventory.find_vm.return_value = MagicMock()
+        fake_inventory.get_meta.return_value = {'component' : 'InsightIQ'}
 
         result = vmware.update_network(username='pat',
                                        machine_name='myIIQ',
@@ -204,19 +752,13 @@ class TestVMware(unittest.TestCase):
         self.assertTrue(result is None)
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'inventory')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware, 'vCenter')
-    def test_update_network_no_vm(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    def test_update_network_no_vm(self, fake_vCenter, fake_consume_task, fake_inventory, fake_change_network):
         """``update_network`` Raises ValueError if the supplied VM doesn't exist"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myIIQ'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'InsightIQ'}}
+        self.network_names.return_value = {'wootTown' : vmware.vim.Network(moId='network-1')}
+        fake_inventory.find_vm.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
@@ -224,19 +766,14 @@ class TestVMware(unittest.TestCase):
                                   new_network='wootTown')
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'inventory')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware, 'vCenter')
-    def test_update_network_no_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    def test_update_network_no_network(self, fake_vCenter, fake_consume_task, fake_inventory, fake_change_network):
         """``update_network`` Raises ValueError if the supplied new network doesn't exist"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myIIQ'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'InsightIQ'}}
+        self.network_names.return_value = {'wootTown' : vmware.vim.Network(moId='network-1')}
+        fake_inventory.find_vm.return_value = MagicMock()
+        fake_inventory.get_meta.return_value = {'component' : 'InsightIQ'}
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
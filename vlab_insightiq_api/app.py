@@ -2,15 +2,20 @@
 from flask import Flask
 from celery import Celery
 
-from vlab_insightiq_api.lib import const
-from vlab_insightiq_api.lib.views import HealthView, InsightIQView
+from vlab_insightiq_api.lib import const, metrics, queues, results
+from vlab_insightiq_api.lib.views import HealthView, InsightIQView, MetricsView
 
 app = Flask(__name__)
-app.celery_app = Celery('insightiq', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+app.celery_app = Celery('insightiq', backend=results.backend_name(), broker=const.VLAB_MESSAGE_BROKER)
+app.celery_app.conf.result_expires = const.VLAB_INSIGHTIQ_RESULT_TTL
 app.celery_app.conf.broker_heartbeat = 0 #https://github.com/celery/celery/issues/4895
+queues.configure(app.celery_app)
+metrics.instrument_app(app)
+metrics.instrument_celery()
 
 HealthView.register(app)
 InsightIQView.register(app)
+MetricsView.register(app)
 
 
 if __name__ == '__main__':
@@ -24,6 +24,49 @@ DEFINED = OrderedDict([
             ('VLAB_URL', environ.get('VLAB_URL', 'https://localhost')),
             ('VLAB_INSIGHTIQ_IMAGES_DIR', environ.get('VLAB_INSIGHTIQ_IMAGES_DIR', '/images')),
             ('VLAB_VERIFY_TOKEN', environ.get('VLAB_VERIFY_TOKEN', False)),
+            ('VLAB_INSIGHTIQ_SESSION_POOL_SIZE', int(environ.get('VLAB_INSIGHTIQ_SESSION_POOL_SIZE', 2))),
+            ('VLAB_INSIGHTIQ_SESSION_KEEPALIVE', int(environ.get('VLAB_INSIGHTIQ_SESSION_KEEPALIVE', 60))),
+            ('VLAB_INSIGHTIQ_CACHE_DIR', environ.get('VLAB_INSIGHTIQ_CACHE_DIR', '/tmp/vlab_insightiq')),
+            ('VLAB_INSIGHTIQ_SHOW_CACHE_TTL', int(environ.get('VLAB_INSIGHTIQ_SHOW_CACHE_TTL', 15))),
+            ('VLAB_INSIGHTIQ_LINKED_CLONES', environ.get('VLAB_INSIGHTIQ_LINKED_CLONES', False)),
+            ('VLAB_INSIGHTIQ_ASYNC_DELETE', environ.get('VLAB_INSIGHTIQ_ASYNC_DELETE', False)),
+            ('VLAB_INSIGHTIQ_TASK_POLL_INTERVAL', int(environ.get('VLAB_INSIGHTIQ_TASK_POLL_INTERVAL', 2))),
+            ('VLAB_INSIGHTIQ_EVENTS_TIMEOUT', int(environ.get('VLAB_INSIGHTIQ_EVENTS_TIMEOUT', 5))),
+            ('VLAB_INSIGHTIQ_EVENTS_INTERVAL', float(environ.get('VLAB_INSIGHTIQ_EVENTS_INTERVAL', 0.5))),
+            ('VLAB_INSIGHTIQ_RESULT_BACKEND', environ.get('VLAB_INSIGHTIQ_RESULT_BACKEND', 'rpc://')),
+            ('VLAB_INSIGHTIQ_RESULT_DIR', environ.get('VLAB_INSIGHTIQ_RESULT_DIR', '/tmp/vlab_insightiq/results')),
+            ('VLAB_INSIGHTIQ_RESULT_TTL', int(environ.get('VLAB_INSIGHTIQ_RESULT_TTL', 86400))),
+            ('VLAB_INSIGHTIQ_WORKER_METRICS_PORT', int(environ.get('VLAB_INSIGHTIQ_WORKER_METRICS_PORT', 9100))),
+            ('VLAB_INSIGHTIQ_SYNC_IMAGES', environ.get('VLAB_INSIGHTIQ_SYNC_IMAGES', False)),
+            ('VLAB_INSIGHTIQ_TEMPLATES_DIR', environ.get('VLAB_INSIGHTIQ_TEMPLATES_DIR', '/vlab/templates/insightiq')),
+            ('VLAB_INSIGHTIQ_HEALTH_INTERVAL', int(environ.get('VLAB_INSIGHTIQ_HEALTH_INTERVAL', 30))),
+            ('VLAB_INSIGHTIQ_HEALTH_TIMEOUT', int(environ.get('VLAB_INSIGHTIQ_HEALTH_TIMEOUT', 5))),
+            ('VLAB_INSIGHTIQ_NETWORK_TTL', int(environ.get('VLAB_INSIGHTIQ_NETWORK_TTL', 300))),
+            ('VLAB_INSIGHTIQ_STANDBY_SIZE', int(environ.get('VLAB_INSIGHTIQ_STANDBY_SIZE', 0))),
+            ('VLAB_INSIGHTIQ_STANDBY_VERSIONS', environ.get('VLAB_INSIGHTIQ_STANDBY_VERSIONS', '')),
+            ('VLAB_INSIGHTIQ_STANDBY_FOLDER', environ.get('VLAB_INSIGHTIQ_STANDBY_FOLDER', 'insightiq-standby')),
+            ('VLAB_INSIGHTIQ_STANDBY_NETWORK', environ.get('VLAB_INSIGHTIQ_STANDBY_NETWORK', 'insightiq-standby')),
+            ('VLAB_INSIGHTIQ_IDEMPOTENCY_TTL', int(environ.get('VLAB_INSIGHTIQ_IDEMPOTENCY_TTL', 600))),
+            ('VLAB_INSIGHTIQ_IDEMPOTENCY_SIZE', int(environ.get('VLAB_INSIGHTIQ_IDEMPOTENCY_SIZE', 10000))),
+            ('VLAB_INSIGHTIQ_IDEMPOTENCY_SWEEP', int(environ.get('VLAB_INSIGHTIQ_IDEMPOTENCY_SWEEP', 60))),
+            ('VLAB_INSIGHTIQ_IDEMPOTENCY_DIR', environ.get('VLAB_INSIGHTIQ_IDEMPOTENCY_DIR', '/tmp/vlab_insightiq/requests')),
+            ('VLAB_INSIGHTIQ_MAX_DEPLOYS', int(environ.get('VLAB_INSIGHTIQ_MAX_DEPLOYS', 0))),
+            ('VLAB_INSIGHTIQ_MAX_USER_DEPLOYS', int(environ.get('VLAB_INSIGHTIQ_MAX_USER_DEPLOYS', 0))),
+            ('VLAB_INSIGHTIQ_ADMISSION_DIR', environ.get('VLAB_INSIGHTIQ_ADMISSION_DIR', '/tmp/vlab_insightiq/admission')),
+            ('VLAB_INSIGHTIQ_ADMISSION_INTERVAL', int(environ.get('VLAB_INSIGHTIQ_ADMISSION_INTERVAL', 10))),
+            ('VLAB_INSIGHTIQ_ADMISSION_TIMEOUT', int(environ.get('VLAB_INSIGHTIQ_ADMISSION_TIMEOUT', 1800))),
+            ('VLAB_INSIGHTIQ_IP_TIMEOUT', int(environ.get('VLAB_INSIGHTIQ_IP_TIMEOUT', 600))),
+            ('VLAB_INSIGHTIQ_IP_AT_POWER_ON', environ.get('VLAB_INSIGHTIQ_IP_AT_POWER_ON', False)),
+            ('VLAB_INSIGHTIQ_UPLOAD_PARALLEL', int(environ.get('VLAB_INSIGHTIQ_UPLOAD_PARALLEL', 2))),
+            ('VLAB_INSIGHTIQ_UPLOAD_CHUNK', int(environ.get('VLAB_INSIGHTIQ_UPLOAD_CHUNK', 1048576))),
+            ('VLAB_INSIGHTIQ_UPLOAD_READ_AHEAD', int(environ.get('VLAB_INSIGHTIQ_UPLOAD_READ_AHEAD', 4))),
+            ('VLAB_INSIGHTIQ_ADMINS', environ.get('VLAB_INSIGHTIQ_ADMINS', '')),
+            ('VLAB_INSIGHTIQ_INVENTORY_CACHE_TTL', int(environ.get('VLAB_INSIGHTIQ_INVENTORY_CACHE_TTL', 60))),
+            ('VLAB_INSIGHTIQ_INVENTORY_PAGE_SIZE', int(environ.get('VLAB_INSIGHTIQ_INVENTORY_PAGE_SIZE', 100))),
+            ('VLAB_INSIGHTIQ_MIRROR', environ.get('VLAB_INSIGHTIQ_MIRROR', False)),
+            ('VLAB_INSIGHTIQ_MIRROR_WAIT', int(environ.get('VLAB_INSIGHTIQ_MIRROR_WAIT', 5))),
+            ('VLAB_INSIGHTIQ_MIRROR_MAX_AGE', int(environ.get('VLAB_INSIGHTIQ_MIRROR_MAX_AGE', 30))),
+            ('VLAB_INSIGHTIQ_MIRROR_SNAPSHOT', environ.get('VLAB_INSIGHTIQ_MIRROR_SNAPSHOT', '')),
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
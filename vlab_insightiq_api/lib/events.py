@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+"""
+Turns the state of a Celery task into a stream of events.
+
+Instead of every client polling the task end point in a tight loop, the API
+checks on the task for the client, and only sends something when the task's
+state (or progress) has changed.
+
+Every watcher holds an API thread while it waits, so streams and long-polls
+are kept short (``VLAB_INSIGHTIQ_EVENTS_TIMEOUT``); the client reconnects to
+keep watching.
+"""
+import time
+import hashlib
+
+import ujson
+from celery import states
+
+
+def task_events(celery_app, task_id, last_id=None, timeout=5, interval=0.5):
+    """Yield the state of a task every time it changes, until the task is done
+    or ``timeout`` seconds pass.
+
+    Each event is a dictionary with the ``status`` of the task, the ``progress``
+    the task reported (if it's running, or its place in line if it's waiting to
+    start), and the ``result`` (if it's done).
+
+    :Returns: Generator of Tuple (String, Dictionary) of the event id and the event
+
+    :param celery_app: The Celery app the task was sent with
+    :type celery_app: celery.Celery
+
+    :param task_id: The id of the task
+    :type task_id: String
+
+    :param last_id: Optional - The id of the last event the client saw. Nothing
+                    is yielded until the state of the task is different.
+    :type last_id: String
+
+    :param timeout: How many seconds to wait on the task
+    :type timeout: Integer
+
+    :param interval: How many seconds to wait between checks of the task
+    :type interval: Float
+    """
+    deadline = time.time() + timeout
+    while True:
+        result = celery_app.AsyncResult(task_id)
+        event = {'status': result.status, 'progress': None, 'result': None}
+        if result.status in ('PROGRESS', 'QUEUED'):
+            event['progress'] = result.info
+        elif result.status == states.SUCCESS:
+            event['result'] = result.result
+        event_id = hashlib.sha1(ujson.dumps(event, sort_keys=True).encode()).hexdigest()[:16]
+        if event_id != last_id:
+            last_id = event_id
+            yield event_id, event
+        if result.status in states.READY_STATES or time.time() >= deadline:
+            break
+        time.sleep(interval)
+
+
+def to_sse(event_id, event):
+    """Format an event for a ``text/event-stream`` response
+
+    :Returns: String
+
+    :param event_id: The unique id of the event
+    :type event_id: String
+
+    :param event: The state of the task
+    :type event: Dictionary
+    """
+    if event['status'] in states.READY_STATES:
+        name = 'done'
+    else:
+        name = 'status'
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, name, ujson.dumps(event))
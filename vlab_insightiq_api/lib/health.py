@@ -0,0 +1,118 @@
+# -*- coding: UTF-8 -*-
+"""
+Checks on the services the API depends on, for the deep healthcheck.
+
+Health checks are hit constantly, and must answer quickly even when a
+dependency is down. So a background thread checks the dependencies every
+``VLAB_INSIGHTIQ_HEALTH_INTERVAL`` seconds, and the healthcheck only ever reads
+the results of the last check.
+
+The API only reads the images directory to answer ``GET /image`` itself, and
+sends a task to a worker when it can't. So the images directory is reported,
+but isn't required; an API container that doesn't mount it is still healthy.
+"""
+import os
+import time
+import socket
+import threading
+
+from vlab_insightiq_api.lib import const
+
+
+UNKNOWN = {'ok': None, 'error': 'Not checked yet', 'checked': None}
+# The dependencies the API can work without
+OPTIONAL = frozenset(['images'])
+
+
+class DependencyProbe(object):
+    """Periodically checks that the broker, vCenter, and images directory are usable.
+
+    :param interval: How many seconds to wait between checks
+    :type interval: Integer
+
+    :param timeout: How many seconds a single check can take
+    :type timeout: Integer
+    """
+    def __init__(self, interval=30, timeout=5):
+        self._interval = interval
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._results = {}
+        self._thread = None
+        self._pid = None
+
+    def status(self, celery_app):
+        """Obtain the result of the last check of every dependency. Starts the
+        background checks if they're not running yet.
+
+        :Returns: Dictionary
+
+        :param celery_app: The Celery app the API sends tasks with
+        :type celery_app: celery.Celery
+        """
+        self.start(celery_app)
+        with self._lock:
+            answer = dict(self._results)
+        for name in ('broker', 'vcenter', 'images'):
+            answer.setdefault(name, dict(UNKNOWN, required=name not in OPTIONAL))
+        return answer
+
+    def start(self, celery_app):
+        """Start checking the dependencies in a background thread, if not already
+
+        :Returns: None
+
+        :param celery_app: The Celery app the API sends tasks with
+        :type celery_app: celery.Celery
+        """
+        pid = os.getpid()
+        with self._lock:
+            # uWSGI forks after the app is loaded; threads don't survive a fork
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._results = {}
+            self._thread = threading.Thread(target=self._run, args=(celery_app,), daemon=True)
+            self._thread.start()
+
+    def check(self, celery_app):
+        """Check every dependency once
+
+        :Returns: None
+
+        :param celery_app: The Celery app the API sends tasks with
+        :type celery_app: celery.Celery
+        """
+        checks = {'broker': lambda: self._check_broker(celery_app),
+                  'vcenter': self._check_vcenter,
+                  'images': self._check_images}
+        for name, the_check in checks.items():
+            try:
+                the_check()
+            except Exception as doh:
+                result = {'ok': False, 'error': '{}'.format(doh)}
+            else:
+                result = {'ok': True, 'error': None}
+            result['checked'] = time.time()
+            result['required'] = name not in OPTIONAL
+            with self._lock:
+                self._results[name] = result
+
+    def _run(self, celery_app):
+        while True:
+            self.check(celery_app)
+            time.sleep(self._interval)
+
+    def _check_broker(self, celery_app):
+        """Connect to the message broker"""
+        with celery_app.connection_for_write(connect_timeout=self._timeout) as conn:
+            conn.ensure_connection(max_retries=1)
+
+    def _check_vcenter(self):
+        """Open a TCP connection to vCenter. Logging in would use up a session."""
+        address = (const.INF_VCENTER_SERVER, const.INF_VCENTER_PORT)
+        socket.create_connection(address, timeout=self._timeout).close()
+
+    def _check_images(self):
+        """List the directory of InsightIQ OVAs"""
+        os.listdir(const.VLAB_INSIGHTIQ_IMAGES_DIR)
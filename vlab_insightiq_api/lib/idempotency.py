@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+"""
+Remembers which task each request started, so a retried request doesn't start another one.
+
+A client that times out waiting on ``POST /api/2/inf/insightiq`` will retry it,
+but the first request already sent an ``insightiq.create`` task. The retry
+would start a second multi-GB deploy, which fails on the name conflict only
+after it's uploaded the whole OVA. Requests that set the ``X-REQUEST-ID``
+header are remembered for ``VLAB_INSIGHTIQ_IDEMPOTENCY_TTL`` seconds, and a
+request with the same id (from the same user, to the same end point) gets the
+id of the original task instead.
+
+The retry can land on any uwsgi process (or thread), so the index is a file per
+request id in ``VLAB_INSIGHTIQ_IDEMPOTENCY_DIR``, changed under an ``flock``.
+Every API process that shares the directory shares the index. The file names
+are a short digest of the request id, so ``VLAB_INSIGHTIQ_IDEMPOTENCY_SIZE``
+entries only take a few MB.
+
+Dropping the expired entries means looking at every entry, so it's done at most
+once every ``VLAB_INSIGHTIQ_IDEMPOTENCY_SWEEP`` seconds (by whichever process
+claims a request id first after that), not on every claim. The mtime of a
+marker file in the directory is when the last sweep ran. Between sweeps, the
+index can grow past its size by the number of requests in that time.
+"""
+import os
+import time
+import hashlib
+import tempfile
+
+import ujson
+
+from vlab_insightiq_api.lib.worker.cache import FileLock
+
+
+NO_ID = 'noId'
+SWEEP_MARKER = 'swept.marker'
+
+
+class RequestIndex(object):
+    """An expiring map of request ids to task ids, with a bounded size.
+
+    :param directory: Where to keep the request ids
+    :type directory: String
+
+    :param ttl: How many seconds a request id is remembered. Zero disables the index.
+    :type ttl: Integer
+
+    :param max_entries: The most request ids to remember; the oldest are forgotten first
+    :type max_entries: Integer
+
+    :param sweep_interval: The fewest seconds between dropping the expired request ids
+    :type sweep_interval: Integer
+    """
+    def __init__(self, directory, ttl=600, max_entries=10000, sweep_interval=60):
+        self._directory = directory
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._sweep_interval = sweep_interval
+
+    def claim(self, username, action, request_id, body, task_id):
+        """Record that a request is about to send a task, unless a request with
+        the same id already did.
+
+        :Returns: Tuple (String, Boolean) of the task id to use, and if that task was already sent
+
+        :Raises: ValueError if the request id was already used with a different body
+
+        :param username: The user who made the request
+        :type username: String
+
+        :param action: What the request does, like "create" or "delete"
+        :type action: String
+
+        :param request_id: The value of the X-REQUEST-ID header
+        :type request_id: String
+
+        :param body: The JSON body of the request
+        :type body: Dictionary
+
+        :param task_id: The id the new task will have, if this is a new request
+        :type task_id: String
+        """
+        if not self._ttl or not request_id or request_id == NO_ID:
+            return task_id, False
+        key = _digest(username, action, request_id)
+        fingerprint = _digest(ujson.dumps(body, sort_keys=True))
+        now = time.time()
+        with FileLock(os.path.join(self._directory, 'requests.lock')):
+            found = self._read(key)
+            if found.get('expires', 0) > now:
+                if found['fingerprint'] != fingerprint:
+                    raise ValueError('Request id {} was already used for a different request'.format(request_id))
+                return found['task_id'], True
+            self._write(key, {'expires': now + self._ttl, 'task_id': task_id, 'fingerprint': fingerprint})
+            if self._sweep_due(now):
+                self._expire(now)
+        return task_id, False
+
+    def forget(self, username, action, request_id):
+        """Drop a request id, so a retry of it sends a new task. Used when
+        sending the task failed.
+
+        :Returns: None
+
+        :param username: The user who made the request
+        :type username: String
+
+        :param action: What the request does, like "create" or "delete"
+        :type action: String
+
+        :param request_id: The value of the X-REQUEST-ID header
+        :type request_id: String
+        """
+        with FileLock(os.path.join(self._directory, 'requests.lock')):
+            try:
+                os.remove(self._path(_digest(username, action, request_id)))
+            except FileNotFoundError:
+                pass
+
+    def _sweep_due(self, now):
+        """Check if it's time to drop the expired entries, and if so, record
+        that they're being dropped now. Call while holding the lock."""
+        marker = os.path.join(self._directory, SWEEP_MARKER)
+        try:
+            since = now - os.stat(marker).st_mtime
+        except FileNotFoundError:
+            since = None
+        # A marker from the future means the clock moved back; don't wait on it
+        if since is not None and 0 <= since < self._sweep_interval:
+            return False
+        with open(marker, 'a'):
+            pass
+        os.utime(marker, (now, now))
+        return True
+
+    def _expire(self, now):
+        """Drop the expired entries, then the oldest ones past ``max_entries``.
+        Call while holding the lock.
+
+        The mtime of an entry is set to when it expires, so this doesn't have to
+        read every entry.
+        """
+        entries = sorted((x.stat().st_mtime, x.path) for x in self._entries())
+        extra = len(entries) - self._max_entries
+        for count, (expires, path) in enumerate(entries):
+            if expires > now and count >= extra:
+                break
+            os.remove(path)
+
+    def _entries(self):
+        """Every saved request id, as os.DirEntry objects"""
+        try:
+            return [x for x in os.scandir(self._directory) if x.name.endswith('.json')]
+        except FileNotFoundError:
+            return []
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + '.json')
+
+    def _read(self, key):
+        """Load a saved request id; an empty dictionary if there is none"""
+        try:
+            with open(self._path(key)) as the_file:
+                return ujson.load(the_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, key, record):
+        """Atomically replace a saved request id"""
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory)
+        with os.fdopen(fd, 'w') as the_file:
+            ujson.dump(record, the_file)
+        os.utime(tmp_path, (record['expires'], record['expires']))
+        os.replace(tmp_path, self._path(key))
+
+    def __len__(self):
+        return len(self._entries())
+
+
+def _digest(*parts):
+    """Make a compact key out of strings"""
+    return hashlib.blake2b('\0'.join(parts).encode(), digest_size=16).hexdigest()
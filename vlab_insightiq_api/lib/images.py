@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-memory listing of the InsightIQ images that can be deployed.
+
+The images directory almost never changes, so the listing is only re-read when
+the modification time of the directory changes (i.e. a file was added, removed,
+or renamed).
+
+The naming convention of the OVAs lives here too, so the API and the workers
+share it without the API importing the worker code (pyVmomi, the vCenter
+session pool, etc).
+"""
+import os
+import hashlib
+import threading
+
+
+def convert_name(name, to_version=False):
+    """This function centralizes converting between the name of the OVA, and the
+    version of software it contains.
+
+    The naming convention for the InsightIQ OVAs is "InsightIQ_<VERSION>.ova".
+    For example IIQ 3.1.1 is named "InsightIQ_3.1.1.ova".
+
+    :param name: The thing to covert
+    :type name: String
+
+    :param to_version: Set to True to covert the name of an OVA to the version
+    :type to_version: Boolean
+    """
+    if to_version:
+        return name.split('_')[-1].rstrip('.ova')
+    else:
+        return 'InsightIQ_{}.ova'.format(name)
+
+
+class ImageCatalog(object):
+    """Keeps track of the available versions of InsightIQ.
+
+    :param directory: Where the InsightIQ OVAs are stored
+    :type directory: String
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._versions = []
+        self._etag = None
+
+    def versions(self):
+        """Obtain the versions of InsightIQ that can be deployed, and an ETag
+        that changes whenever the list of versions does.
+
+        :Returns: Tuple (List, String)
+
+        :Raises: OSError if the images directory cannot be read
+        """
+        mtime = os.stat(self._directory).st_mtime_ns
+        with self._lock:
+            if mtime != self._mtime:
+                images = os.listdir(self._directory)
+                self._versions = [convert_name(x, to_version=True) for x in images]
+                self._etag = hashlib.sha1('\n'.join(sorted(images)).encode()).hexdigest()
+                self._mtime = mtime
+            return list(self._versions), self._etag
@@ -0,0 +1,181 @@
+# -*- coding: UTF-8 -*-
+"""
+Prometheus metrics for the API and the workers.
+
+Both uWSGI and Celery (prefork) run several processes. When the
+``PROMETHEUS_MULTIPROC_DIR`` environment variable is set, every process writes
+its metrics to that directory, and a scrape reports the sum of all processes.
+Without it, a scrape only reports the process that answered it.
+
+The API serves metrics from ``MetricsView``. Workers serve them on their own
+port (``VLAB_INSIGHTIQ_WORKER_METRICS_PORT``) from the main Celery process.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from flask import request
+from celery import signals
+from prometheus_client import (CollectorRegistry, Counter, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, start_http_server)
+from prometheus_client import multiprocess
+
+from vlab_insightiq_api.lib import const
+
+
+# Deploys take minutes, so the default buckets (which top out at 10s) are no good
+TASK_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800)
+THROUGHPUT_BUCKETS = tuple(x * 1024 * 1024 for x in (1, 5, 10, 25, 50, 100, 250, 500))
+ENQUEUED_HEADER = 'vlab_enqueued'
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+TASK_LATENCY = Histogram('insightiq_task_seconds',
+                         'How long a Celery task took to run',
+                         ['task', 'state'],
+                         buckets=TASK_BUCKETS)
+QUEUE_WAIT = Histogram('insightiq_task_queue_wait_seconds',
+                       'How long a Celery task waited in the queue before a worker started it',
+                       ['task'],
+                       buckets=TASK_BUCKETS)
+VCENTER_CALLS = Histogram('insightiq_vcenter_call_seconds',
+                          'How long calls to vCenter took',
+                          ['call'],
+                          buckets=TASK_BUCKETS)
+VCENTER_ERRORS = Counter('insightiq_vcenter_call_errors_total',
+                         'How many calls to vCenter raised an exception',
+                         ['call'])
+UPLOAD_BYTES = Counter('insightiq_ova_upload_bytes_total',
+                       'How many bytes of OVA disks were uploaded to vCenter')
+UPLOAD_THROUGHPUT = Histogram('insightiq_ova_upload_bytes_per_second',
+                              'How fast OVA disks were uploaded to vCenter',
+                              buckets=THROUGHPUT_BUCKETS)
+API_LATENCY = Histogram('insightiq_api_request_seconds',
+                        'How long the API took to answer a request',
+                        ['method', 'route', 'status'])
+
+
+@contextmanager
+def vcenter_call(name):
+    """Time a call to vCenter, and count it if it fails
+
+    :Returns: None
+
+    :param name: What the call is doing, i.e. "deploy_from_ova"
+    :type name: String
+    """
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        VCENTER_ERRORS.labels(call=name).inc()
+        raise
+    finally:
+        VCENTER_CALLS.labels(call=name).observe(time.time() - start)
+
+
+def record_upload(size, seconds):
+    """Record how fast an OVA was uploaded
+
+    :Returns: None
+
+    :param size: How many bytes were uploaded
+    :type size: Integer
+
+    :param seconds: How long the upload took
+    :type seconds: Float
+    """
+    UPLOAD_BYTES.inc(size)
+    if seconds > 0:
+        UPLOAD_THROUGHPUT.observe(size / seconds)
+
+
+def registry():
+    """Obtain the registry to report from, combining every process when in
+    multiprocess mode.
+
+    :Returns: prometheus_client.CollectorRegistry
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return collector_registry
+    return REGISTRY
+
+
+def exposition():
+    """Render every metric in the Prometheus text format
+
+    :Returns: Tuple (Bytes, String) of the body and its content type
+    """
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def instrument_app(app):
+    """Record the latency of every request the Flask app handles
+
+    :Returns: None
+
+    :param app: The API
+    :type app: flask.Flask
+    """
+    @app.before_request
+    def _start_timer():
+        request.environ['vlab.started'] = time.time()
+
+    @app.after_request
+    def _record_latency(response):
+        started = request.environ.get('vlab.started')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unknown'
+            API_LATENCY.labels(method=request.method,
+                               route=route,
+                               status=response.status_code).observe(time.time() - started)
+        return response
+
+
+def instrument_celery():
+    """Record queue wait time and latency of every task, and serve the worker's
+    metrics on ``VLAB_INSIGHTIQ_WORKER_METRICS_PORT``.
+
+    :Returns: None
+    """
+    signals.before_task_publish.connect(_stamp_enqueued, weak=False)
+    signals.task_prerun.connect(_task_started, weak=False)
+    signals.task_postrun.connect(_task_finished, weak=False)
+    signals.worker_init.connect(_serve_worker_metrics, weak=False)
+    signals.worker_process_shutdown.connect(_process_shutdown, weak=False)
+
+
+def _stamp_enqueued(headers=None, **kwargs):
+    """Record when a task was sent, so the worker can tell how long it waited"""
+    if headers is not None:
+        headers[ENQUEUED_HEADER] = time.time()
+
+
+def _task_started(task=None, **kwargs):
+    """Record how long a task sat in the queue, and start timing it"""
+    now = time.time()
+    enqueued = task.request.get(ENQUEUED_HEADER)
+    if enqueued:
+        QUEUE_WAIT.labels(task=task.name).observe(max(0, now - enqueued))
+    task.request.vlab_started = now
+
+
+def _task_finished(task=None, state=None, **kwargs):
+    """Record how long a task took to run"""
+    started = task.request.get('vlab_started')
+    if started:
+        TASK_LATENCY.labels(task=task.name, state=state).observe(time.time() - started)
+
+
+def _serve_worker_metrics(**kwargs):
+    """Run the metrics HTTP server in the main worker process"""
+    if const.VLAB_INSIGHTIQ_WORKER_METRICS_PORT:
+        start_http_server(const.VLAB_INSIGHTIQ_WORKER_METRICS_PORT, registry=registry())
+
+
+def _process_shutdown(pid=None, **kwargs):
+    """Stop reporting the live metrics (i.e. gauges) of a dead worker process"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') and pid:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+"""
+Which Celery queue each task goes to, and how urgent it is.
+
+Listing things (``insightiq.show``, ``insightiq.image`` and
+``insightiq.inventory``) takes seconds at most, but deploying InsightIQ takes
+minutes. When both share a queue, a burst of deploys leaves the reads waiting
+behind them. So reads and changes go to separate queues, which are consumed
+by separate workers with their own concurrency and prefetch settings. Both
+queues also support message priorities, so a worker that consumes both queues
+still handles reads first. Refilling the pool of standby VMs is background
+work, so it goes behind any deploy a user is waiting on.
+
+The API and the workers must use the same settings, so both call ``configure``.
+"""
+from kombu import Queue
+
+
+READ_QUEUE = 'insightiq.read'
+WRITE_QUEUE = 'insightiq.write'
+MAX_PRIORITY = 9
+READ_PRIORITY = 9
+WRITE_PRIORITY = 5
+BACKGROUND_PRIORITY = 1
+READ_TASKS = ('insightiq.show', 'insightiq.image', 'insightiq.inventory')
+BACKGROUND_TASKS = ('insightiq.standby_refill',)
+
+
+def routes(name, args, kwargs, options, task=None, **kw):
+    """A Celery router that sends read tasks to the read queue, and everything
+    else to the write queue.
+
+    :Returns: Dictionary
+
+    :param name: The name of the task being sent
+    :type name: String
+    """
+    if name in READ_TASKS:
+        return {'queue': READ_QUEUE, 'priority': READ_PRIORITY}
+    elif name in BACKGROUND_TASKS:
+        return {'queue': WRITE_QUEUE, 'priority': BACKGROUND_PRIORITY}
+    return {'queue': WRITE_QUEUE, 'priority': WRITE_PRIORITY}
+
+
+def configure(celery_app):
+    """Set up the queues, routing, and prefetch settings of a Celery app
+
+    :Returns: None
+
+    :param celery_app: The Celery app of the API or worker
+    :type celery_app: celery.Celery
+    """
+    priority = {'x-max-priority': MAX_PRIORITY}
+    celery_app.conf.task_queues = (Queue(READ_QUEUE, routing_key=READ_QUEUE, queue_arguments=priority),
+                                   Queue(WRITE_QUEUE, routing_key=WRITE_QUEUE, queue_arguments=priority))
+    celery_app.conf.task_default_queue = WRITE_QUEUE
+    celery_app.conf.task_routes = (routes,)
+    celery_app.conf.task_queue_max_priority = MAX_PRIORITY
+    celery_app.conf.task_default_priority = WRITE_PRIORITY
+    # A deploy holds onto a worker for minutes; don't let one worker hoard
+    # tasks that an idle worker could be running. The read workers override
+    # this on the command line, because their tasks are short.
+    celery_app.conf.worker_prefetch_multiplier = 1
@@ -0,0 +1,162 @@
+# -*- coding: UTF-8 -*-
+"""
+A Celery result backend that keeps task results in a (shared) directory.
+
+With the ``rpc://`` backend, a result can only be read once, only by the API
+process that sent the task, and is lost if that process restarts. Storing
+results as files on a volume that every API process and worker mounts means any
+API process can answer "how's my task doing?" by reading one file.
+
+Results expire ``VLAB_INSIGHTIQ_RESULT_TTL`` seconds after they were last
+updated. Every task is also indexed by the user who ran it, so the API can list
+a user's tasks.
+"""
+import os
+import time
+import tempfile
+from urllib.parse import quote
+
+from celery.backends.filesystem import FilesystemBackend
+
+from vlab_insightiq_api.lib import const
+
+
+BACKEND_PATH = 'vlab_insightiq_api.lib.results:FileBackend'
+# Tasks run for a user, who's their first argument. Other tasks (like listing
+# images, the admin inventory, or refilling standby VMs) aren't indexed.
+USER_TASKS = frozenset(['insightiq.show', 'insightiq.create', 'insightiq.create_batch',
+                        'insightiq.delete', 'insightiq.delete_batch', 'insightiq.modify_network',
+                        'insightiq.fill_ip'])
+
+
+def backend_name():
+    """The Celery result backend to use, per ``VLAB_INSIGHTIQ_RESULT_BACKEND``.
+    The value "file" selects ``FileBackend``; anything else is handed to Celery.
+
+    :Returns: String
+    """
+    if const.VLAB_INSIGHTIQ_RESULT_BACKEND == 'file':
+        return BACKEND_PATH
+    return const.VLAB_INSIGHTIQ_RESULT_BACKEND
+
+
+class FileBackend(FilesystemBackend):
+    """Stores one file per task result in ``VLAB_INSIGHTIQ_RESULT_DIR``, plus an
+    index of task ids per user.
+
+    :param url: Optional - A file:// URL of the directory to use
+    :type url: String
+    """
+    def __init__(self, url=None, *args, **kwargs):
+        url = url or 'file://{}'.format(const.VLAB_INSIGHTIQ_RESULT_DIR)
+        directory = url[len('file://'):]
+        self._index_dir = os.path.join(directory, 'users')
+        os.makedirs(self._index_dir, exist_ok=True)
+        super(FileBackend, self).__init__(url, *args, **kwargs)
+
+    def get(self, key):
+        """Read a result; expired results are deleted instead of returned"""
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as the_file:
+                if self._expired(os.fstat(the_file.fileno()).st_mtime):
+                    data = None
+                else:
+                    data = the_file.read()
+        except FileNotFoundError:
+            return None
+        if data is None:
+            self._unlink(filename)
+        return data
+
+    def set(self, key, value):
+        """Atomically write a result, so other processes never read half of one"""
+        if isinstance(value, str):
+            value = value.encode()
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'wb') as the_file:
+            the_file.write(value)
+        os.replace(tmp_path, self._filename(key))
+
+    def delete(self, key):
+        self._unlink(self._filename(key))
+
+    def _store_result(self, task_id, result, state, traceback=None, request=None, **kwargs):
+        answer = super(FileBackend, self)._store_result(task_id, result, state, traceback=traceback,
+                                                        request=request, **kwargs)
+        username = _username(request)
+        if username:
+            user_dir = os.path.join(self._index_dir, quote(username, safe=''))
+            os.makedirs(user_dir, exist_ok=True)
+            open(os.path.join(user_dir, task_id), 'a').close()
+        return answer
+
+    def user_tasks(self, username):
+        """Obtain the ids of the (unexpired) tasks a user has run, newest first
+
+        :Returns: List
+
+        :param username: The user who ran the tasks
+        :type username: String
+        """
+        return self._indexed(os.path.join(self._index_dir, quote(username, safe='')))
+
+    def cleanup(self):
+        """Delete expired results, and index entries of results that are gone"""
+        super(FileBackend, self).cleanup()
+        for user_dir in os.listdir(self._index_dir):
+            self._indexed(os.path.join(self._index_dir, user_dir))
+
+    def _indexed(self, user_dir):
+        """Obtain the unexpired task ids in a user's index, pruning the rest
+
+        :Returns: List
+
+        :param user_dir: The index directory of the user
+        :type user_dir: String
+        """
+        try:
+            task_ids = os.listdir(user_dir)
+        except FileNotFoundError:
+            return []
+        found = []
+        for task_id in task_ids:
+            try:
+                updated = os.stat(self._filename(self.get_key_for_task(task_id))).st_mtime
+            except FileNotFoundError:
+                updated = None
+            if updated is None or self._expired(updated):
+                self._unlink(os.path.join(user_dir, task_id))
+            else:
+                found.append((updated, task_id))
+        return [task_id for _, task_id in sorted(found, reverse=True)]
+
+    def _expired(self, mtime):
+        """Check if a result last updated at ``mtime`` is past its TTL"""
+        if not self.expires:
+            return False
+        return time.time() - mtime > self.expires
+
+    @staticmethod
+    def _unlink(filename):
+        """Delete a file, if it still exists; another process might have beaten us to it"""
+        try:
+            os.unlink(filename)
+        except FileNotFoundError:
+            pass
+
+
+def _username(request):
+    """Find the user who ran a task, from the task's request
+
+    :Returns: String or None
+
+    :param request: The request context of the task
+    :type request: celery.app.task.Context
+    """
+    if request is None:
+        return None
+    args = getattr(request, 'args', None) or []
+    if getattr(request, 'task', None) not in USER_TASKS or not args:
+        return None
+    return args[0]
@@ -1,3 +1,4 @@
 # -*- coding: UTF-8 -*-
 from .healthcheck import HealthView
 from .insightiq import InsightIQView
+from .metrics import MetricsView
@@ -2,14 +2,21 @@
 """
 Enables Health checks for the power API
 """
-from time import time
 import pkg_resources
 
 import ujson
-from flask_classy import FlaskView, Response
-from vlab_inf_common.vmware import vCenter
+from flask import current_app
+from flask_classy import FlaskView, Response, request
 
 from vlab_insightiq_api.lib import const
+from vlab_insightiq_api.lib.health import DependencyProbe
+
+
+# Looking up the version scans every installed distribution; it can't change
+# without restarting the service, so only do it once.
+VERSION = pkg_resources.get_distribution('vlab-insightiq-api').version
+PROBE = DependencyProbe(interval=const.VLAB_INSIGHTIQ_HEALTH_INTERVAL,
+                        timeout=const.VLAB_INSIGHTIQ_HEALTH_TIMEOUT)
 
 
 class HealthView(FlaskView):
@@ -20,10 +27,19 @@ class HealthView(FlaskView):
     trailing_slash = False
 
     def get(self):
-        """End point for health checks"""
+        """End point for health checks.
+
+        Supply ``?deep=true`` to also get the state of the broker, vCenter, and
+        the images directory, as of the last background check. Any required
+        dependency that failed its last check makes the response an HTTP 503.
+        """
         resp = {}
         status = 200
-        resp['version'] = pkg_resources.get_distribution('vlab-insightiq-api').version
+        resp['version'] = VERSION
+        if request.args.get('deep', '').lower() in ('true', '1', 'yes'):
+            resp['dependencies'] = PROBE.status(current_app.celery_app)
+            if any(x['ok'] is False and x.get('required', True) for x in resp['dependencies'].values()):
+                status = 503
         response = Response(ujson.dumps(resp))
         response.status_code = status
         response.headers['Content-Type'] = 'application/json'
@@ -2,8 +2,10 @@
 """
 Defines the RESTful API for the InsightIQ deployment service
 """
+import uuid
+
 import ujson
-from flask import current_app
+from flask import current_app, stream_with_context
 from flask_classy import request, route, Response
 from vlab_inf_common.views import MachineView
 from vlab_inf_common.vmware import vCenter, vim
@@ -11,9 +13,74 @@ from vlab_api_common import describe, get_logger, requires, validate_input
 
 
 from vlab_insightiq_api.lib import const
+from vlab_insightiq_api.lib.images import ImageCatalog
+from vlab_insightiq_api.lib.idempotency import RequestIndex
+from vlab_insightiq_api.lib.events import task_events, to_sse
 
 
 logger = get_logger(__name__, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL)
+IMAGE_CATALOG = ImageCatalog(const.VLAB_INSIGHTIQ_IMAGES_DIR)
+REQUESTS = RequestIndex(const.VLAB_INSIGHTIQ_IDEMPOTENCY_DIR,
+                        ttl=const.VLAB_INSIGHTIQ_IDEMPOTENCY_TTL,
+                        max_entries=const.VLAB_INSIGHTIQ_IDEMPOTENCY_SIZE,
+                        sweep_interval=const.VLAB_INSIGHTIQ_IDEMPOTENCY_SWEEP)
+# The users who can see every user's InsightIQ instances
+ADMINS = frozenset(x.strip() for x in const.VLAB_INSIGHTIQ_ADMINS.split(',') if x.strip())
+MAX_PAGE_SIZE = 1000
+
+
+def _send_once(username, txn_id, action, body, task_name, args):
+    """Send a task, unless a request with the same X-REQUEST-ID already sent it
+
+    :Returns: Tuple (String, Boolean) of the task id, and if it was sent by an earlier request
+
+    :Raises: ValueError if the request id was already used with a different body
+
+    :param username: The user who made the request
+    :type username: String
+
+    :param txn_id: The value of the X-REQUEST-ID header
+    :type txn_id: String
+
+    :param action: What the request does, like "create" or "delete"
+    :type action: String
+
+    :param body: The JSON body of the request
+    :type body: Dictionary
+
+    :param task_name: The name of the Celery task to send
+    :type task_name: String
+
+    :param args: The arguments of the task
+    :type args: List
+    """
+    task_id, seen = REQUESTS.claim(username, action, txn_id, body, str(uuid.uuid4()))
+    if seen:
+        logger.info('Request {} already sent task {}'.format(txn_id, task_id))
+        return task_id, True
+    try:
+        task = current_app.celery_app.send_task(task_name, args, task_id=task_id)
+    except Exception:
+        REQUESTS.forget(username, action, txn_id)
+        raise
+    return task.id, False
+
+
+def _task_response(resp_data, route_base, task_id, replayed):
+    """Make the HTTP 202 response for a task that was sent"""
+    resp_data['content'] = {'task-id': task_id}
+    resp = Response(ujson.dumps(resp_data))
+    resp.status_code = 202
+    resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, route_base, task_id))
+    if replayed:
+        resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+
+def _conflict(resp_data, error):
+    """Make the HTTP 409 response for a reused X-REQUEST-ID"""
+    resp_data['error'] = '{}'.format(error)
+    return ujson.dumps(resp_data), 409
 
 
 class InsightIQView(MachineView):
@@ -52,6 +119,85 @@ class InsightIQView(MachineView):
     GET_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
                   "description": "Display the InsightIQ instances you own"
                  }
+    BATCH_POST_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                         "type": "object",
+                         "description": "Create several InsightIQ instances at once. Supply either a list of names, or a count and a prefix.",
+                         "properties": {
+                            "network": {
+                                "description": "The public network to connect the InsightIQ instances to",
+                                "type": "string"
+                            },
+                            "names": {
+                                "description": "The names to give the new InsightIQ instances",
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "minItems": 1,
+                                "uniqueItems": True
+                            },
+                            "count": {
+                                "description": "How many InsightIQ instances to create",
+                                "type": "integer",
+                                "minimum": 1
+                            },
+                            "prefix": {
+                                "description": "The instances are named <prefix><number>, starting at 1",
+                                "type": "string"
+                            },
+                            "image": {
+                                "description": "The image/version of InsightIQ to create",
+                                "type": "string"
+                            }
+                        },
+                        "required": ["network", "image"],
+                        "oneOf": [
+                            {"required": ["names"]},
+                            {"required": ["count", "prefix"]}
+                        ]
+                       }
+    BATCH_DELETE_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                           "type": "object",
+                           "description": "Destroy several InsightIQ instances at once. Supply either a list of names, or set all to true.",
+                           "properties": {
+                              "names": {
+                                  "description": "The names of the InsightIQ instances to destroy",
+                                  "type": "array",
+                                  "items": {"type": "string"},
+                                  "minItems": 1,
+                                  "uniqueItems": True
+                              },
+                              "all": {
+                                  "description": "Destroy every InsightIQ instance you own",
+                                  "type": "boolean",
+                                  "enum": [True]
+                              }
+                           },
+                           "oneOf": [
+                              {"required": ["names"]},
+                              {"required": ["all"]}
+                           ]
+                          }
+    TASKS_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                    "description": "List the tasks you've run, and their status"
+                   }
+    INVENTORY_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                        "description": "Display the InsightIQ instances of every user, grouped by owner and version. Admins only."
+                       }
+    INVENTORY_ARGS = {"$schema": "http://json-schema.org/draft-04/schema#",
+                      "type": "object",
+                      "properties": {
+                         "page": {
+                             "description": "Which page of owners to display, starting at 1",
+                             "type": "integer",
+                             "minimum": 1
+                         },
+                         "per_page": {
+                             "description": "How many owners to display per page",
+                             "type": "integer",
+                             "minimum": 1,
+                             "maximum": MAX_PAGE_SIZE
+                         }
+                      }
+                     }
     IMAGES_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
                      "description": "View available versions ofinsightiq that can be created"
                     }
@@ -74,7 +220,11 @@ class InsightIQView(MachineView):
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
     @validate_input(schema=POST_SCHEMA)
     def post(self, *args, **kwargs):
-        """Create a insightiq"""
+        """Create a insightiq
+
+        Retrying a request with the same X-REQUEST-ID returns the task of the
+        original request, instead of starting another deploy.
+        """
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
@@ -82,28 +232,174 @@ class InsightIQView(MachineView):
         network = '{}_{}'.format(username, kwargs['body']['network'])
         machine_name = kwargs['body']['name']
         image = kwargs['body']['image']
-        task = current_app.celery_app.send_task('insightiq.create', [username, machine_name, image, network, txn_id])
-        resp_data['content'] = {'task-id': task.id}
-        resp = Response(ujson.dumps(resp_data))
-        resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
-        return resp
+        try:
+            task_id, replayed = _send_once(username, txn_id, 'create', body, 'insightiq.create',
+                                           [username, machine_name, image, network, txn_id])
+        except ValueError as doh:
+            return _conflict(resp_data, doh)
+        return _task_response(resp_data, self.route_base, task_id, replayed)
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
     @validate_input(schema=DELETE_SCHEMA)
     def delete(self, *args, **kwargs):
-        """Destroy a insightiq"""
+        """Destroy a insightiq
+
+        Retrying a request with the same X-REQUEST-ID returns the task of the
+        original request.
+        """
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
         machine_name = kwargs['body']['name']
-        task = current_app.celery_app.send_task('insightiq.delete', [username, machine_name, txn_id])
-        resp_data['content'] = {'task-id': task.id}
-        resp = Response(ujson.dumps(resp_data))
-        resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        try:
+            task_id, replayed = _send_once(username, txn_id, 'delete', kwargs['body'], 'insightiq.delete',
+                                           [username, machine_name, txn_id])
+        except ValueError as doh:
+            return _conflict(resp_data, doh)
+        return _task_response(resp_data, self.route_base, task_id, replayed)
+
+    @route('/batch', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=BATCH_POST_SCHEMA)
+    @describe(post=BATCH_POST_SCHEMA)
+    def batch_post(self, *args, **kwargs):
+        """Create several insightiq instances with one task"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        body = kwargs['body']
+        network = '{}_{}'.format(username, body['network'])
+        image = body['image']
+        if 'names' in body:
+            machine_names = body['names']
+        else:
+            machine_names = ['{}{}'.format(body['prefix'], x) for x in range(1, body['count'] + 1)]
+        try:
+            task_id, replayed = _send_once(username, txn_id, 'create_batch', body, 'insightiq.create_batch',
+                                           [username, machine_names, image, network, txn_id])
+        except ValueError as doh:
+            return _conflict(resp_data, doh)
+        return _task_response(resp_data, self.route_base, task_id, replayed)
+
+    @route('/batch', methods=["DELETE"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=BATCH_DELETE_SCHEMA)
+    @describe(delete=BATCH_DELETE_SCHEMA)
+    def batch_delete(self, *args, **kwargs):
+        """Destroy several insightiq instances with one task"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        # None means "all of them"
+        machine_names = kwargs['body'].get('names', None)
+        try:
+            task_id, replayed = _send_once(username, txn_id, 'delete_batch', kwargs['body'], 'insightiq.delete_batch',
+                                           [username, machine_names, txn_id])
+        except ValueError as doh:
+            return _conflict(resp_data, doh)
+        return _task_response(resp_data, self.route_base, task_id, replayed)
+
+    @route('/task', methods=["GET"])
+    @route('/task/<tid>', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(get_args=MachineView.TASK_ARGS)
+    def handle_task(self, *args, **kwargs):
+        """Same as ``TaskView.handle_task``, but includes the partial results of
+        a task that's still running (i.e. the instances of a batch that are done),
+        and the place in line of a deploy that's waiting to start."""
+        task_id = request.args.get('task-id', kwargs.get('tid', None))
+        if task_id is not None:
+            result = current_app.celery_app.AsyncResult(task_id)
+            if result.status in ('PROGRESS', 'QUEUED'):
+                resp_data = {'user': kwargs['token']['username'],
+                             'content': {'status': result.status, 'progress': result.info}}
+                return ujson.dumps(resp_data), 202
+        return super().handle_task(*args, **kwargs)
+
+    @route('/tasks', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(get=TASKS_SCHEMA)
+    def tasks(self, *args, **kwargs):
+        """List the tasks you've run, newest first"""
+        username = kwargs['token']['username']
+        resp_data = {'user' : username}
+        backend = current_app.celery_app.backend
+        if not hasattr(backend, 'user_tasks'):
+            resp_data['error'] = 'Listing tasks is not supported by the configured result backend'
+            return ujson.dumps(resp_data), 400
+        found = []
+        for task_id in backend.user_tasks(username):
+            status = backend.get_task_meta(task_id)['status']
+            found.append({'task-id': task_id, 'status': status})
+        resp_data['content'] = {'tasks': found}
+        return ujson.dumps(resp_data), 200
+
+    @route('/inventory', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(get=INVENTORY_SCHEMA, get_args=INVENTORY_ARGS)
+    def inventory(self, *args, **kwargs):
+        """Display the InsightIQ instances of every user; only for the users in ``VLAB_INSIGHTIQ_ADMINS``"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        if username not in ADMINS:
+            resp_data['error'] = 'user {} does not have access'.format(username)
+            return ujson.dumps(resp_data), 403
+        try:
+            page = int(request.args.get('page', 1))
+            per_page = int(request.args.get('per_page', const.VLAB_INSIGHTIQ_INVENTORY_PAGE_SIZE))
+        except ValueError:
+            page, per_page = 0, 0
+        if page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE:
+            resp_data['error'] = 'page must be at least 1, and per_page between 1 and {}'.format(MAX_PAGE_SIZE)
+            return ujson.dumps(resp_data), 400
+        task = current_app.celery_app.send_task('insightiq.inventory', [page, per_page, txn_id])
+        return _task_response(resp_data, self.route_base, task.id, False)
+
+    @route('/task/<tid>/events', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    def task_events(self, *args, **kwargs):
+        """Push the status of a task to the client, instead of the client polling for it.
+
+        Clients that accept ``text/event-stream`` get Server-Sent Events until
+        the task is done, or the stream times out (the client then reconnects
+        with the Last-Event-ID header). Other clients get a long-poll; the
+        response is sent once the task's status changes from the ``last`` event
+        id the client supplied.
+        """
+        username = kwargs['token']['username']
+        task_id = kwargs['tid']
+        last_id = request.args.get('last', request.headers.get('Last-Event-ID', None))
+        events = task_events(current_app.celery_app, task_id, last_id,
+                             timeout=const.VLAB_INSIGHTIQ_EVENTS_TIMEOUT,
+                             interval=const.VLAB_INSIGHTIQ_EVENTS_INTERVAL)
+        if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+            stream = (to_sse(event_id, event) for event_id, event in events)
+            resp = Response(stream_with_context(stream), mimetype='text/event-stream')
+            resp.headers['Cache-Control'] = 'no-cache'
+            # Stop nginx from buffering the stream
+            resp.headers['X-Accel-Buffering'] = 'no'
+            return resp
+        resp_data = {'user' : username}
+        changed = next(events, None)
+        if changed is None:
+            # Nothing new before the timeout; the client should just ask again
+            resp_data['content'] = {'event-id': last_id}
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 202
+        else:
+            event_id, event = changed
+            resp_data['content'] = dict(event, **{'event-id': event_id})
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 200
         return resp
 
+    def after_request(self, name, response):
+        """Don't let the JSON formatting of ``BaseView`` read (and buffer) an event stream"""
+        if response.mimetype == 'text/event-stream':
+            return response
+        return super().after_request(name, response)
+
     @route('/image', methods=["GET"])
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
     @describe(get=IMAGES_SCHEMA)
@@ -112,6 +408,22 @@ class InsightIQView(MachineView):
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
+        if const.VLAB_INSIGHTIQ_SYNC_IMAGES:
+            try:
+                images, etag = IMAGE_CATALOG.versions()
+            except OSError as doh:
+                # Images dir not mounted on the API; let a worker answer instead
+                logger.error('Unable to read images directory: {}'.format(doh))
+            else:
+                if request.if_none_match.contains(etag):
+                    resp = Response()
+                    resp.status_code = 304
+                else:
+                    resp_data['content'] = {'image': images}
+                    resp = Response(ujson.dumps(resp_data))
+                    resp.status_code = 200
+                resp.set_etag(etag)
+                return resp
         task = current_app.celery_app.send_task('insightiq.image', [txn_id])
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
@@ -0,0 +1,23 @@
+# -*- coding: UTF-8 -*-
+"""
+Exposes Prometheus metrics for the InsightIQ API
+"""
+from flask_classy import FlaskView, Response
+
+from vlab_insightiq_api.lib import metrics
+
+
+class MetricsView(FlaskView):
+    """
+    End point for Prometheus to scrape
+    """
+    route_base = '/api/1/inf/insightiq/metrics'
+    trailing_slash = False
+
+    def get(self):
+        """End point for metrics"""
+        body, content_type = metrics.exposition()
+        response = Response(body)
+        response.status_code = 200
+        response.headers['Content-Type'] = content_type
+        return response
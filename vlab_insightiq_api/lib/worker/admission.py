@@ -0,0 +1,170 @@
+# -*- coding: UTF-8 -*-
+"""
+Limits how many InsightIQ deploys write to the datastore at once, and takes turns between users.
+
+Past a handful of concurrent OVA uploads, the datastore's write bandwidth is
+split so many ways that every deploy slows down, and some hit the task time
+limit. With ``VLAB_INSIGHTIQ_MAX_DEPLOYS`` set, at most that many deploys run at
+once; with ``VLAB_INSIGHTIQ_MAX_USER_DEPLOYS`` set, no single user gets more than
+that many of them. Zero means no limit. A deploy gives up its slot as soon as
+its disks are written; booting and waiting for an IP don't load the datastore.
+
+A deploy that can't start yet is put in line. The line is served round-robin
+by user (each user's oldest deploy, then each user's second oldest, ...), so a
+user who asks for 30 deploys doesn't make everyone else wait behind all 30.
+
+The state is a small JSON file in ``VLAB_INSIGHTIQ_ADMISSION_DIR``, changed
+under an ``flock``. Every worker that shares the directory shares the limits.
+"""
+import os
+import time
+import tempfile
+
+import ujson
+
+from vlab_insightiq_api.lib.worker.cache import FileLock
+
+
+
+class Admission(object):
+    """Hands out deploy slots, fairly between users.
+
+    :param directory: Where to keep the state of the slots and line
+    :type directory: String
+
+    :param max_deploys: The most deploys that can run at once. Zero means no limit.
+    :type max_deploys: Integer
+
+    :param max_user_deploys: The most deploys one user can run at once. Zero means no limit.
+    :type max_user_deploys: Integer
+
+    :param interval: How often (in seconds) a waiting deploy checks if it can start
+    :type interval: Integer
+
+    :param running_timeout: A deploy "running" longer than this many seconds was killed without releasing its slot.
+                            Set it to the --time-limit of the write workers (``VLAB_INSIGHTIQ_ADMISSION_TIMEOUT``).
+    :type running_timeout: Integer
+    """
+    def __init__(self, directory, max_deploys=0, max_user_deploys=0, interval=10, running_timeout=1800):
+        self._directory = directory
+        self._max_deploys = max_deploys
+        self._max_user_deploys = max_user_deploys
+        self.interval = interval
+        self._running_timeout = running_timeout
+        # A deploy in line that hasn't checked in for this long was revoked, or lost
+        self._stale = max(60, interval * 3)
+
+    @property
+    def enabled(self):
+        """True if there are any limits to enforce"""
+        return bool(self._max_deploys or self._max_user_deploys)
+
+    def admit(self, task_id, username):
+        """Try to start a deploy. A deploy that can't start is put in line (or
+        keeps its place, if it's already in line).
+
+        :Returns: Tuple (Boolean, Integer) of if the deploy can start, and its
+                  place in line (zero when it can start)
+
+        :param task_id: The id of the task doing the deploy
+        :type task_id: String
+
+        :param username: The user who wants the deploy
+        :type username: String
+        """
+        if not self.enabled:
+            return True, 0
+        now = time.time()
+        with FileLock(self._path('.lock')):
+            state = self._read()
+            self._prune(state, now)
+            running = state['running']
+            waiting = state['waiting']
+            if task_id in running:
+                # A redelivered message of a deploy that's already started
+                return True, 0
+            if task_id in waiting:
+                waiting[task_id]['seen'] = now
+            else:
+                waiting[task_id] = {'user': username, 'queued': now, 'seen': now}
+            line = self._line(waiting)
+            for candidate in line:
+                if not self._fits(running, waiting[candidate]['user']):
+                    continue
+                if candidate == task_id:
+                    running[task_id] = {'user': username, 'started': now}
+                    del waiting[task_id]
+                    self._write(state)
+                    return True, 0
+                # Someone ahead in line gets the slot, once they check in
+                break
+            self._write(state)
+        return False, line.index(task_id) + 1
+
+    def release(self, task_id):
+        """Free up the slot of a deploy that's done, or drop it from the line
+
+        :Returns: None
+
+        :param task_id: The id of the task that did the deploy
+        :type task_id: String
+        """
+        if not self.enabled:
+            return
+        with FileLock(self._path('.lock')):
+            state = self._read()
+            state['running'].pop(task_id, None)
+            state['waiting'].pop(task_id, None)
+            self._write(state)
+
+    def _fits(self, running, username):
+        """Check if one more deploy for a user would stay within the limits"""
+        if self._max_deploys and len(running) >= self._max_deploys:
+            return False
+        if self._max_user_deploys:
+            mine = len([x for x in running.values() if x['user'] == username])
+            if mine >= self._max_user_deploys:
+                return False
+        return True
+
+    @staticmethod
+    def _line(waiting):
+        """Order the waiting deploys round-robin by user, oldest first within a user
+
+        :Returns: List of task ids
+        """
+        per_user = {}
+        for task_id in sorted(waiting.keys(), key=lambda x: waiting[x]['queued']):
+            per_user.setdefault(waiting[task_id]['user'], []).append(task_id)
+        # Users take turns in the order they first got in line
+        users = sorted(per_user.keys(), key=lambda x: waiting[per_user[x][0]]['queued'])
+        line = []
+        for turn in range(max([len(x) for x in per_user.values()] or [0])):
+            for user in users:
+                if turn < len(per_user[user]):
+                    line.append(per_user[user][turn])
+        return line
+
+    def _prune(self, state, now):
+        """Drop deploys that were killed, or stopped checking in"""
+        state['running'] = {x: y for x, y in state['running'].items() if now - y['started'] < self._running_timeout}
+        state['waiting'] = {x: y for x, y in state['waiting'].items() if now - y['seen'] < self._stale}
+
+    def _path(self, suffix):
+        return os.path.join(self._directory, 'deploys' + suffix)
+
+    def _read(self):
+        """Load the slots and line; empty ones if there's no state yet"""
+        try:
+            with open(self._path('.json')) as the_file:
+                return ujson.load(the_file)
+        except (OSError, ValueError):
+            return {'running': {}, 'waiting': {}}
+
+    def _write(self, state):
+        """Atomically replace the state file"""
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory)
+        with os.fdopen(fd, 'w') as the_file:
+            ujson.dump(state, the_file)
+        os.replace(tmp_path, self._path('.json'))
+
@@ -0,0 +1,157 @@
+# -*- coding: UTF-8 -*-
+"""
+A short lived, per-user cache for the results of ``insightiq.show``.
+
+The cache lives on disk so that every process of a Celery worker shares it, and
+so that a task that changes a user's VMs (create, delete, etc) can invalidate
+the cached listing no matter which process ran the ``show`` task.
+"""
+import os
+import time
+import fcntl
+import tempfile
+from urllib.parse import quote
+
+import ujson
+
+
+class ResultCache(object):
+    """Store JSON-able results per user, for a limited amount of time.
+
+    :param directory: Where to save the cached results
+    :type directory: String
+
+    :param ttl: How many seconds a result is valid for. Set to zero to disable caching.
+    :type ttl: Integer
+    """
+    def __init__(self, directory, ttl):
+        self._directory = directory
+        self._ttl = ttl
+
+    def get(self, username):
+        """Obtain the cached result for a user, if it's not expired.
+
+        :Returns: Dictionary or None
+
+        :param username: The user who owns the cached result
+        :type username: String
+        """
+        if not self._ttl:
+            return None
+        record = self._read(username)
+        if record.get('data') is None:
+            return None
+        elif time.time() - record['stored'] > self._ttl:
+            return None
+        return record['data']
+
+    def set(self, username, data, started):
+        """Save a result for a user.
+
+        The result is *not* saved if the cache was invalidated after ``started``;
+        that means the user changed something while the result was being computed,
+        so it's already stale.
+
+        :Returns: None
+
+        :param username: The user who owns the result
+        :type username: String
+
+        :param data: The result to cache
+        :type data: Dictionary
+
+        :param started: The epoch timestamp of when work on the result began
+        :type started: Float
+        """
+        if not self._ttl:
+            return
+        with self._locked(username):
+            invalidated = self._read(username).get('invalidated', 0)
+            if invalidated >= started:
+                return
+            self._write(username, {'stored': time.time(), 'data': data, 'invalidated': invalidated})
+
+    def invalidate(self, username):
+        """Drop the cached result for a user.
+
+        :Returns: None
+
+        :param username: The user whose cached result is now stale
+        :type username: String
+        """
+        if not self._ttl:
+            return
+        with self._locked(username):
+            self._write(username, {'invalidated': time.time(), 'data': None})
+
+    def changed(self, username):
+        """Obtain when the cache for a user was last invalidated; i.e. when they last changed something.
+
+        :Returns: Float epoch timestamp, or 0 if never (or the cache is disabled)
+
+        :param username: The user who owns the cached result
+        :type username: String
+        """
+        if not self._ttl:
+            return 0
+        return self._read(username).get('invalidated', 0)
+
+    def _path(self, username, suffix='.json'):
+        """Avoid usernames being treated as file paths"""
+        return os.path.join(self._directory, quote(username, safe='') + suffix)
+
+    def _read(self, username):
+        """Load the on-disk record for a user; an empty dictionary if there is none"""
+        try:
+            with open(self._path(username)) as the_file:
+                return ujson.load(the_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, username, record):
+        """Atomically replace the on-disk record for a user"""
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory)
+        with os.fdopen(fd, 'w') as the_file:
+            ujson.dump(record, the_file)
+        os.replace(tmp_path, self._path(username))
+
+    def _locked(self, username):
+        """Serialize writers for a single user, across processes"""
+        return FileLock(self._path(username, suffix='.lock'))
+
+
+class FileLock(object):
+    """An exclusive ``flock`` held for the life of a ``with`` block.
+
+    Works across every process on the same host.
+
+    :param path: The file to lock. Created (along with its directory) if needed.
+    :type path: String
+
+    :param blocking: Set to False to not wait for the lock; check ``held`` to see if it was taken
+    :type blocking: Boolean
+    """
+    def __init__(self, path, blocking=True):
+        self._path = path
+        self._blocking = blocking
+        self._fd = None
+        self.held = False
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        self._fd = os.open(self._path, os.O_CREAT | os.O_RDWR)
+        flags = fcntl.LOCK_EX if self._blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._fd, flags)
+        except BlockingIOError:
+            os.close(self._fd)
+            self._fd = None
+        else:
+            self.held = True
+        return self
+
+    def __exit__(self, *args):
+        if self.held:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self.held = False
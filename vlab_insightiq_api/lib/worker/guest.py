@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+"""
+Waits for a new VM to get an IP by having vCenter push changes to its guest info.
+
+``virtual_machine.get_info(ensure_ip=True)`` reads ``guest.net`` once a second
+until the appliance has an IP, which is a round trip per second per deploy, and
+up to a second of waiting after the IP shows up. Instead, ``wait_for_ip`` asks a
+PropertyCollector to report changes to ``guest.net``, and blocks in
+``WaitForUpdatesEx`` until vCenter has one.
+"""
+import time
+
+from pyVmomi import vim, vmodl
+
+from vlab_insightiq_api.lib.worker import inventory
+
+
+def wait_for_ip(vcenter, the_vm, timeout, ignore=()):
+    """Block until a VM reports an IP
+
+    :Returns: List of the VM's IPs
+
+    :Raises: RuntimeError if the VM has no IP within ``timeout`` seconds
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine to wait on
+    :type the_vm: vim.VirtualMachine
+
+    :param timeout: The most seconds to wait
+    :type timeout: Integer
+
+    :param ignore: Optional - IPs that don't count, like the ones a VM had before it changed networks
+    :type ignore: List
+    """
+    # Deploys in a batch share one session, so each wait gets its own collector;
+    # otherwise they'd consume each other's updates
+    collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+    try:
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=the_vm, skip=False)
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=['guest.net'])
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        deadline = time.time() + timeout
+        version = ''
+        while True:
+            remaining = int(deadline - time.time())
+            if remaining <= 0:
+                break
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=remaining)
+            update = collector.WaitForUpdatesEx(version, options)
+            if update is None:
+                # maxWaitSeconds passed without a change
+                continue
+            version = update.version
+            ips = [x for x in _changed_ips(the_vm, update) if x not in ignore]
+            if ips:
+                return ips
+    finally:
+        collector.DestroyPropertyCollector()
+    error = "Unable to obtain an IP within {} seconds".format(timeout)
+    raise RuntimeError(error)
+
+
+def _changed_ips(the_vm, update):
+    """Pull the IPs out of an update to ``guest.net``
+
+    :Returns: List
+
+    :param the_vm: The virtual machine being waited on
+    :type the_vm: vim.VirtualMachine
+
+    :param update: What WaitForUpdatesEx returned
+    :type update: vmodl.query.PropertyCollector.UpdateSet
+    """
+    changes = [z for x in update.filterSet for y in x.objectSet for z in y.changeSet]
+    assigned = [x for x in changes if x.name == 'guest.net' and x.op == 'assign']
+    if assigned:
+        return inventory.get_ips(assigned[-1].val or [])
+    elif changes:
+        # Some other kind of change to the NICs; just read them
+        return inventory.get_ips(the_vm.guest.net)
+    return []
@@ -0,0 +1,475 @@
+# -*- coding: UTF-8 -*-
+"""
+Bulk lookups of virtual machine details via the vSphere PropertyCollector.
+
+Reading properties off of pyVmomi objects one at a time is a SOAP round trip per
+attribute. The functions in this module ask vCenter for every property we need,
+for every VM in a folder, in a single ``RetrievePropertiesEx`` call.
+"""
+import ssl
+import textwrap
+
+import ujson
+import OpenSSL
+from pyVmomi import vim, vmodl
+
+from vlab_insightiq_api.lib import const
+
+
+VM_PROPERTIES = ['name', 'runtime.powerState', 'config.annotation', 'guest.net', 'network']
+UNKNOWN_META = {'component': 'Unknown',
+                'created': 0,
+                'version': "Unknown",
+                'generation': 0,
+                'configured': False
+               }
+# Maps a username to the moId of their VM folder. Only ever used as a hint; the
+# folder is always checked before being trusted.
+_FOLDERS = {}
+
+
+def retrieve(vcenter, filter_spec):
+    """Run a PropertyCollector query, following the continuation token until
+    every page of results has been read.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param filter_spec: What objects and properties to obtain
+    :type filter_spec: vmodl.query.PropertyCollector.FilterSpec
+    """
+    answer = {}
+    collector = vcenter.content.propertyCollector
+    result = collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+    while result:
+        for obj in result.objects:
+            answer[obj.obj] = {prop.name: prop.val for prop in obj.propSet}
+        if result.token:
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+        else:
+            result = None
+    return answer
+
+
+def folder_vms(vcenter, folder, username):
+    """Obtain the details about every VM in a folder. The returned dictionary
+    maps the name of the VM to the same data ``virtual_machine.get_info`` returns.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder that contains the virtual machines
+    :type folder: vim.Folder
+
+    :param username: The name of the user who owns the VMs
+    :type username: String
+    """
+    vm_to_network = vmodl.query.PropertyCollector.TraversalSpec(name='vmToNetwork',
+                                                                type=vim.VirtualMachine,
+                                                                path='network',
+                                                                skip=False)
+    folder_to_vm = vmodl.query.PropertyCollector.TraversalSpec(name='folderToVm',
+                                                               type=vim.Folder,
+                                                               path='childEntity',
+                                                               skip=False,
+                                                               selectSet=[vm_to_network])
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=folder, skip=True, selectSet=[folder_to_vm])
+    vm_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=VM_PROPERTIES)
+    net_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.Network, pathSet=['name'])
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[vm_props, net_props])
+    found = retrieve(vcenter, filter_spec)
+
+    network_names = {obj: props['name'] for obj, props in found.items() if isinstance(obj, vim.Network)}
+    vms = {}
+    for obj, props in found.items():
+        if isinstance(obj, vim.VirtualMachine):
+            vms[props['name']] = _to_info(obj, props, network_names, username)
+    return vms
+
+
+def vm_info(vcenter, the_vm, username):
+    """Obtain the details about one VM, in the same format as
+    ``virtual_machine.get_info``. The names of the VM's networks come from the
+    same query, instead of ``vcenter.networks`` reading the name of every
+    network in vCenter.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine
+    :type the_vm: vim.VirtualMachine
+
+    :param username: The name of the user who owns the VM
+    :type username: String
+    """
+    vm_to_network = vmodl.query.PropertyCollector.TraversalSpec(name='vmToNetwork',
+                                                                type=vim.VirtualMachine,
+                                                                path='network',
+                                                                skip=False)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=the_vm, skip=False, selectSet=[vm_to_network])
+    vm_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=VM_PROPERTIES)
+    net_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.Network, pathSet=['name'])
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[vm_props, net_props])
+    found = retrieve(vcenter, filter_spec)
+
+    network_names = {obj: props['name'] for obj, props in found.items() if isinstance(obj, vim.Network)}
+    props = {}
+    for obj, obj_props in found.items():
+        if isinstance(obj, vim.VirtualMachine):
+            props = obj_props
+    info = _to_info(the_vm, props, network_names, username)
+    add_consoles(vcenter, {props.get('name', ''): info})
+    return info
+
+
+def find_folder(vcenter, username):
+    """Obtain the VM folder of a user.
+
+    Finding a folder by name means listing every folder under the vLab top level
+    directory, so once found the folder's moId is remembered. On later calls, the
+    remembered folder only needs its name checked to know it's still correct.
+
+    :Returns: vim.Folder
+
+    :Raises: ValueError if the user has no folder
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The name of the user who owns the folder
+    :type username: String
+    """
+    moid = _FOLDERS.get(username)
+    if moid:
+        folder = vim.Folder(moid, stub=vcenter._conn._stub)
+        try:
+            if folder.name == username:
+                return folder
+        except vmodl.fault.ManagedObjectNotFound:
+            pass
+        _FOLDERS.pop(username, None)
+    folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    _FOLDERS[username] = folder._moId
+    return folder
+
+
+def find_vm(vcenter, folder, machine_name):
+    """Look up a VM by name within a folder, without listing the folder.
+
+    :Returns: vim.VirtualMachine or None
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder that contains the virtual machine
+    :type folder: vim.Folder
+
+    :param machine_name: The name of the virtual machine
+    :type machine_name: String
+    """
+    entity = vcenter.content.searchIndex.FindChild(entity=folder, name=machine_name)
+    if isinstance(entity, vim.VirtualMachine):
+        return entity
+    return None
+
+
+def get_meta(vcenter, the_vm):
+    """Obtain the vLab meta data of a VM, without pulling down the whole VM config.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine
+    :type the_vm: vim.VirtualMachine
+    """
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=the_vm, skip=False)
+    vm_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=['config.annotation'])
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[vm_props])
+    props = retrieve(vcenter, filter_spec).get(the_vm, {})
+    return _parse_meta(props)
+
+
+def network_names(vcenter):
+    """Obtain every network in vCenter, with one PropertyCollector query instead
+    of reading the name of each network one at a time.
+
+    :Returns: Dictionary mapping the network name to the vim.Network
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    content = vcenter.content
+    view = content.viewManager.CreateContainerView(container=content.rootFolder,
+                                                   type=[vim.Network],
+                                                   recursive=True)
+    try:
+        view_to_obj = vmodl.query.PropertyCollector.TraversalSpec(name='viewToObject',
+                                                                  type=vim.view.ContainerView,
+                                                                  path='view',
+                                                                  skip=False)
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[view_to_obj])
+        net_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.Network, pathSet=['name'])
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[net_props])
+        found = retrieve(vcenter, filter_spec)
+    finally:
+        view.DestroyView()
+    return {props['name']: obj for obj, props in found.items() if 'name' in props}
+
+
+def insightiq_vms(vcenter, folder, username):
+    """Like ``folder_vms``, but only the VMs that are InsightIQ instances. Only
+    these VMs get a console URL, because making one costs a call to vCenter.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder that contains the virtual machines
+    :type folder: vim.Folder
+
+    :param username: The name of the user who owns the VMs
+    :type username: String
+    """
+    vms = {x: y for x, y in folder_vms(vcenter, folder, username).items() if y['meta']['component'] == 'InsightIQ'}
+    add_consoles(vcenter, vms)
+    return vms
+
+
+def add_consoles(vcenter, vms):
+    """Set the console URL of every VM in a ``folder_vms`` style dictionary
+
+    :Returns: None
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param vms: Maps the VM name to its info
+    :type vms: Dictionary
+    """
+    if vms:
+        console_url = _console_url_maker(vcenter)
+        for name, info in vms.items():
+            info['console'] = console_url(info['moid'], name)
+
+
+def insightiq_objects(vcenter, folder):
+    """Find every InsightIQ VM in a folder, along with its power state. Cheaper
+    than ``insightiq_vms`` because it skips the guest and network details.
+
+    :Returns: Dictionary mapping the VM name to a tuple of (vim.VirtualMachine, power state)
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder that contains the virtual machines
+    :type folder: vim.Folder
+    """
+    folder_to_vm = vmodl.query.PropertyCollector.TraversalSpec(name='folderToVm',
+                                                               type=vim.Folder,
+                                                               path='childEntity',
+                                                               skip=False)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=folder, skip=True, selectSet=[folder_to_vm])
+    vm_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                                          pathSet=['name', 'runtime.powerState', 'config.annotation'])
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[vm_props])
+    found = retrieve(vcenter, filter_spec)
+
+    vms = {}
+    for obj, props in found.items():
+        if isinstance(obj, vim.VirtualMachine) and _parse_meta(props)['component'] == 'InsightIQ':
+            vms[props['name']] = (obj, props.get('runtime.powerState'))
+    return vms
+
+
+def every_insightiq(vcenter, top_folder):
+    """Find every InsightIQ VM, of every user, grouped by owner and version.
+
+    Running ``insightiq_vms`` per user means finding each user's folder, then
+    a query per folder. Instead, this walks every folder under ``top_folder``
+    in a single ``RetrievePropertiesEx`` call. The owner of a VM is the name of
+    the folder it's in. Console URLs are left out, because making one costs a
+    call to vCenter per VM.
+
+    :Returns: Dictionary of owner -> version -> VM name -> ``get_info`` data
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param top_folder: The folder that contains every user's VM folder
+    :type top_folder: vim.Folder
+    """
+    found = retrieve(vcenter, every_vm_spec(top_folder))
+    return group_insightiq(found)
+
+
+def every_vm_spec(top_folder):
+    """Make the PropertyCollector query for every VM, folder, and VM network under a folder
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param top_folder: The folder that contains every user's VM folder
+    :type top_folder: vim.Folder
+    """
+    vm_to_network = vmodl.query.PropertyCollector.TraversalSpec(name='vmToNetwork',
+                                                                type=vim.VirtualMachine,
+                                                                path='network',
+                                                                skip=False)
+    folder_to_child = vmodl.query.PropertyCollector.TraversalSpec(name='folderToChild',
+                                                                  type=vim.Folder,
+                                                                  path='childEntity',
+                                                                  skip=False)
+    # Recurse into sub-folders, and out to the networks of the VMs found
+    folder_to_child.selectSet = [vmodl.query.PropertyCollector.SelectionSpec(name='folderToChild'), vm_to_network]
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=top_folder, skip=True, selectSet=[folder_to_child])
+    vm_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=VM_PROPERTIES + ['parent'])
+    folder_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.Folder, pathSet=['name'])
+    net_props = vmodl.query.PropertyCollector.PropertySpec(type=vim.Network, pathSet=['name'])
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[vm_props, folder_props, net_props])
+
+
+def group_insightiq(found):
+    """Group the InsightIQ VMs found by ``every_vm_spec`` by owner and version.
+    The standby VMs in ``VLAB_INSIGHTIQ_STANDBY_FOLDER`` aren't anyone's yet, so
+    they're left out.
+
+    :Returns: Dictionary of owner -> version -> VM name -> ``get_info`` data
+
+    :param found: Maps every object found to its properties
+    :type found: Dictionary
+    """
+    names = {obj: props.get('name', '') for obj, props in found.items() if not isinstance(obj, vim.VirtualMachine)}
+    owners = {}
+    for obj, props in found.items():
+        if not isinstance(obj, vim.VirtualMachine):
+            continue
+        owner = names.get(props.get('parent'))
+        if owner is None:
+            # Being moved between folders; it'll show up on the next look
+            continue
+        if owner == const.VLAB_INSIGHTIQ_STANDBY_FOLDER:
+            continue
+        info = _to_info(obj, props, names, owner)
+        if info['meta']['component'] != 'InsightIQ':
+            continue
+        version = info['meta'].get('version', 'Unknown')
+        owners.setdefault(owner, {}).setdefault(version, {})[props['name']] = info
+    return owners
+
+
+def _to_info(the_vm, props, network_names, username):
+    """Convert the raw PropertyCollector results into the ``get_info`` format
+
+    :Returns: Dictionary
+
+    :param the_vm: The VM the properties belong to
+    :type the_vm: vim.VirtualMachine
+
+    :param props: The properties of the VM
+    :type props: Dictionary
+
+    :param network_names: Maps vim.Network objects to their names
+    :type network_names: Dictionary
+
+    :param username: The name of the user who owns the VM
+    :type username: String
+    """
+    details = {}
+    details['state'] = props.get('runtime.powerState')
+    details['console'] = None
+    details['ips'] = get_ips(props.get('guest.net', []))
+    details['networks'] = _get_networks(props.get('network', []), network_names, username)
+    details['moid'] = the_vm._moId
+    details['meta'] = _parse_meta(props)
+    return details
+
+
+def _parse_meta(props):
+    """Load the vLab meta data stored in the notes of a VM
+
+    :Returns: Dictionary
+
+    :param props: The properties of the VM
+    :type props: Dictionary
+    """
+    try:
+        return ujson.loads(props['config.annotation'])
+    except (KeyError, ValueError, TypeError):
+        # KeyError   -> A VM being deployed has no config
+        # ValueError -> VM created, but notes not updated
+        # TypeError  -> VM failed to be created; notes are None
+        return dict(UNKNOWN_META)
+
+
+def get_ips(guest_nics):
+    """Pull the IPs out of the VM's guest NIC info
+
+    :Returns: List
+
+    :param guest_nics: The value of ``guest.net`` for a VM
+    :type guest_nics: List
+    """
+    ips = []
+    for nic in guest_nics:
+        ips += nic.ipAddress
+    # No point is showing the IPv6 link local addrs if a firewall wont forward them
+    return [x for x in ips if not x.startswith('fe80::')]
+
+
+def _get_networks(networks, network_names, username):
+    """Obtain the names of the user's networks that a VM is connected to
+
+    :Returns: List
+
+    :param networks: The value of ``network`` for a VM
+    :type networks: List
+
+    :param network_names: Maps vim.Network objects to their names
+    :type network_names: Dictionary
+
+    :param username: The name of the user who owns the VM
+    :type username: String
+    """
+    answer = []
+    for network in networks:
+        name = network_names.get(network, '')
+        if name.startswith(username):
+            answer.append(name.replace('{}_'.format(username), ''))
+    return answer
+
+
+def _console_url_maker(vcenter):
+    """Look up the parts of the HTML5 console URL that are the same for every VM.
+
+    :Returns: Function
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    vcenter_cert = ssl.get_server_certificate((const.INF_VCENTER_SERVER, const.INF_VCENTER_PORT))
+    thumbprint = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, vcenter_cert).digest('sha1').decode()
+    content = vcenter.content
+    server_guid = content.about.instanceUuid
+    session_manager = content.sessionManager
+
+    def console_url(moid, name):
+        # Clone tickets are single use, so every VM needs its own
+        url = """\
+        https://{0}/ui/webconsole.html?vmId={1}&vmName={2}&serverGuid={3}&
+        locale=en_US&host={0}&sessionTicket={4}&thumbprint={5}
+        """.format(const.INF_VCENTER_SERVER,
+                   moid,
+                   name,
+                   server_guid,
+                   session_manager.AcquireCloneTicket(),
+                   thumbprint)
+        return textwrap.dedent(url).replace('\n', '')
+    return console_url
@@ -0,0 +1,292 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-memory copy of every InsightIQ VM under the vLab top level folder, kept
+current by vCenter pushing changes to it.
+
+Every ``show``, ``delete`` and ``modify_network`` task looks up the user's folder
+and VMs from scratch; a handful of SOAP calls each time. When
+``VLAB_INSIGHTIQ_MIRROR`` is set, each worker process instead runs a thread that
+asks a PropertyCollector for every VM, folder and VM network under the top level
+folder, then blocks in ``WaitForUpdatesEx`` for changes to them. Lookups are
+then answered from memory.
+
+Every answer is stamped with the version of the last update applied, and the
+time the mirror is known to be current as of. A ``WaitForUpdatesEx`` call that
+returns has reported every change made before the call was sent, so the time a
+call was sent is how current the mirror is once the call returns. A lookup can
+ask for a mirror that's current as of some time (like when the user last
+changed something), and gets None when the mirror is behind that; the caller
+then asks vCenter directly.
+
+With ``VLAB_INSIGHTIQ_MIRROR_SNAPSHOT`` set, the grouped inventory is also saved
+to that file every ``SNAPSHOT_INTERVAL`` seconds, for processes that don't run
+a mirror.
+"""
+import os
+import time
+import tempfile
+import threading
+from collections import namedtuple
+
+import ujson
+from pyVmomi import vim, vmodl
+from vlab_api_common import get_logger
+
+from vlab_insightiq_api.lib import const
+from vlab_insightiq_api.lib.worker import inventory
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL)
+Lookup = namedtuple('Lookup', ['data', 'version', 'as_of'])
+SNAPSHOT_INTERVAL = 30
+# How long to wait before logging back into vCenter after losing the session
+RETRY_INTERVAL = 10
+
+
+class InventoryMirror(object):
+    """Follows the changes to every VM under the vLab top level folder.
+
+    :param factory: A callable that logs into vCenter, and returns the new vCenter object
+    :type factory: Function
+
+    :param top_dir: The folder that holds every user's folder
+    :type top_dir: String
+
+    :param wait: The most seconds a single ``WaitForUpdatesEx`` blocks for
+    :type wait: Integer
+
+    :param max_age: Lookups aren't answered when the mirror is older than this many seconds
+    :type max_age: Integer
+
+    :param snapshot: Optional - The file to save the inventory to
+    :type snapshot: String
+    """
+    def __init__(self, factory, top_dir, wait=5, max_age=30, snapshot=''):
+        self._factory = factory
+        self._top_dir = top_dir
+        self._wait = wait
+        self._max_age = max_age
+        self._snapshot = snapshot
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._objects = {}
+        self._version = ''
+        self._as_of = 0
+        self._grouped = None
+        self._saved = 0
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start following vCenter in a background thread, if not already
+
+        :Returns: None
+        """
+        pid = os.getpid()
+        with self._lock:
+            # Celery forks its pool processes; threads don't survive a fork
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._reset()
+            # Every thread gets its own event, so a stopped thread can't be restarted by accident
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stopped,), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop following vCenter, and forget the inventory
+
+        :Returns: None
+        """
+        self._stopped.set()
+        with self._lock:
+            self._pid = None
+            self._reset()
+
+    def user_vms(self, username, since=0):
+        """Obtain the InsightIQ instances of a user, in the ``insightiq_vms``
+        format without console URLs.
+
+        :Returns: Lookup, or None if the mirror isn't current as of ``since``, or the user has no folder
+
+        :param username: The user who owns the VMs
+        :type username: String
+
+        :param since: The epoch time the mirror must be current as of
+        :type since: Float
+        """
+        with self._lock:
+            if not self._current(since):
+                return None
+            folders, owners = self._group()
+            if username not in folders:
+                # Let vCenter say the folder doesn't exist
+                return None
+            vms = {}
+            for by_name in owners.get(username, {}).values():
+                vms.update({x: dict(y) for x, y in by_name.items()})
+            return Lookup(vms, self._version, self._as_of)
+
+    def owners(self, since=0):
+        """Obtain every InsightIQ instance, of every user
+
+        :Returns: Lookup of owner -> version -> VM name -> VM info, or None if the mirror isn't current
+
+        :param since: The epoch time the mirror must be current as of
+        :type since: Float
+        """
+        with self._lock:
+            if not self._current(since):
+                return None
+            _, owners = self._group()
+            return Lookup(owners, self._version, self._as_of)
+
+    def find_vm(self, vcenter, username, machine_name):
+        """Look up an InsightIQ instance without searching for it in vCenter.
+        The VM's name is checked, because it could have been deleted since the
+        mirror last heard from vCenter.
+
+        :Returns: vim.VirtualMachine, or None if the mirror doesn't know of it
+
+        :param vcenter: The vCenter object, that the returned VM will use
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param username: The user who owns the VM
+        :type username: String
+
+        :param machine_name: The name of the VM
+        :type machine_name: String
+        """
+        with self._lock:
+            if not self._current(0):
+                return None
+            _, owners = self._group()
+            info = None
+            for by_name in owners.get(username, {}).values():
+                info = by_name.get(machine_name, info)
+        if info is None:
+            return None
+        the_vm = vim.VirtualMachine(info['moid'], stub=vcenter._conn._stub)
+        try:
+            if the_vm.name == machine_name:
+                return the_vm
+        except vmodl.fault.ManagedObjectNotFound:
+            pass
+        return None
+
+    def _current(self, since):
+        """If the mirror is recent enough to answer a lookup. Call while holding the lock."""
+        return self._as_of >= since and time.time() - self._as_of <= self._max_age
+
+    def _group(self):
+        """The folder names and grouped InsightIQ VMs, recomputed only after a change. Call while holding the lock."""
+        if self._grouped is None:
+            folders = set(props.get('name') for obj, props in self._objects.items()
+                          if isinstance(obj, vim.Folder))
+            self._grouped = (folders, inventory.group_insightiq(self._objects))
+        return self._grouped
+
+    def _reset(self):
+        """Forget the inventory. Call while holding the lock."""
+        self._objects = {}
+        self._version = ''
+        self._as_of = 0
+        self._grouped = None
+
+    def _run(self, stopped):
+        while not stopped.is_set():
+            try:
+                self._follow(stopped)
+            except Exception:
+                # Session expired, vCenter restarted, etc; start over with a new session
+                logger.exception('Inventory mirror stopped following vCenter; retrying in {} seconds'.format(RETRY_INTERVAL))
+                with self._lock:
+                    self._reset()
+                stopped.wait(RETRY_INTERVAL)
+
+    def _follow(self, stopped):
+        """Load the whole inventory, then apply changes to it until stopped"""
+        vcenter = self._factory()
+        collector = None
+        try:
+            top_folder = vcenter.get_vm_folder(self._top_dir)
+            collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+            collector.CreateFilter(inventory.every_vm_spec(top_folder), partialUpdates=False)
+            version = ''
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self._wait)
+            while not stopped.is_set():
+                sent = time.time()
+                update = collector.WaitForUpdatesEx(version, options)
+                with self._lock:
+                    if stopped.is_set():
+                        break
+                    if update is not None:
+                        self._apply(update)
+                        version = update.version
+                        self._version = version
+                    # A truncated update means vCenter has more to send right away
+                    if update is None or not update.truncated:
+                        self._as_of = sent
+                self._save()
+        finally:
+            if collector is not None:
+                try:
+                    collector.DestroyPropertyCollector()
+                except Exception:
+                    pass
+            vcenter.close()
+
+    def _apply(self, update):
+        """Merge the changes vCenter sent into the inventory. Call while holding the lock."""
+        for filter_update in update.filterSet:
+            for obj_update in filter_update.objectSet:
+                if obj_update.kind == 'leave':
+                    self._objects.pop(obj_update.obj, None)
+                    continue
+                props = self._objects.setdefault(obj_update.obj, {})
+                for change in obj_update.changeSet:
+                    if change.op in ('remove', 'indirectRemove'):
+                        props.pop(change.name, None)
+                    else:
+                        props[change.name] = change.val
+        self._grouped = None
+
+    def _save(self):
+        """Write the inventory to the snapshot file, if it's time to"""
+        if not self._snapshot or time.time() - self._saved < SNAPSHOT_INTERVAL:
+            return
+        with self._lock:
+            if not self._as_of:
+                return
+            _, owners = self._group()
+            record = {'version': self._version, 'as_of': self._as_of, 'owners': owners}
+        directory = os.path.dirname(self._snapshot) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as the_file:
+            ujson.dump(record, the_file)
+        os.replace(tmp_path, self._snapshot)
+        self._saved = time.time()
+
+
+def read_snapshot(path, since=0):
+    """Load the inventory a mirror saved
+
+    :Returns: Lookup of owner -> version -> VM name -> VM info, or None if there's
+              no snapshot, or it's older than ``since``
+
+    :param path: The snapshot file
+    :type path: String
+
+    :param since: The epoch time the snapshot must be current as of
+    :type since: Float
+    """
+    try:
+        with open(path) as the_file:
+            record = ujson.load(the_file)
+    except (OSError, ValueError):
+        return None
+    if record.get('as_of', 0) < since:
+        return None
+    return Lookup(record['owners'], record['version'], record['as_of'])
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+"""
+A per-worker index of network names to vCenter managed object ids.
+
+``vcenter.networks`` lists every port group in vCenter, then reads the name of
+each one (a round trip per network), on every task. Every user has their own
+networks, so that's thousands of round trips just to find one network. This
+index loads every network name with one PropertyCollector query, and keeps it
+for ``VLAB_INSIGHTIQ_NETWORK_TTL`` seconds. A name that's not in the index
+causes a reload, so new networks are found right away.
+"""
+import os
+import time
+import threading
+
+from pyVmomi import vmodl
+
+from vlab_insightiq_api.lib.worker import inventory
+
+
+class NetworkIndex(object):
+    """Maps network names to their managed object ids.
+
+    The ids are stored instead of the objects, because a managed object is tied
+    to the vCenter session that found it.
+
+    :param ttl: How many seconds the index is used before it's reloaded
+    :type ttl: Integer
+    """
+    def __init__(self, ttl=300):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._networks = {}
+        self._loaded = 0
+        self._pid = os.getpid()
+
+    def lookup(self, vcenter, name):
+        """Find a network by name
+
+        :Returns: vim.Network
+
+        :Raises: KeyError if there's no network with that name
+
+        :param vcenter: The vCenter object
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param name: The name of the network
+        :type name: String
+        """
+        entry = self._current().get(name)
+        if entry is not None:
+            net_type, moid = entry
+            network = net_type(moid, stub=vcenter._conn._stub)
+            # The network could have been deleted (or renamed) since the index was loaded
+            try:
+                if network.name == name:
+                    return network
+            except vmodl.fault.ManagedObjectNotFound:
+                pass
+        return self.refresh(vcenter)[name]
+
+    def refresh(self, vcenter):
+        """Reload every network name from vCenter
+
+        :Returns: Dictionary mapping the network name to the vim.Network
+
+        :param vcenter: The vCenter object
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        found = inventory.network_names(vcenter)
+        with self._lock:
+            self._networks = {x: (type(y), y._moId) for x, y in found.items()}
+            self._loaded = time.time()
+        return found
+
+    def _current(self):
+        """The index, or an empty one if it's expired
+
+        :Returns: Dictionary mapping the network name to a tuple of (type, moId)
+        """
+        with self._lock:
+            if self._pid != os.getpid() or time.time() - self._loaded > self._ttl:
+                self._networks = {}
+                self._pid = os.getpid()
+            return self._networks
+
+    def clear(self):
+        """Forget every network
+
+        :Returns: None
+        """
+        with self._lock:
+            self._networks = {}
+            self._loaded = 0
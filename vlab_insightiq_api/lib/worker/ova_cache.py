@@ -0,0 +1,316 @@
+# -*- coding: UTF-8 -*-
+"""
+Caches what's inside an OVA, so it only has to be parsed (and verified) once.
+
+Opening an ``Ova`` scans the whole tarball and re-reads the OVF every time. The
+contents of an OVA file never change without the file changing, so the parsed
+OVF, network names, and where each disk lives in the tarball are saved, keyed by
+the identity of the file (path, inode, size, and mtime). The first time an OVA
+is seen, every file listed in its manifest is checksummed; a corrupted image is
+rejected before any upload to vCenter starts.
+"""
+import os
+import re
+import hashlib
+import tarfile
+import tempfile
+from collections import namedtuple
+
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware.ova import Ova, FileHandle
+
+from vlab_insightiq_api.lib import const
+from vlab_insightiq_api.lib.worker import upload
+from vlab_insightiq_api.lib.worker.cache import FileLock
+
+
+ImageMeta = namedtuple('ImageMeta', ['ovf', 'networks', 'disks'])
+MANIFEST_LINE = re.compile(r'^(?P<algorithm>SHA1|SHA256|SHA512)\((?P<name>.+)\)\s*=\s*(?P<digest>[0-9a-fA-F]+)\s*$')
+READ_SIZE = 1024 * 1024
+_CACHE = {}
+
+
+def open_ova(ova_path):
+    """Open an OVA without scanning the tarball, if it's been seen before.
+
+    :Returns: CachedOva
+
+    :Raises: FileNotFoundError if the OVA does not exist, ValueError if the OVA is corrupted
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+    """
+    return CachedOva(ova_path, get_meta(ova_path))
+
+
+def get_meta(ova_path):
+    """Obtain the parsed contents of an OVA
+
+    :Returns: ImageMeta
+
+    :Raises: FileNotFoundError if the OVA does not exist, ValueError if the OVA is corrupted
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+    """
+    key = identity(ova_path)
+    meta = _CACHE.get(key)
+    if meta is None:
+        cache_file = os.path.join(const.VLAB_INSIGHTIQ_CACHE_DIR, 'ova',
+                                  hashlib.sha1(ujson.dumps(key).encode()).hexdigest() + '.json')
+        with FileLock(cache_file + '.lock'):
+            meta = _load(cache_file)
+            if meta is None:
+                meta = _scan(ova_path)
+                _save(cache_file, meta)
+        _CACHE[key] = meta
+    return meta
+
+
+def identity(ova_path):
+    """Uniquely identify a specific version of a file
+
+    :Returns: Tuple
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+    """
+    stats = os.stat(ova_path)
+    return (os.path.abspath(ova_path), stats.st_ino, stats.st_size, stats.st_mtime_ns)
+
+
+def _scan(ova_path):
+    """Read and verify the contents of an OVA
+
+    :Returns: ImageMeta
+
+    :Raises: ValueError if the OVA is corrupted
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+    """
+    ovf = None
+    manifest = ''
+    members = {}
+    image_name = os.path.basename(ova_path)
+    try:
+        with tarfile.open(ova_path) as tar:
+            for member in tar:
+                members[member.name] = member
+                if member.name.endswith('.ovf'):
+                    ovf = tar.extractfile(member).read().decode()
+                elif member.name.endswith('.mf'):
+                    manifest = tar.extractfile(member).read().decode()
+            if ovf is None:
+                raise ValueError('Image {} contains no OVF'.format(image_name))
+            _verify(tar, members, manifest, image_name)
+    except (tarfile.TarError, EOFError) as doh:
+        raise ValueError('Image {} is corrupted: {}'.format(image_name, doh))
+    disks = {x: (y.offset_data, y.size) for x, y in members.items() if x.endswith('.vmdk')}
+    return ImageMeta(ovf=ovf, networks=_networks(ovf), disks=disks)
+
+
+def _verify(tar, members, manifest, image_name):
+    """Compare the checksums in the OVA manifest to the files in the OVA
+
+    :Returns: None
+
+    :Raises: ValueError if a file does not match the manifest
+
+    :param tar: The opened OVA
+    :type tar: tarfile.TarFile
+
+    :param members: Maps file names in the OVA to their TarInfo
+    :type members: Dictionary
+
+    :param manifest: The contents of the OVA's manifest file
+    :type manifest: String
+
+    :param image_name: The file name of the OVA; for error messages
+    :type image_name: String
+    """
+    for line in manifest.splitlines():
+        match = MANIFEST_LINE.match(line.strip())
+        if not match:
+            continue
+        member = members.get(match.group('name'))
+        if member is None:
+            raise ValueError('Image {} is missing {}'.format(image_name, match.group('name')))
+        digest = hashlib.new(match.group('algorithm').lower())
+        the_file = tar.extractfile(member)
+        chunk = the_file.read(READ_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = the_file.read(READ_SIZE)
+        if digest.hexdigest() != match.group('digest').lower():
+            raise ValueError('Image {} is corrupted: bad checksum for {}'.format(image_name, member.name))
+
+
+def _networks(ovf):
+    """Obtain the names of the networks defined in the OVF; same logic as ``Ova.networks``
+
+    :Returns: List
+
+    :param ovf: The OVF descriptor
+    :type ovf: String
+    """
+    ntwks = re.findall(r'Network ovf:name=[\w\ \"]{1,50}', ovf)
+    return [x.split('=')[1].replace('"', '') for x in ntwks]
+
+
+def _load(cache_file):
+    """Read the saved contents of an OVA; None if it's not been saved before"""
+    try:
+        with open(cache_file) as the_file:
+            data = ujson.load(the_file)
+    except (OSError, ValueError):
+        return None
+    data['disks'] = {x: tuple(y) for x, y in data['disks'].items()}
+    return ImageMeta(**data)
+
+
+def _save(cache_file, meta):
+    """Atomically save the parsed contents of an OVA"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+    with os.fdopen(fd, 'w') as the_file:
+        ujson.dump(meta._asdict(), the_file)
+    os.replace(tmp_path, cache_file)
+
+
+class CachedOva(Ova):
+    """An ``Ova`` built from already-parsed contents, instead of by scanning the tarball.
+    Deploying it uploads the disks with ``upload.upload_disks``.
+
+    :param ovafile: The file path to the OVA
+    :type ovafile: String
+
+    :param meta: The parsed contents of the OVA
+    :type meta: ImageMeta
+    """
+    def __init__(self, ovafile, meta):
+        self._spec = None
+        self._lease = None
+        self._host = None
+        self._handle = FileHandle(ovafile)
+        self._tar = None
+        self._ovf = meta.ovf
+        self._prog = None
+        self._networks = meta.networks
+        self._disks = {x: TarMember(self._handle, offset, size, on_read=self._uploaded) for x, (offset, size) in meta.disks.items()}
+        self._total = sum(size for _, size in meta.disks.values())
+        self._percent = None
+        # Set to a function that takes an integer percent to be told how much
+        # of the disks have been uploaded while deploying the OVA
+        self.on_progress = None
+        # The UploadStats of every disk, after a deploy
+        self.upload_stats = []
+
+    def deploy(self, deploy_spec, lease, host):
+        """Create a new VM based off the OVA, uploading its disks in parallel
+
+        :param deploy_spec: **Required** The OVA deployment spec
+        :type deploy_spec: vim.OvfManager.CreateImportSpecResult
+
+        :param lease: **Required** The vSphere lease that enables VM/vApp creation
+        :type lease: vim.HttpNfcLease
+
+        :param host: **Required** The FQDN for vSphere
+        :type host: String
+        """
+        try:
+            with upload.LeaseProgress(lease, self._done_percent):
+                self.upload_stats = upload.upload_disks(lease, deploy_spec.fileItem, self._disks, host,
+                                                        parallel=const.VLAB_INSIGHTIQ_UPLOAD_PARALLEL,
+                                                        chunk_size=const.VLAB_INSIGHTIQ_UPLOAD_CHUNK,
+                                                        read_ahead=const.VLAB_INSIGHTIQ_UPLOAD_READ_AHEAD)
+            lease.Progress(100)
+            lease.Complete()
+        except vmodl.MethodFault as doh:
+            lease.Abort(doh)
+            raise
+        except Exception as doh:
+            lease.Abort(vmodl.fault.SystemError(reason=str(doh)))
+            raise
+        finally:
+            for disk in self._disks.values():
+                disk.seek(0, 0)
+
+    @property
+    def networks(self):
+        """Return a list of network names that a VM has configured"""
+        return list(self._networks)
+
+    @property
+    def size(self):
+        """How many bytes of disks the OVA has"""
+        return self._total
+
+    def _uploaded(self):
+        """Called every time a disk is read; calls ``on_progress`` when the percent changes"""
+        if self.on_progress is None or not self._total:
+            return
+        percent = self._done_percent()
+        if percent != self._percent:
+            self._percent = percent
+            self.on_progress(percent)
+
+    def _done_percent(self):
+        """How much of the disks have been read, as an integer percent"""
+        if not self._total:
+            return 100
+        return int(100 * sum(x.tell() for x in self._disks.values()) / self._total)
+
+
+class TarMember(object):
+    """A read-only file object for one file in a tarball.
+
+    Reads go straight to the file's offset within the tarball, with ``pread``,
+    so several members of the same tarball can be read at once.
+
+    :param handle: The opened tarball
+    :type handle: vlab_inf_common.vmware.ova.FileHandle
+
+    :param offset: Where the file's data starts within the tarball
+    :type offset: Integer
+
+    :param size: How many bytes the file is
+    :type size: Integer
+
+    :param on_read: Optional - Called (with no arguments) after every read
+    :type on_read: Function
+    """
+    def __init__(self, handle, offset, size, on_read=None):
+        self._handle = handle
+        self._offset = offset
+        self._pos = 0
+        self._on_read = on_read
+        self.size = size
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            self._pos = self.size + offset
+        self._pos = max(0, min(self._pos, self.size))
+        return self._pos
+
+    def read(self, amount=-1):
+        remaining = self.size - self._pos
+        if amount is None or amount < 0 or amount > remaining:
+            amount = remaining
+        if amount <= 0:
+            return b''
+        data = os.pread(self._handle.fh.fileno(), amount, self._offset + self._pos)
+        self._pos += len(data)
+        if self._on_read is not None:
+            self._on_read()
+        return data
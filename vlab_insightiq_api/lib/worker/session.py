@@ -0,0 +1,162 @@
+# -*- coding: UTF-8 -*-
+"""
+Keeps authenticated vCenter sessions alive across Celery tasks.
+
+Logging into vCenter (and pulling the service content) is a large share of the
+time it takes to run a short task like ``insightiq.show``. Instead of logging in
+and out for every task, each worker process checks out a session from this pool,
+and returns it when the task is done.
+
+An idle session can expire between being checked and being used. Work that is
+safe to repeat goes through ``SessionPool.run``, which logs in again and runs it
+once more when that happens.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from pyVmomi import vim, vmodl
+
+
+# The errors that mean the session is no good anymore
+DEAD_SESSION = (vim.fault.NotAuthenticated, ConnectionError)
+
+
+class SessionPool(object):
+    """A per-process pool of logged in vCenter connections.
+
+    :param factory: A callable that logs into vCenter, and returns the new vCenter object
+    :type factory: Function
+
+    :param size: The max number of idle sessions to hold onto
+    :type size: Integer
+
+    :param keepalive: How many seconds a session can sit idle before it's checked
+                      for being expired.
+    :type keepalive: Integer
+    """
+    def __init__(self, factory, size=2, keepalive=60):
+        self._factory = factory
+        self._size = size
+        self._keepalive = keepalive
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    @contextmanager
+    def session(self, fresh=False):
+        """Check out a logged in vCenter object for the duration of the ``with`` block.
+
+        Sessions that hit an authentication error are discarded instead of being
+        returned to the pool.
+
+        :Returns: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param fresh: Set to True to log in, instead of using an idle session
+        :type fresh: Boolean
+        """
+        vcenter = self._factory() if fresh else self._checkout()
+        try:
+            yield vcenter
+        except DEAD_SESSION:
+            self._discard(vcenter)
+            raise
+        except Exception:
+            self._checkin(vcenter)
+            raise
+        else:
+            self._checkin(vcenter)
+
+    def run(self, func, *args, **kwargs):
+        """Call a function with a logged in vCenter object as its first argument.
+        If the session turns out to have expired, log in and call it once more;
+        so only use this for work that's safe to repeat, like lookups.
+
+        :Returns: Whatever the function returns
+
+        :param func: The function to call
+        :type func: Function
+        """
+        try:
+            with self.session() as vcenter:
+                return func(vcenter, *args, **kwargs)
+        except DEAD_SESSION:
+            # Any other idle session is probably just as stale
+            with self.session(fresh=True) as vcenter:
+                return func(vcenter, *args, **kwargs)
+
+    def clear(self):
+        """Log out of, and forget about, every idle session.
+
+        :Returns: None
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for vcenter, _ in idle:
+            self._discard(vcenter)
+
+    def _checkout(self):
+        """Obtain an idle session, or log in if there are no usable ones
+
+        :Returns: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        vcenter = None
+        while vcenter is None:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Celery forked us; the parent's sockets are not ours to use or close
+                    self._idle = []
+                    self._pid = os.getpid()
+                if not self._idle:
+                    break
+                vcenter, last_used = self._idle.pop()
+            if time.time() - last_used > self._keepalive and not self._alive(vcenter):
+                self._discard(vcenter)
+                vcenter = None
+        if vcenter is None:
+            vcenter = self._factory()
+        return vcenter
+
+    def _checkin(self, vcenter):
+        """Return a session to the pool, or log out if the pool is full
+
+        :Returns: None
+
+        :param vcenter: The session to return
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self._size:
+                self._idle.append((vcenter, time.time()))
+                return
+        self._discard(vcenter)
+
+    @staticmethod
+    def _alive(vcenter):
+        """Cheaply test if the vCenter session has expired
+
+        :Returns: Boolean
+
+        :param vcenter: The session to check
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        try:
+            return vcenter.content.sessionManager.currentSession is not None
+        except (vmodl.MethodFault, ConnectionError, OSError):
+            return False
+
+    @staticmethod
+    def _discard(vcenter):
+        """Log out of vCenter, ignoring errors from sessions that are already dead
+
+        :Returns: None
+
+        :param vcenter: The session to terminate
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        try:
+            vcenter.close()
+        except Exception:
+            pass
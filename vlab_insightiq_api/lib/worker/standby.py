@@ -0,0 +1,190 @@
+# -*- coding: UTF-8 -*-
+"""
+A pool of powered on, unassigned InsightIQ VMs, kept per version in a holding folder.
+
+Even a linked clone has to boot and get an IP before a deploy is done. For the
+versions listed in ``VLAB_INSIGHTIQ_STANDBY_VERSIONS``, workers keep
+``VLAB_INSIGHTIQ_STANDBY_SIZE`` instances booted in the
+``VLAB_INSIGHTIQ_STANDBY_FOLDER`` folder, connected to
+``VLAB_INSIGHTIQ_STANDBY_NETWORK``. Creating one of those versions claims a
+standby VM instead: it's moved into the user's folder, renamed, and connected to
+the user's network (the appliance renews its DHCP lease when the link changes).
+
+Workers on different hosts claim from the same pool, so a claim is made atomic
+in vCenter instead of with a file lock: the VM is first renamed to a unique claim
+name with a reconfigure that only succeeds if no one else changed the VM since
+it was looked up (its ``changeVersion``). A task that loses that race moves on
+to the next standby VM. A renamed VM no longer matches the standby names, so
+no other task will try to claim it.
+"""
+import os
+import re
+import uuid
+
+from vlab_inf_common.vmware import vim, consume_task
+
+from vlab_insightiq_api.lib import const
+from vlab_insightiq_api.lib.worker import inventory
+from vlab_insightiq_api.lib.worker.cache import FileLock
+from vlab_insightiq_api.lib.worker.templates import HOSTNAME_REGEX
+
+
+NAME_PREFIX = 'insightiq-standby'
+
+
+def versions():
+    """The versions of InsightIQ to keep standby VMs of
+
+    :Returns: List
+    """
+    if const.VLAB_INSIGHTIQ_STANDBY_SIZE <= 0:
+        return []
+    return [x.strip() for x in const.VLAB_INSIGHTIQ_STANDBY_VERSIONS.split(',') if x.strip()]
+
+
+def enabled(version):
+    """Check if standby VMs are kept for a version of InsightIQ
+
+    :Returns: Boolean
+
+    :param version: The version of InsightIQ
+    :type version: String
+    """
+    return version in versions()
+
+
+def standby_name(version):
+    """Make a unique name for a new standby VM
+
+    :Returns: String
+
+    :param version: The version of InsightIQ
+    :type version: String
+    """
+    return '{}-{}-{}'.format(NAME_PREFIX, version, uuid.uuid4().hex[:8])
+
+
+def folder(vcenter):
+    """Obtain the holding folder of standby VMs, making it if needed
+
+    :Returns: vim.Folder
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    try:
+        return inventory.find_folder(vcenter, const.VLAB_INSIGHTIQ_STANDBY_FOLDER)
+    except ValueError:
+        path = '{}/{}'.format(const.INF_VCENTER_TOP_LVL_DIR, const.VLAB_INSIGHTIQ_STANDBY_FOLDER)
+        vcenter.create_vm_folder(path)
+        return inventory.find_folder(vcenter, const.VLAB_INSIGHTIQ_STANDBY_FOLDER)
+
+
+def find_standby(vcenter, holding_folder, version):
+    """Find the standby VMs of a version, including ones still being built
+
+    :Returns: Dictionary mapping the VM name to a tuple of (vim.VirtualMachine, power state)
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param holding_folder: The folder the standby VMs are kept in
+    :type holding_folder: vim.Folder
+
+    :param version: The version of InsightIQ
+    :type version: String
+    """
+    prefix = '{}-{}-'.format(NAME_PREFIX, version)
+    found = inventory.insightiq_objects(vcenter, holding_folder)
+    return {x: y for x, y in found.items() if x.startswith(prefix)}
+
+
+def claim(vcenter, version, username, machine_name, logger):
+    """Take a standby VM out of the pool, and give it to a user
+
+    :Returns: vim.VirtualMachine, or None if there are no standby VMs of the version
+
+    :Raises: ValueError if the machine name is not valid
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param version: The version of InsightIQ
+    :type version: String
+
+    :param username: The user who gets the VM
+    :type username: String
+
+    :param machine_name: The new name of the VM
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    if not re.match(HOSTNAME_REGEX, machine_name):
+        error = 'Invalid machine name. Names can only contain characters a-z, A-Z, 0-9, periods (".") and dashes ("-"). Supplied: {}'.format(machine_name)
+        raise ValueError(error)
+    holding_folder = folder(vcenter)
+    user_folder = inventory.find_folder(vcenter, username)
+    found = find_standby(vcenter, holding_folder, version)
+    powered_on = sorted(x for x, y in found.items() if y[1] == vim.VirtualMachinePowerState.poweredOn)
+    for name in powered_on:
+        the_vm = found[name][0]
+        if not _booted(the_vm) or not _take(the_vm, holding_folder):
+            continue
+        logger.debug('Claimed standby VM {}'.format(name))
+        try:
+            consume_task(user_folder.MoveIntoFolder_Task([the_vm]))
+        except RuntimeError:
+            # Put it back in the pool, instead of leaving it stranded under the claim name
+            consume_task(the_vm.Rename_Task(standby_name(version)))
+            raise
+        consume_task(the_vm.Rename_Task(machine_name))
+        return the_vm
+    return None
+
+
+def refill_lock(version):
+    """Allow only one task per host to add standby VMs of a version at a time.
+    Every deploy sends a refill, so the lock doesn't wait; check ``held`` to
+    see if another task is already refilling.
+
+    :Returns: vlab_insightiq_api.lib.worker.cache.FileLock
+
+    :param version: The version of InsightIQ
+    :type version: String
+    """
+    return FileLock(_lock_file('refill', version), blocking=False)
+
+
+def _take(the_vm, holding_folder):
+    """Atomically rename a standby VM to a unique claim name
+
+    :Returns: Boolean - False if another task claimed the VM first
+
+    :param the_vm: The standby VM
+    :type the_vm: vim.VirtualMachine
+
+    :param holding_folder: The folder the standby VMs are kept in
+    :type holding_folder: vim.Folder
+    """
+    claim_name = '{}-claim-{}'.format(NAME_PREFIX, uuid.uuid4().hex)
+    spec = vim.vm.ConfigSpec()
+    spec.name = claim_name
+    # vCenter rejects the change if the VM changed since this version was read
+    spec.changeVersion = the_vm.config.changeVersion
+    try:
+        consume_task(the_vm.ReconfigVM_Task(spec))
+    except RuntimeError:
+        return False
+    return the_vm.name == claim_name and the_vm.parent == holding_folder
+
+
+def _booted(the_vm):
+    """Check if a standby VM is done booting; a VM that's still booting has no IP yet"""
+    return bool(the_vm.guest.ipAddress)
+
+
+def _lock_file(action, version):
+    """The path to the lock file for an action on the standby VMs of a version"""
+    return os.path.join(const.VLAB_INSIGHTIQ_CACHE_DIR, 'standby', '{}-{}.lock'.format(action, version))
@@ -2,19 +2,111 @@
 """
 Entry point logic for available backend worker tasks
 """
-from celery import Celery
+import os.path
+import time
+from functools import partial
+
+from celery import Celery, signals, states
+from celery.exceptions import Ignore
+from celery.backends.rpc import RPCBackend
 from vlab_api_common import get_task_logger
 
-from vlab_insightiq_api.lib import const
-from vlab_insightiq_api.lib.worker import vmware
+from vlab_insightiq_api.lib import const, metrics, queues, results
+from vlab_insightiq_api.lib.worker import standby, vmware
+from vlab_insightiq_api.lib.worker.admission import Admission
+from vlab_insightiq_api.lib.worker.cache import ResultCache
+
+app = Celery('insightiq', backend=results.backend_name(), broker=const.VLAB_MESSAGE_BROKER)
+app.conf.result_expires = const.VLAB_INSIGHTIQ_RESULT_TTL
+queues.configure(app)
+metrics.instrument_celery()
+show_cache = ResultCache(os.path.join(const.VLAB_INSIGHTIQ_CACHE_DIR, 'show'),
+                         ttl=const.VLAB_INSIGHTIQ_SHOW_CACHE_TTL)
+# The whole inventory is one entry; every page of a listing is cut from the same copy
+inventory_cache = ResultCache(os.path.join(const.VLAB_INSIGHTIQ_CACHE_DIR, 'inventory'),
+                              ttl=const.VLAB_INSIGHTIQ_INVENTORY_CACHE_TTL)
+admission = Admission(const.VLAB_INSIGHTIQ_ADMISSION_DIR,
+                      max_deploys=const.VLAB_INSIGHTIQ_MAX_DEPLOYS,
+                      max_user_deploys=const.VLAB_INSIGHTIQ_MAX_USER_DEPLOYS,
+                      interval=const.VLAB_INSIGHTIQ_ADMISSION_INTERVAL,
+                      running_timeout=const.VLAB_INSIGHTIQ_ADMISSION_TIMEOUT)
+
+
+def _wait_for_slot(task, username, logger):
+    """Stop the task if it's not its turn to deploy yet.
+
+    Instead of blocking a worker while it waits, the task goes back on the
+    queue and checks again in ``VLAB_INSIGHTIQ_ADMISSION_INTERVAL`` seconds.
+    In the meantime, its state is ``QUEUED`` and its meta data has its place
+    in line.
+
+    :Returns: None
+
+    :Raises: celery.exceptions.Ignore if the task was put back on the queue
+
+    :param task: The running task
+    :type task: celery.Task
+
+    :param username: The user who wants the deploy
+    :type username: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    admitted, position = admission.admit(task.request.id, username)
+    if admitted:
+        return
+    logger.info('Waiting for a deploy slot; number {} in line'.format(position))
+    task.update_state(state='QUEUED', meta={'position': position})
+    _resend(task, admission.interval)
+
+
+def _resend(task, countdown, **kwargs):
+    """Put the running task back on the queue, to run again in ``countdown`` seconds.
+
+    Like Task.retry, the options of the original request (reply_to, queue,
+    priority, etc) are kept, so the result still finds its way back to the
+    caller. Task.retry itself would record the state as RETRY, and lose the
+    meta data the task last reported (like its place in line).
+
+    :Returns: None
+
+    :Raises: celery.exceptions.Ignore, so no result is recorded; the task isn't done
+
+    :param task: The running task
+    :type task: celery.Task
+
+    :param countdown: How many seconds to wait before running the task again
+    :type countdown: Integer
+
+    :param kwargs: Keyword arguments to add to (or change in) the next run
+    :type kwargs: Dictionary
+    """
+    the_kwargs = dict(task.request.kwargs or {}, **kwargs)
+    task.signature_from_request(kwargs=the_kwargs, countdown=countdown).apply_async()
+    raise Ignore()
 
-app = Celery('insightiq', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+
+def _shared_results():
+    """Check if this worker can read the results of tasks that other processes
+    sent. An rpc:// result can only be read once, by the process that sent the task.
+
+    :Returns: Boolean
+    """
+    return not isinstance(app.backend, RPCBackend)
 
 
 @app.task(name='insightiq.show', bind=True)
 def show(self, username, txn_id):
     """Obtain basic information about the InsightIQ instances a user owns.
 
+    When the inventory mirror is on, and has caught up with the last change
+    the user made, the answer comes from the mirror instead of vCenter.
+
+    An answer from the cache has no console URLs (``console`` is None). The
+    clone ticket in a console URL is single use, so it can't be cached, and
+    making new ones would cost a call to vCenter per VM.
+
     :Returns: Dictionary
 
     :param username: The name of the user who wants info about their default gateway
@@ -26,21 +118,51 @@ def show(self, username, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+    started = time.time()
+    info = show_cache.get(username)
+    if info is not None:
+        logger.info('Task complete (cached)')
+        resp['content'] = info
+        return resp
     try:
-        info = vmware.show_insightiq(username)
+        found = vmware.mirrored_insightiq(username, since=show_cache.changed(username))
+        if found is None:
+            info = vmware.show_insightiq(username)
+        else:
+            logger.debug('Answered from inventory mirror version {}'.format(found.version))
+            info, started = found.data, found.as_of
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
         resp['content'] = info
+        show_cache.set(username, _without_consoles(info), started)
     return resp
 
 
+def _without_consoles(vms):
+    """Copy the output of ``show``, minus the console URLs, so they aren't cached
+
+    :Returns: Dictionary
+
+    :param vms: Maps the VM name to its info
+    :type vms: Dictionary
+    """
+    return {x: dict(y, console=None) for x, y in vms.items()}
+
+
 @app.task(name='insightiq.create', bind=True)
 def create(self, username, machine_name, image, network, txn_id):
     """Deploy a new shinny instance of InsightIQ
 
+    While InsightIQ is being deployed, the task is in the ``PROGRESS`` state,
+    and its meta data has the current phase of the deploy. When too many deploys
+    are already running, the task is in the ``QUEUED`` state until it's its turn.
+
+    With ``VLAB_INSIGHTIQ_IP_AT_POWER_ON`` set, the task is done once the VM is
+    powered on, and ``insightiq.fill_ip`` adds the IP to its result later.
+
     :Returns: Dictionary
 
     :param username: The name of the user who wants to create a new default gateway
@@ -61,19 +183,120 @@ def create(self, username, machine_name, image, network, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+
+    def progress(phase, percent=None):
+        self.update_state(state='PROGRESS', meta={'phase': phase, 'percent': percent})
+
+    _wait_for_slot(self, username, logger)
     try:
-        resp['content'] = vmware.create_insightiq(username, machine_name, image, network, logger)
+        resp['content'] = vmware.create_insightiq(username, machine_name, image, network, logger, progress=progress,
+                                                  written=partial(admission.release, self.request.id))
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    finally:
+        admission.release(self.request.id)
+        show_cache.invalidate(username)
+    if const.VLAB_INSIGHTIQ_IP_AT_POWER_ON and resp['error'] is None:
+        fill_ip.delay(username, machine_name, self.request.id, txn_id)
+    if standby.enabled(image):
+        # Replace the standby VM this deploy (probably) used
+        standby_refill.delay(image, txn_id)
     logger.info('Task complete')
     return resp
 
 
+@app.task(name='insightiq.create_batch', bind=True)
+def create_batch(self, username, machine_names, image, network, txn_id, children=None):
+    """Deploy several instances of InsightIQ at once
+
+    Every instance is deployed by its own ``insightiq.create`` task, so each one
+    waits in line for its own deploy slot, and gets the whole time limit of the
+    worker. This task only sends them, then goes back on the queue to check on
+    them every ``VLAB_INSIGHTIQ_TASK_POLL_INTERVAL`` seconds. Until they're all
+    done, the task is in the ``PROGRESS`` state, and its meta data has the
+    instances that have finished so far.
+
+    Checking on the other tasks needs a result backend that every worker can
+    read (like ``VLAB_INSIGHTIQ_RESULT_BACKEND=file``), not ``rpc://``.
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants the new InsightIQ instances
+    :type username: String
+
+    :param machine_names: The names to give the new IIQ instances
+    :type machine_names: List
+
+    :param image: The version/image of IIQ to create
+    :type image: String
+
+    :param network: The network to connect IIQ to
+    :type network: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+
+    :param children: Maps each instance to the id of the task deploying it. Only set by the checks.
+    :type children: Dictionary
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    if children is None:
+        logger.info('Task starting')
+        if not _shared_results():
+            resp['error'] = 'Batch deploys need a result backend every worker can read, not {}'.format(const.VLAB_INSIGHTIQ_RESULT_BACKEND)
+            logger.error('Task failed: {}'.format(resp['error']))
+            return resp
+        children = {x: create.delay(username, x, image, network, txn_id).id for x in machine_names}
+    created, failed, running = _batch_results(children)
+    if running:
+        logger.debug('Waiting on {} of {} instances'.format(len(running), len(children)))
+        self.update_state(state='PROGRESS', meta={'created': created, 'failed': failed})
+        _resend(self, const.VLAB_INSIGHTIQ_TASK_POLL_INTERVAL, children=children)
+    resp['content'] = {'created': created, 'failed': failed}
+    if failed:
+        resp['error'] = 'Failed to create {} of {} instances'.format(len(failed), len(children))
+    logger.info('Task complete')
+    return resp
+
+
+def _batch_results(children):
+    """Collect the results of the ``insightiq.create`` tasks of a batch deploy
+
+    :Returns: Tuple (Dictionary, Dictionary, List) of the created instances, the
+              error of each instance that could not be created, and the
+              instances that are still being deployed
+
+    :param children: Maps each instance to the id of the task deploying it
+    :type children: Dictionary
+    """
+    created = {}
+    failed = {}
+    running = []
+    for machine_name, task_id in sorted(children.items()):
+        result = app.AsyncResult(task_id)
+        if result.state == states.SUCCESS:
+            if result.result['error']:
+                failed[machine_name] = result.result['error']
+            else:
+                created.update(result.result['content'])
+        elif result.state in states.READY_STATES:
+            # Killed by the time limit, revoked, etc
+            failed[machine_name] = '{}'.format(result.result)
+        else:
+            running.append(machine_name)
+    return created, failed, running
+
+
 @app.task(name='insightiq.delete', bind=True)
-def delete(self, username, machine_name, txn_id):
+def delete(self, username, machine_name, txn_id, vcenter_task=None):
     """Destroy an instance of InsightIQ
 
+    When ``VLAB_INSIGHTIQ_ASYNC_DELETE`` is set, the task does not block while
+    vCenter destroys the VM. Instead, it retries itself until the vCenter task
+    is done, which frees up the worker between checks.
+
     :Returns: Dictionary
 
     :param username: The name of the user who wants to create a new default gateway
@@ -84,17 +307,62 @@ def delete(self, username, machine_name, txn_id):
 
     :param txn_id: A unique string supplied by the client to track the call through logs
     :type txn_id: String
+
+    :param vcenter_task: The moId of the vCenter task destroying the VM. Only set by retries.
+    :type vcenter_task: String
     """
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
     try:
-        vmware.delete_insightiq(username, machine_name, logger)
-    except ValueError as doh:
+        if vcenter_task is None:
+            wait = not const.VLAB_INSIGHTIQ_ASYNC_DELETE
+            vcenter_task = vmware.delete_insightiq(username, machine_name, logger, wait=wait)
+        if vcenter_task is not None and not vmware.destroy_done(vcenter_task, username, machine_name):
+            logger.debug('vCenter task {} still running'.format(vcenter_task))
+            raise self.retry(kwargs={'vcenter_task': vcenter_task},
+                             countdown=const.VLAB_INSIGHTIQ_TASK_POLL_INTERVAL,
+                             max_retries=None)
+    except (ValueError, RuntimeError) as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
+    finally:
+        show_cache.invalidate(username)
+    return resp
+
+
+@app.task(name='insightiq.delete_batch', bind=True)
+def delete_batch(self, username, machine_names, txn_id):
+    """Destroy several instances of InsightIQ at once
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the InsightIQ instances
+    :type username: String
+
+    :param machine_names: The instances to destroy. None means all of the user's instances.
+    :type machine_names: List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        deleted, failed = vmware.delete_insightiqs(username, machine_names, logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        resp['content'] = {'deleted': deleted, 'failed': failed}
+        if failed:
+            resp['error'] = 'Failed to delete {} of {} instances'.format(len(failed), len(deleted) + len(failed))
+    finally:
+        show_cache.invalidate(username)
+    logger.info('Task complete')
     return resp
 
 
@@ -118,6 +386,80 @@ def image(self, txn_id):
     return resp
 
 
+@app.task(name='insightiq.inventory', bind=True)
+def inventory(self, page, per_page, txn_id):
+    """List the InsightIQ instances of every user, grouped by owner and version.
+
+    The whole inventory is read from vCenter at once (or from the inventory
+    mirror, when it's on), and cached for ``VLAB_INSIGHTIQ_INVENTORY_CACHE_TTL``
+    seconds, so reading the other pages of a listing doesn't read the inventory
+    again.
+
+    :Returns: Dictionary
+
+    :param page: Which page of owners to return, starting at 1
+    :type page: Integer
+
+    :param per_page: How many owners are on a page
+    :type per_page: Integer
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    started = time.time()
+    found = inventory_cache.get('all')
+    if found is None:
+        mirrored = vmware.mirrored_inventory(since=started - const.VLAB_INSIGHTIQ_INVENTORY_CACHE_TTL)
+        if mirrored is not None:
+            logger.debug('Answered from inventory mirror version {}'.format(mirrored.version))
+            owners, started = mirrored.data, mirrored.as_of
+        else:
+            try:
+                owners = vmware.inventory_insightiq()
+            except ValueError as doh:
+                logger.error('Task failed: {}'.format(doh))
+                resp['error'] = '{}'.format(doh)
+                return resp
+        found = {'owners': owners, 'generated': started}
+        inventory_cache.set('all', found, started)
+    resp['content'] = _page(found['owners'], page, per_page)
+    resp['content']['generated'] = found['generated']
+    logger.info('Task complete')
+    return resp
+
+
+def _page(owners, page, per_page):
+    """Cut one page of owners out of the inventory, along with totals for all of it
+
+    :Returns: Dictionary
+
+    :param owners: Maps an owner to their InsightIQ instances, grouped by version
+    :type owners: Dictionary
+
+    :param page: Which page of owners to return, starting at 1
+    :type page: Integer
+
+    :param per_page: How many owners are on a page
+    :type per_page: Integer
+    """
+    versions = {}
+    for by_version in owners.values():
+        for version, vms in by_version.items():
+            versions[version] = versions.get(version, 0) + len(vms)
+    names = sorted(owners.keys())
+    start = (page - 1) * per_page
+    return {'owners': {x: owners[x] for x in names[start:start + per_page]},
+            'page': page,
+            'per_page': per_page,
+            'pages': (len(names) + per_page - 1) // per_page,
+            'total_owners': len(names),
+            'total_vms': sum(versions.values()),
+            'versions': versions}
+
+
 @app.task(name='insightiq.modify_network', bind=True)
 def modify_network(self, username, machine_name, new_network, txn_id):
     """Change the network an InsightIQ instance is connected to"""
@@ -129,5 +471,98 @@ def modify_network(self, username, machine_name, new_network, txn_id):
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    finally:
+        show_cache.invalidate(username)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='insightiq.fill_ip', bind=True)
+def fill_ip(self, username, machine_name, create_task_id, txn_id):
+    """Wait for a new InsightIQ instance to get an IP, then add it to the result
+    of the ``insightiq.create`` task that deployed it.
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the InsightIQ instance
+    :type username: String
+
+    :param machine_name: The name of the InsightIQ instance
+    :type machine_name: String
+
+    :param create_task_id: The id of the task that deployed the instance. None to skip updating its result.
+    :type create_task_id: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        info = vmware.wait_for_ip(username, machine_name)
+    except (ValueError, RuntimeError) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        resp['content'] = info
+        if create_task_id is not None and _shared_results():
+            created = app.AsyncResult(create_task_id)
+            if created.state != 'SUCCESS':
+                logger.debug('Task {} has not saved its result yet'.format(create_task_id))
+                raise self.retry(countdown=const.VLAB_INSIGHTIQ_TASK_POLL_INTERVAL, max_retries=10)
+            result = created.result
+            result['content'].update(info)
+            app.backend.store_result(create_task_id, result, 'SUCCESS')
+    finally:
+        show_cache.invalidate(username)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='insightiq.standby_refill', bind=True)
+def standby_refill(self, image, txn_id):
+    """Deploy standby VMs of a version of InsightIQ, so there's a full pool of
+    them for ``create`` to claim.
+
+    Each task deploys one standby VM, then sends another refill task for the
+    next one, so filling the pool never runs into the time limit of a task.
+
+    :Returns: Dictionary
+
+    :param image: The version/image of IIQ to keep standby VMs of
+    :type image: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_INSIGHTIQ_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    _wait_for_slot(self, const.VLAB_INSIGHTIQ_STANDBY_FOLDER, logger)
+    try:
+        resp['content'] = {'created': vmware.refill_standby(image, logger, written=partial(admission.release, self.request.id))}
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    finally:
+        admission.release(self.request.id)
+    if resp['content'].get('created'):
+        # The next task stops once the pool is full
+        standby_refill.delay(image, txn_id)
     logger.info('Task complete')
     return resp
+
+
+@signals.worker_process_init.connect(weak=False)
+def _start_mirror(sender=None, **kwargs):
+    """Load the inventory mirror as soon as a pool process starts, instead of on its first task"""
+    if const.VLAB_INSIGHTIQ_MIRROR:
+        vmware.MIRROR.start()
+
+
+@signals.worker_ready.connect(weak=False)
+def _fill_standby(sender=None, **kwargs):
+    """Fill the pools of standby VMs when a worker starts"""
+    for version in standby.versions():
+        standby_refill.delay(version, 'worker-ready')
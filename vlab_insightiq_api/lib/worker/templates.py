@@ -0,0 +1,193 @@
+# -*- coding: UTF-8 -*-
+"""
+Deploy InsightIQ as linked clones of a per-version template.
+
+Streaming a multi-GB OVA to the datastore takes minutes. Instead, the first
+deploy of a version imports the OVA once, takes a snapshot of it, and marks it
+as a template. Every deploy after that is a linked clone of that snapshot, which
+only has to create a small delta disk.
+
+Templates are named after the version *and* the identity of the OVA file, so
+replacing an OVA causes a new template to be built on the next deploy.
+"""
+import os
+import re
+import hashlib
+
+from vlab_inf_common.vmware import vim, virtual_machine, consume_task
+
+from vlab_insightiq_api.lib import const
+from vlab_insightiq_api.lib.worker import inventory
+from vlab_insightiq_api.lib.worker.cache import FileLock
+
+
+HOSTNAME_REGEX = r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+SNAPSHOT_NAME = 'base'
+
+
+def linked_clone(vcenter, ova, ova_path, version, network_map, username, machine_name, logger):
+    """Create a new InsightIQ instance as a linked clone of the template for the
+    supplied version, building the template first if needed.
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA of the version of InsightIQ to deploy
+    :type ova: vlab_inf_common.vmware.ova.Ova
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+
+    :param version: The version of InsightIQ to deploy
+    :type version: String
+
+    :param network_map: Which network to connect the new VM to
+    :type network_map: vim.OvfManager.NetworkMapping
+
+    :param username: The name of the user who wants a new InsightIQ instance
+    :type username: String
+
+    :param machine_name: The name to give the new InsightIQ instance
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    if not re.match(HOSTNAME_REGEX, machine_name):
+        error = 'Invalid machine name. Names can only contain characters a-z, A-Z, 0-9, periods (".") and dashes ("-"). Supplied: {}'.format(machine_name)
+        raise ValueError(error)
+    template = get_template(vcenter, ova, ova_path, version, network_map, username, logger)
+    folder = inventory.find_folder(vcenter, username)
+    resource_pool = vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL]
+    relocate_spec = vim.vm.RelocateSpec(pool=resource_pool, diskMoveType='createNewChildDiskBacking')
+    clone_spec = vim.vm.CloneSpec(location=relocate_spec,
+                                  snapshot=template.snapshot.currentSnapshot,
+                                  powerOn=False,
+                                  template=False)
+    logger.debug('Creating linked clone of {}'.format(template.name))
+    the_vm = consume_task(template.CloneVM_Task(folder=folder, name=machine_name, spec=clone_spec))
+    # The template is connected to whatever network the first deploy used
+    virtual_machine.change_network(the_vm, network_map.network)
+    logger.debug("Powering on {}'s new VM {}".format(username, machine_name))
+    virtual_machine.power(the_vm, state='on')
+    return the_vm
+
+
+def get_template(vcenter, ova, ova_path, version, network_map, username, logger):
+    """Find the template for a version of InsightIQ, or build it if there isn't
+    one for the current OVA file.
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA of the version of InsightIQ
+    :type ova: vlab_inf_common.vmware.ova.Ova
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+
+    :param version: The version of InsightIQ
+    :type version: String
+
+    :param network_map: Which network to connect the template to while it's being built
+    :type network_map: vim.OvfManager.NetworkMapping
+
+    :param username: The user whose folder the template is built in
+    :type username: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    name = template_name(version, ova_path)
+    folder = _template_folder(vcenter)
+    template = inventory.find_vm(vcenter, folder, name)
+    if template is not None:
+        return template
+    lock_file = os.path.join(const.VLAB_INSIGHTIQ_CACHE_DIR, 'templates', '{}.lock'.format(name))
+    with FileLock(lock_file):
+        # Another process might have built it while we waited on the lock
+        template = inventory.find_vm(vcenter, folder, name)
+        if template is None:
+            logger.info('Building template {}'.format(name))
+            template = _build_template(vcenter, ova, network_map, username, name, folder, logger)
+    return template
+
+
+def template_name(version, ova_path):
+    """Every OVA file gets a unique template name. Replacing the OVA file (even
+    with the same name) results in a different template name.
+
+    :Returns: String
+
+    :param version: The version of InsightIQ
+    :type version: String
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+    """
+    stats = os.stat(ova_path)
+    identity = '{}-{}-{}'.format(stats.st_ino, stats.st_size, stats.st_mtime_ns)
+    fingerprint = hashlib.sha1(identity.encode()).hexdigest()[:8]
+    return 'insightiq-template-{}-{}'.format(version, fingerprint)
+
+
+def _template_folder(vcenter):
+    """Obtain the folder where templates are stored, making it if needed
+
+    :Returns: vim.Folder
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    try:
+        return vcenter.get_vm_folder(const.VLAB_INSIGHTIQ_TEMPLATES_DIR)
+    except FileNotFoundError:
+        vcenter.create_vm_folder(const.VLAB_INSIGHTIQ_TEMPLATES_DIR)
+        return vcenter.get_vm_folder(const.VLAB_INSIGHTIQ_TEMPLATES_DIR)
+
+
+def _build_template(vcenter, ova, network_map, username, name, folder, logger):
+    """Import the OVA, snapshot it, and turn it into a template
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA of the version of InsightIQ
+    :type ova: vlab_inf_common.vmware.ova.Ova
+
+    :param network_map: Which network to connect the template to
+    :type network_map: vim.OvfManager.NetworkMapping
+
+    :param username: The user whose folder the OVA is imported into
+    :type username: String
+
+    :param name: The name of the template
+    :type name: String
+
+    :param folder: Where to store the template
+    :type folder: vim.Folder
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    the_vm = virtual_machine.deploy_from_ova(vcenter, ova, [network_map], username,
+                                             name, logger, power_on=False)
+    try:
+        logger.debug('Taking snapshot of {}'.format(name))
+        consume_task(the_vm.CreateSnapshot_Task(name=SNAPSHOT_NAME,
+                                                description='Base disk for linked clones',
+                                                memory=False,
+                                                quiesce=False))
+        consume_task(folder.MoveIntoFolder_Task([the_vm]))
+        the_vm.MarkAsTemplate()
+    except Exception:
+        # Don't leave a half-built template lying around in the user's folder
+        consume_task(the_vm.Destroy_Task())
+        raise
+    return the_vm
@@ -0,0 +1,248 @@
+# -*- coding: UTF-8 -*-
+"""
+Uploads the disks of an OVA to an HttpNfcLease, several at a time.
+
+``Ova.deploy`` uploads one disk at a time with ``urlopen``, which reads the disk
+in whatever size blocks ``http.client`` picks, and never reads ahead; the
+upload waits on the disk, then the disk waits on the upload. Here, each disk is
+read by its own thread, ``VLAB_INSIGHTIQ_UPLOAD_READ_AHEAD`` chunks of
+``VLAB_INSIGHTIQ_UPLOAD_CHUNK`` bytes ahead of what's been sent, and
+``VLAB_INSIGHTIQ_UPLOAD_PARALLEL`` disks are uploaded at once.
+
+For every disk, how long the upload spent waiting to read the OVA versus
+sending to the host is recorded, so a slow upload shows if it's the images
+volume or the network/datastore that's slow.
+"""
+import time
+import queue
+import threading
+import http.client
+from urllib.parse import urlparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+from vlab_inf_common.ssl_context import get_context
+
+
+UploadStats = namedtuple('UploadStats', ['disk', 'size', 'seconds', 'read_wait', 'send_seconds'])
+# How often to tell vCenter the upload is still going; a lease with no progress
+# for 5 minutes is cancelled
+PROGRESS_INTERVAL = 5
+
+
+def upload_disks(lease, file_items, disks, host, parallel=2, chunk_size=1048576, read_ahead=4):
+    """Upload the disks of an OVA to the URLs of a lease
+
+    :Returns: List of UploadStats
+
+    :Raises: RuntimeError if the lease has no URL for a disk, or the host rejects a disk
+
+    :param lease: The lease of the VM being imported
+    :type lease: vim.HttpNfcLease
+
+    :param file_items: The files the import spec wants uploaded
+    :type file_items: List of vim.OvfManager.FileItem
+
+    :param disks: Maps the name of a disk in the OVA to a file object of its contents
+    :type disks: Dictionary
+
+    :param host: The name of the ESXi host to upload to; used when the lease URL has no host
+    :type host: String
+
+    :param parallel: How many disks to upload at once
+    :type parallel: Integer
+
+    :param chunk_size: How many bytes to read, and send, at a time
+    :type chunk_size: Integer
+
+    :param read_ahead: How many chunks to read before they're sent
+    :type read_ahead: Integer
+    """
+    urls = {x.importKey: x.url for x in lease.info.deviceUrl}
+    uploads = []
+    for file_item in file_items:
+        disk = disks.get(file_item.path)
+        if disk is None:
+            continue
+        url = urls.get(file_item.deviceId)
+        if url is None:
+            raise RuntimeError('Failed to find deviceUrl for file {}'.format(file_item.path))
+        uploads.append((file_item.path, disk, url.replace('*', host)))
+    # Once one disk fails, the lease is aborted; don't keep streaming the others
+    cancelled = threading.Event()
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [executor.submit(upload_disk, url, name, disk, chunk_size, read_ahead, cancelled)
+                   for name, disk, url in uploads]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [x for x in futures if x in done and x.exception() is not None]
+        if failed:
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+            raise failed[0].exception()
+    return [x.result() for x in futures]
+
+
+def upload_disk(url, name, disk, chunk_size=1048576, read_ahead=4, cancelled=None):
+    """Stream one disk to an upload URL
+
+    :Returns: UploadStats
+
+    :Raises: RuntimeError if the host rejects the disk, or the upload is cancelled
+
+    :param url: Where to upload the disk to
+    :type url: String
+
+    :param name: The name of the disk; for the stats
+    :type name: String
+
+    :param disk: The contents of the disk, with its size as a ``size`` attribute
+    :type disk: vlab_insightiq_api.lib.worker.ova_cache.TarMember
+
+    :param chunk_size: How many bytes to read, and send, at a time
+    :type chunk_size: Integer
+
+    :param read_ahead: How many chunks to read before they're sent
+    :type read_ahead: Integer
+
+    :param cancelled: Optional - Stops the upload between chunks once it's set
+    :type cancelled: threading.Event
+    """
+    if cancelled is not None and cancelled.is_set():
+        raise RuntimeError('Upload of {} cancelled'.format(name))
+    parsed = urlparse(url)
+    conn = http.client.HTTPSConnection(parsed.netloc, context=get_context())
+    started = time.time()
+    read_wait = 0
+    send_seconds = 0
+    try:
+        conn.putrequest('POST', parsed.path + ('?' + parsed.query if parsed.query else ''))
+        conn.putheader('Content-Length', str(disk.size))
+        conn.putheader('Content-Type', 'application/x-vnd.vmware-streamVmdk')
+        conn.endheaders()
+        chunks = ReadAhead(disk, chunk_size, read_ahead)
+        try:
+            while True:
+                waited = time.time()
+                chunk = chunks.next_chunk()
+                sending = time.time()
+                read_wait += sending - waited
+                if not chunk:
+                    break
+                if cancelled is not None and cancelled.is_set():
+                    raise RuntimeError('Upload of {} cancelled'.format(name))
+                conn.send(chunk)
+                send_seconds += time.time() - sending
+        finally:
+            chunks.stop()
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status not in (200, 201):
+            raise RuntimeError('Upload of {} failed: HTTP {} {}'.format(name, resp.status, resp.reason))
+    finally:
+        conn.close()
+    return UploadStats(disk=name, size=disk.size, seconds=time.time() - started,
+                       read_wait=read_wait, send_seconds=send_seconds)
+
+
+class ReadAhead(object):
+    """Reads a file in a background thread, a limited number of chunks ahead.
+
+    :param the_file: The file to read
+    :type the_file: File-like object
+
+    :param chunk_size: How many bytes to read at a time
+    :type chunk_size: Integer
+
+    :param depth: How many chunks can be read, but not yet taken
+    :type depth: Integer
+    """
+    def __init__(self, the_file, chunk_size, depth):
+        self._file = the_file
+        self._chunk_size = chunk_size
+        self._chunks = queue.Queue(maxsize=max(1, depth))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def next_chunk(self):
+        """Take the next chunk of the file. An empty chunk means the whole file was read.
+
+        :Returns: Bytes
+
+        :Raises: Whatever reading the file raised
+        """
+        chunk = self._chunks.get()
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def stop(self):
+        """Stop reading, if the file isn't done being read
+
+        :Returns: None
+        """
+        self._stopped.set()
+        # Unblock the reader, if it's waiting on a full queue
+        try:
+            while True:
+                self._chunks.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join()
+
+    def _read(self):
+        try:
+            while not self._stopped.is_set():
+                chunk = self._file.read(self._chunk_size)
+                self._put(chunk)
+                if not chunk:
+                    break
+        except Exception as doh:
+            self._put(doh)
+
+    def _put(self, item):
+        """Queue an item, unless told to stop while waiting for room"""
+        while not self._stopped.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+class LeaseProgress(object):
+    """Tells vCenter how far along an upload is, until the ``with`` block ends.
+
+    :param lease: The lease of the VM being imported
+    :type lease: vim.HttpNfcLease
+
+    :param percent: Returns how much (as an integer percent) has been uploaded
+    :type percent: Function
+
+    :param interval: How many seconds between updates
+    :type interval: Integer
+    """
+    def __init__(self, lease, percent, interval=PROGRESS_INTERVAL):
+        self._lease = lease
+        self._percent = percent
+        self._interval = interval
+        self._done = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, the_traceback):
+        self._done.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._done.wait(self._interval):
+            try:
+                self._lease.Progress(min(99, self._percent()))
+            except Exception:
+                # The lease finished, or was aborted, between checks
+                return
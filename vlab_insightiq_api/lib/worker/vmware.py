@@ -3,9 +3,35 @@
 import time
 import random
 import os.path
-from vlab_inf_common.vmware import vCenter, Ova, vim, virtual_machine, consume_task
+from functools import partial
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vCenter, vim, virtual_machine, consume_task
 
-from vlab_insightiq_api.lib import const
+from vlab_insightiq_api.lib import const, metrics
+from vlab_insightiq_api.lib.images import convert_name
+from vlab_insightiq_api.lib.worker import guest, inventory, mirror, networks, ova_cache, standby, templates
+from vlab_insightiq_api.lib.worker.session import SessionPool
+
+
+def _connect():
+    """Log into vCenter. Used by the session pool when it has no usable sessions.
+
+    :Returns: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    with metrics.vcenter_call('login'):
+        return vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
+                       password=const.INF_VCENTER_PASSWORD)
+
+
+SESSIONS = SessionPool(_connect,
+                       size=const.VLAB_INSIGHTIQ_SESSION_POOL_SIZE,
+                       keepalive=const.VLAB_INSIGHTIQ_SESSION_KEEPALIVE)
+NETWORKS = networks.NetworkIndex(ttl=const.VLAB_INSIGHTIQ_NETWORK_TTL)
+# Only started when VLAB_INSIGHTIQ_MIRROR is set
+MIRROR = mirror.InventoryMirror(_connect, const.INF_VCENTER_TOP_LVL_DIR,
+                                wait=const.VLAB_INSIGHTIQ_MIRROR_WAIT,
+                                max_age=const.VLAB_INSIGHTIQ_MIRROR_MAX_AGE,
+                                snapshot=const.VLAB_INSIGHTIQ_MIRROR_SNAPSHOT)
 
 
 def show_insightiq(username):
@@ -16,22 +42,99 @@ def show_insightiq(username):
     :param username: The user requesting info about their insightiq
     :type username: String
     """
-    insightiq_vms = {}
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for vm in folder.childEntity:
-            info = virtual_machine.get_info(vcenter, vm, username)
-            if info['meta']['component'] == 'InsightIQ':
-                insightiq_vms[vm.name] = info
-    return insightiq_vms
+    def show(vcenter):
+        with metrics.vcenter_call('show'):
+            folder = inventory.find_folder(vcenter, username)
+            return inventory.insightiq_vms(vcenter, folder, username)
 
+    return SESSIONS.run(show)
 
-def delete_insightiq(username, machine_name, logger):
-    """Unregister and destroy a user's insightiq
+
+def mirrored_insightiq(username, since):
+    """Obtain basic information about a user's InsightIQ instances from the
+    inventory mirror, instead of searching vCenter for them.
+
+    :Returns: mirror.Lookup, or None if the mirror is off or isn't current as of ``since``
+
+    :param username: The user requesting info about their insightiq
+    :type username: String
+
+    :param since: The epoch time the answer must be current as of; i.e. when the user last changed something
+    :type since: Float
+    """
+    if not const.VLAB_INSIGHTIQ_MIRROR:
+        return None
+    MIRROR.start()
+    found = MIRROR.user_vms(username, since=since)
+    if found is not None:
+        # Console URLs are single use, so they can't come from the mirror
+        add_consoles(found.data)
+    return found
+
+
+def add_consoles(vms):
+    """Give every InsightIQ instance a new console URL. The clone ticket in a
+    console URL is single use, so an answer that comes from the inventory
+    mirror needs new ones.
 
     :Returns: None
 
+    :param vms: Maps the VM name to its info, as returned by ``show_insightiq``
+    :type vms: Dictionary
+    """
+    if not vms:
+        return
+
+    def consoles(vcenter):
+        with metrics.vcenter_call('show'):
+            inventory.add_consoles(vcenter, vms)
+
+    SESSIONS.run(consoles)
+
+
+def mirrored_inventory(since):
+    """Obtain every InsightIQ instance, of every user, from this process's
+    inventory mirror, or the snapshot another process's mirror saved.
+
+    :Returns: mirror.Lookup, or None if there's no mirror or snapshot current as of ``since``
+
+    :param since: The epoch time the answer must be current as of
+    :type since: Float
+    """
+    if const.VLAB_INSIGHTIQ_MIRROR:
+        MIRROR.start()
+        found = MIRROR.owners(since=since)
+        if found is not None:
+            return found
+    if const.VLAB_INSIGHTIQ_MIRROR_SNAPSHOT:
+        # Processes that don't run a mirror can still read what another one saved
+        return mirror.read_snapshot(const.VLAB_INSIGHTIQ_MIRROR_SNAPSHOT, since=since)
+    return None
+
+
+def inventory_insightiq():
+    """Obtain every InsightIQ instance, of every user
+
+    :Returns: Dictionary of owner -> version -> VM name -> VM info
+
+    :Raises: ValueError if the vLab top level folder doesn't exist
+    """
+    def every(vcenter):
+        with metrics.vcenter_call('inventory'):
+            try:
+                top_folder = vcenter.get_vm_folder(const.INF_VCENTER_TOP_LVL_DIR)
+            except FileNotFoundError as doh:
+                raise ValueError('{}'.format(doh))
+            return inventory.every_insightiq(vcenter, top_folder)
+
+    return SESSIONS.run(every)
+
+
+def delete_insightiq(username, machine_name, logger, wait=True):
+    """Unregister and destroy a user's insightiq
+
+    :Returns: None, or the moId of the vCenter task destroying the VM when ``wait`` is False
+
     :param username: The user who wants to delete their jumpbox
     :type username: String
 
@@ -40,25 +143,154 @@ def delete_insightiq(username, machine_name, logger):
 
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
+
+    :param wait: Set to False to return as soon as vCenter starts destroying the VM
+    :type wait: Boolean
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'InsightIQ':
-                    logger.debug('powering off VM')
-                    virtual_machine.power(entity, state='off')
-                    delete_task = entity.Destroy_Task()
-                    logger.debug('blocking while VM is being destroyed')
-                    consume_task(delete_task)
-                    break
-        else:
+    with SESSIONS.session() as vcenter:
+        the_vm = _lookup_insightiq(vcenter, username, machine_name)
+        if the_vm is None:
             raise ValueError('No {} named {} found'.format('InsightIQ', machine_name))
+        logger.debug('powering off VM')
+        with metrics.vcenter_call('power_off'):
+            virtual_machine.power(the_vm, state='off')
+        delete_task = the_vm.Destroy_Task()
+        if not wait:
+            return delete_task._moId
+        logger.debug('blocking while VM is being destroyed')
+        with metrics.vcenter_call('destroy'):
+            consume_task(delete_task)
+
+
+def delete_insightiqs(username, machine_names, logger):
+    """Destroy several of a user's InsightIQ instances at the same time.
+
+    The VMs are found with one inventory query. Every VM is told to power off
+    before waiting on any of them, and then every VM is told to be destroyed
+    before waiting on any of them.
+
+    :Returns: Tuple (List, Dictionary) of the deleted VMs, and the error for
+              each VM that could not be deleted
+
+    :param username: The user who owns the InsightIQ instances
+    :type username: String
+
+    :param machine_names: The VMs to destroy. None means every InsightIQ instance the user owns.
+    :type machine_names: List
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    failed = {}
+    with SESSIONS.session() as vcenter:
+        folder = inventory.find_folder(vcenter, username)
+        with metrics.vcenter_call('find_vms'):
+            found = inventory.insightiq_objects(vcenter, folder)
+        if machine_names is None:
+            machine_names = sorted(found.keys())
+        vms = {}
+        for machine_name in machine_names:
+            if machine_name in found:
+                vms[machine_name] = found[machine_name]
+            else:
+                failed[machine_name] = 'No InsightIQ named {} found'.format(machine_name)
+
+        logger.debug('powering off {} VMs'.format(len(vms)))
+        power_tasks = {}
+        for machine_name, (the_vm, power_state) in vms.items():
+            if power_state != vim.VirtualMachinePowerState.poweredOff:
+                power_tasks[machine_name] = the_vm.PowerOffVM_Task
+        with metrics.vcenter_call('power_off'):
+            _run_tasks(power_tasks, failed)
+
+        logger.debug('destroying {} VMs'.format(len(vms)))
+        destroy_tasks = {x: y[0].Destroy_Task for x, y in vms.items() if x not in failed}
+        with metrics.vcenter_call('destroy'):
+            deleted = _run_tasks(destroy_tasks, failed)
+    for machine_name, error in failed.items():
+        logger.error('Failed to delete {}: {}'.format(machine_name, error))
+    return deleted, failed
+
+
+def _run_tasks(starters, failed):
+    """Start a batch of vCenter tasks, then wait for all of them to finish.
+
+    :Returns: List of the names whose task worked
+
+    :param starters: Maps a name to the method that starts its vCenter task
+    :type starters: Dictionary
+
+    :param failed: Updated with the error of every task that did not work
+    :type failed: Dictionary
+    """
+    started = {}
+    for name, start in starters.items():
+        try:
+            started[name] = start()
+        except vmodl.MethodFault as doh:
+            failed[name] = doh.msg
+    worked = []
+    for name, the_task in started.items():
+        try:
+            consume_task(the_task)
+        except RuntimeError as doh:
+            failed[name] = '{}'.format(doh)
+        else:
+            worked.append(name)
+    return worked
+
+
+def task_done(task_id):
+    """Check if a vCenter task has finished, without waiting on it.
+
+    :Returns: Boolean, or None if vCenter no longer knows about the task
+
+    :Raises: RuntimeError if the task failed
+
+    :param task_id: The moId of the vCenter task
+    :type task_id: String
+    """
+    def check(vcenter):
+        the_task = vim.Task(task_id, stub=vcenter._conn._stub)
+        try:
+            info = the_task.info
+        except vmodl.fault.ManagedObjectNotFound:
+            # vCenter only keeps finished tasks around for a little while
+            return None
+        if info.state == vim.TaskInfo.State.error:
+            raise RuntimeError(info.error.msg)
+        return info.state == vim.TaskInfo.State.success
 
+    return SESSIONS.run(check)
 
-def create_insightiq(username, machine_name, image, network, logger):
+
+def destroy_done(task_id, username, machine_name):
+    """Check if vCenter has finished destroying an InsightIQ instance, without
+    waiting on it. When vCenter has already forgotten the task, whether the VM
+    still exists says how the task went.
+
+    :Returns: Boolean
+
+    :Raises: RuntimeError if the VM could not be destroyed
+
+    :param task_id: The moId of the vCenter task destroying the VM
+    :type task_id: String
+
+    :param username: The user who owns the InsightIQ instance
+    :type username: String
+
+    :param machine_name: The name of the InsightIQ instance
+    :type machine_name: String
+    """
+    done = task_done(task_id)
+    if done is not None:
+        return done
+    if SESSIONS.run(_lookup_insightiq, username, machine_name) is not None:
+        raise RuntimeError('Failed to destroy {}'.format(machine_name))
+    return True
+
+
+def create_insightiq(username, machine_name, image, network, logger, progress=None, written=None):
     """Deploy a new instance of InsightIQ
 
     :Returns: Dictionary
@@ -77,65 +309,315 @@ def create_insightiq(username, machine_name, image, network, logger):
 
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
+
+    :param progress: Optional - Called with the phase of the deploy (and a percent, when known) as it changes
+    :type progress: Function
+
+    :param written: Optional - Called once nothing more is written to the datastore, so the admission slot can go to the next deploy
+    :type written: Function
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        image_name = convert_name(image)
-        try:
-            ova = Ova(os.path.join(const.VLAB_INSIGHTIQ_IMAGES_DIR, image_name))
-        except FileNotFoundError:
-            error = 'Invalid version of InsightIQ: {}'.format(image)
-            raise ValueError(error)
+    with SESSIONS.session() as vcenter:
+        if standby.enabled(image):
+            info = _from_standby(vcenter, image, network, username, machine_name, logger, progress, written)
+            if info is not None:
+                return {machine_name: info}
+            logger.info('No standby VMs of InsightIQ {} are ready, deploying a new one'.format(image))
+        ova_path, ova = _open_image(image)
         try:
-            network_map = vim.OvfManager.NetworkMapping()
-            network_map.name = ova.networks[0]
-            try:
-                network_map.network = vcenter.networks[network]
-            except KeyError:
-                raise ValueError('No such network named {}'.format(network))
-            the_vm = virtual_machine.deploy_from_ova(vcenter, ova, [network_map],
-                                                     username, machine_name, logger)
+            network_map = _network_map(vcenter, ova, network)
+            info = _deploy(vcenter, ova, ova_path, image, network_map, username, machine_name, logger, progress, written)
         finally:
             ova.close()
-        meta_data = {'component' : "InsightIQ",
-                     'created': time.time(),
-                     'version': image,
-                     'configured': False,
-                     'generation': 1,
-                    }
-        virtual_machine.set_meta(the_vm, meta_data)
-        info = virtual_machine.get_info(vcenter, the_vm, username, ensure_ip=True)
-        return {the_vm.name: info}
+        return {machine_name: info}
 
 
-def list_images():
-    """Obtain a list of available versions of insightiq that can be created
+def _no_progress(phase, percent=None):
+    """The ``progress`` callback of a deploy that no one is following"""
+    pass
 
-    :Returns: List
+
+def _from_standby(vcenter, image, network, username, machine_name, logger, progress=None, written=None):
+    """Give the user an already booted standby VM, instead of deploying a new one
+
+    :Returns: Dictionary, or None if there are no standby VMs of the version
+
+    :Raises: ValueError if the network does not exist, or the user already has a VM with that name
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param image: The image/version of InsightIQ
+    :type image: String
+
+    :param network: The name of the network to connect the VM to
+    :type network: String
+
+    :param username: The name of the user who wants a new InsightIQ instance
+    :type username: String
+
+    :param machine_name: The name of the new InsightIQ instance
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param progress: Optional - Called with the phase of the deploy (and a percent, when known) as it changes
+    :type progress: Function
+
+    :param written: Optional - Called once nothing more is written to the datastore, so the admission slot can go to the next deploy
+    :type written: Function
     """
-    images = os.listdir(const.VLAB_INSIGHTIQ_IMAGES_DIR)
-    images = [convert_name(x, to_version=True) for x in images]
-    return images
+    if progress is None:
+        progress = _no_progress
+    # Check everything that could fail before taking a VM out of the pool
+    try:
+        the_network = NETWORKS.lookup(vcenter, network)
+    except KeyError:
+        raise ValueError('No such network named {}'.format(network))
+    folder = inventory.find_folder(vcenter, username)
+    if inventory.find_vm(vcenter, folder, machine_name) is not None:
+        raise ValueError('A VM named {} already exists'.format(machine_name))
+    progress('claiming standby')
+    with metrics.vcenter_call('claim_standby'):
+        the_vm = standby.claim(vcenter, image, username, machine_name, logger)
+    if the_vm is None:
+        return None
+    if written is not None:
+        written()
+    # The IP it got on the holding network doesn't count as the VM having an IP
+    old_ips = inventory.get_ips(the_vm.guest.net)
+    progress('changing network')
+    with metrics.vcenter_call('change_network'):
+        virtual_machine.change_network(the_vm, the_network)
+    return _finish(vcenter, the_vm, image, username, progress, ignore_ips=old_ips)
+
+
+def _open_image(image):
+    """Open the OVA for a version of InsightIQ
+
+    :Returns: Tuple (String, vlab_insightiq_api.lib.worker.ova_cache.CachedOva)
+
+    :Raises: ValueError if the version does not exist, or the OVA is corrupted
+
+    :param image: The image/version of InsightIQ
+    :type image: String
+    """
+    ova_path = os.path.join(const.VLAB_INSIGHTIQ_IMAGES_DIR, convert_name(image))
+    try:
+        ova = ova_cache.open_ova(ova_path)
+    except FileNotFoundError:
+        error = 'Invalid version of InsightIQ: {}'.format(image)
+        raise ValueError(error)
+    return ova_path, ova
+
+
+def _network_map(vcenter, ova, network):
+    """Map the network defined in the OVA to a network in vCenter
+
+    :Returns: vim.OvfManager.NetworkMapping
+
+    :Raises: ValueError if the network does not exist
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA of InsightIQ
+    :type ova: vlab_inf_common.vmware.ova.Ova
+
+    :param network: The name of the network in vCenter
+    :type network: String
+    """
+    network_map = vim.OvfManager.NetworkMapping()
+    network_map.name = ova.networks[0]
+    try:
+        network_map.network = NETWORKS.lookup(vcenter, network)
+    except KeyError:
+        raise ValueError('No such network named {}'.format(network))
+    return network_map
+
+
+def _deploy(vcenter, ova, ova_path, image, network_map, username, machine_name, logger, progress=None, written=None):
+    """Create, power on, and tag one instance of InsightIQ
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The opened OVA to deploy
+    :type ova: vlab_inf_common.vmware.ova.Ova
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+
+    :param image: The image/version of InsightIQ
+    :type image: String
+
+    :param network_map: Which network to connect the new VM to
+    :type network_map: vim.OvfManager.NetworkMapping
 
+    :param username: The name of the user who wants a new InsightIQ instance
+    :type username: String
 
-def convert_name(name, to_version=False):
-    """This function centralizes converting between the name of the OVA, and the
-    version of software it contains.
+    :param machine_name: The name of the new InsightIQ instance
+    :type machine_name: String
 
-    The naming convention for the InsightIQ OVAs is "InsightIQ_<VERSION>.ova".
-    For example IIQ 3.1.1 is named "InsightIQ_3.1.1.ova".
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
 
-    :param name: The thing to covert
-    :type name: String
+    :param progress: Optional - Called with the phase of the deploy (and a percent, when known) as it changes
+    :type progress: Function
 
-    :param to_version: Set to True to covert the name of an OVA to the version
-    :type to_version: Boolean
+    :param written: Optional - Called once nothing more is written to the datastore, so the admission slot can go to the next deploy
+    :type written: Function
     """
-    if to_version:
-        return name.split('_')[-1].rstrip('.ova')
+    if progress is None:
+        progress = _no_progress
+    if const.VLAB_INSIGHTIQ_LINKED_CLONES:
+        progress('cloning')
+        with metrics.vcenter_call('linked_clone'):
+            the_vm = templates.linked_clone(vcenter, ova, ova_path, image, network_map,
+                                            username, machine_name, logger)
+        if written is not None:
+            written()
     else:
-        return 'InsightIQ_{}.ova'.format(name)
+        progress('uploading', 0)
+        ova.on_progress = partial(progress, 'uploading')
+        started = time.time()
+        with metrics.vcenter_call('deploy_from_ova'):
+            the_vm = virtual_machine.deploy_from_ova(vcenter, ova, [network_map],
+                                                     username, machine_name, logger, power_on=False)
+        metrics.record_upload(ova.size, time.time() - started)
+        if written is not None:
+            written()
+        for stats in getattr(ova, 'upload_stats', []):
+            mib = stats.size / 1048576
+            logger.info('Uploaded {} ({:.0f} MiB) in {:.1f}s; {:.1f} MiB/s, {:.1f}s waiting on the OVA, {:.1f}s sending'.format(
+                        stats.disk, mib, stats.seconds, mib / max(stats.seconds, 0.001), stats.read_wait, stats.send_seconds))
+        progress('powering on')
+        with metrics.vcenter_call('power_on'):
+            virtual_machine.power(the_vm, state='on')
+    return _finish(vcenter, the_vm, image, username, progress)
+
+
+def _finish(vcenter, the_vm, image, username, progress, ignore_ips=()):
+    """Tag a powered on instance of InsightIQ, and wait for it to get an IP.
+    With ``VLAB_INSIGHTIQ_IP_AT_POWER_ON`` set, it doesn't wait for the IP.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The new InsightIQ instance
+    :type the_vm: vim.VirtualMachine
+
+    :param image: The image/version of InsightIQ
+    :type image: String
+
+    :param username: The name of the user who owns the InsightIQ instance
+    :type username: String
+
+    :param progress: Called with the phase of the deploy as it changes
+    :type progress: Function
+
+    :param ignore_ips: Optional - IPs that don't count as the VM having an IP
+    :type ignore_ips: List
+    """
+    meta_data = {'component' : "InsightIQ",
+                 'created': time.time(),
+                 'version': image,
+                 'configured': False,
+                 'generation': 1,
+                }
+    progress('setting meta')
+    with metrics.vcenter_call('set_meta'):
+        virtual_machine.set_meta(the_vm, meta_data)
+    if not const.VLAB_INSIGHTIQ_IP_AT_POWER_ON:
+        progress('waiting for IP')
+        with metrics.vcenter_call('wait_for_ip'):
+            guest.wait_for_ip(vcenter, the_vm, const.VLAB_INSIGHTIQ_IP_TIMEOUT, ignore=ignore_ips)
+    return inventory.vm_info(vcenter, the_vm, username)
+
+
+def wait_for_ip(username, machine_name):
+    """Wait for an InsightIQ instance to get an IP. Used to fill in the IP of a
+    deploy that returned as soon as the VM was powered on.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError if the instance does not exist
 
+    :param username: The name of the user who owns the InsightIQ instance
+    :type username: String
+
+    :param machine_name: The name of the InsightIQ instance
+    :type machine_name: String
+    """
+    def wait(vcenter):
+        the_vm = _lookup_insightiq(vcenter, username, machine_name)
+        if the_vm is None:
+            error = 'No VM named {} found'.format(machine_name)
+            raise ValueError(error)
+        with metrics.vcenter_call('wait_for_ip'):
+            guest.wait_for_ip(vcenter, the_vm, const.VLAB_INSIGHTIQ_IP_TIMEOUT)
+        return {machine_name: inventory.vm_info(vcenter, the_vm, username)}
+
+    return SESSIONS.run(wait)
+
+
+def refill_standby(image, logger, written=None):
+    """Deploy one standby VM of a version of InsightIQ, if there are fewer than
+    ``VLAB_INSIGHTIQ_STANDBY_SIZE`` of them.
+
+    Deploying the whole pool at once could take longer than the time limit of
+    a task, so each call only deploys one VM; call it again until it returns
+    an empty list.
+
+    :Returns: List of the names of the new standby VMs
+
+    :Raises: ValueError if the image or holding network does not exist
+
+    :param image: The image/version of InsightIQ
+    :type image: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param written: Optional - Called once nothing more is written to the datastore, so the admission slot can go to the next deploy
+    :type written: Function
+    """
+    if not standby.enabled(image):
+        return []
+    with standby.refill_lock(image) as lock:
+        if not lock.held:
+            logger.info('Standby VMs of InsightIQ {} are already being refilled'.format(image))
+            return []
+        with SESSIONS.session() as vcenter:
+            holding_folder = standby.folder(vcenter)
+            missing = const.VLAB_INSIGHTIQ_STANDBY_SIZE - len(standby.find_standby(vcenter, holding_folder, image))
+            if missing <= 0:
+                return []
+            logger.info('Deploying 1 of {} missing standby VMs of InsightIQ {}'.format(missing, image))
+            ova_path, ova = _open_image(image)
+            try:
+                network_map = _network_map(vcenter, ova, const.VLAB_INSIGHTIQ_STANDBY_NETWORK)
+                machine_name = standby.standby_name(image)
+                _deploy(vcenter, ova, ova_path, image, network_map,
+                        const.VLAB_INSIGHTIQ_STANDBY_FOLDER, machine_name, logger, written=written)
+            finally:
+                ova.close()
+    return [machine_name]
+
+
+def list_images():
+    """Obtain a list of available versions of insightiq that can be created
+
+    :Returns: List
+    """
+    images = os.listdir(const.VLAB_INSIGHTIQ_IMAGES_DIR)
+    images = [convert_name(x, to_version=True) for x in images]
+    return images
 
 
 def update_network(username, machine_name, new_network):
@@ -150,23 +632,62 @@ def update_network(username, machine_name, new_network):
     :param new_network: The name of the new network to connect the VM to
     :type new_network: String
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'InsightIQ':
-                    the_vm = entity
-                    break
-        else:
+    with SESSIONS.session() as vcenter:
+        the_vm = _lookup_insightiq(vcenter, username, machine_name)
+        if the_vm is None:
             error = 'No VM named {} found'.format(machine_name)
             raise ValueError(error)
 
         try:
-            network = vcenter.networks[new_network]
+            network = NETWORKS.lookup(vcenter, new_network)
         except KeyError:
             error = 'No VM named {} found'.format(machine_name)
             raise ValueError(error)
         else:
-            virtual_machine.change_network(the_vm, network)
+            with metrics.vcenter_call('change_network'):
+                virtual_machine.change_network(the_vm, network)
+
+
+def _lookup_insightiq(vcenter, username, machine_name):
+    """Look up a user's InsightIQ instance, from the inventory mirror when it's
+    on. A VM the mirror doesn't know about (i.e. one that was just made) is
+    searched for in vCenter.
+
+    :Returns: vim.VirtualMachine or None
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The user who owns the InsightIQ instance
+    :type username: String
+
+    :param machine_name: The name of the InsightIQ instance
+    :type machine_name: String
+    """
+    if const.VLAB_INSIGHTIQ_MIRROR:
+        MIRROR.start()
+        the_vm = MIRROR.find_vm(vcenter, username, machine_name)
+        if the_vm is not None:
+            return the_vm
+    folder = inventory.find_folder(vcenter, username)
+    return _find_insightiq(vcenter, folder, machine_name)
+
+
+def _find_insightiq(vcenter, folder, machine_name):
+    """Look up an InsightIQ instance by name
+
+    :Returns: vim.VirtualMachine or None
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The user's VM folder
+    :type folder: vim.Folder
+
+    :param machine_name: The name of the InsightIQ instance
+    :type machine_name: String
+    """
+    the_vm = inventory.find_vm(vcenter, folder, machine_name)
+    if the_vm is not None and inventory.get_meta(vcenter, the_vm)['component'] == 'InsightIQ':
+        return the_vm
+    return None